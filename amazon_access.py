@@ -1,9 +1,11 @@
 import dask.dataframe as dd
 import pandas as pd
+import numpy as np
 import os
-from ast import literal_eval
 import pickle
 import copy
+from hierarchy_store import edges_to_store, save_edge_store, load_edge_store, load_hierarchy, hier_roots
+from tree_catalog import build_catalog, catalog_path_for
 
 '''
 Purpose: analyze the Amazon access dataset's role hierarchy,
@@ -42,22 +44,18 @@ class kTree:
         child_trees = [c.tree2dict() for c in self.children]
         return {self.person : child_trees}
     
+    #depth and size go through tree_stats, which walks the tree iteratively,
+    #so these work on management chains deeper than the recursion limit.
     def max_depth(self):
-        if self.children == []:
-            return 1 #only the root of this tree
-        
-        return 1 + max([c.max_depth() for c in self.children])
+        return tree_stats(self)['max_depth']
     
     def min_depth(self):
-        if self.children == []:
-            return 1 #only the root of this tree
-        
-        return 1 + min([c.max_depth() for c in self.children])
+        #shallowest leaf. this used to recurse into max_depth by mistake,
+        #which gave 1 + the smallest max depth among the children instead.
+        return tree_stats(self)['min_depth']
     
     def num_nodes(self):
-        if self.children == []:
-            return 1
-        return 1 + sum([c.num_nodes() for c in self.children])
+        return tree_stats(self)['nodes']
     
     def contains(self, person_value):
         if self.person == person_value:
@@ -69,10 +67,97 @@ class kTree:
         
         return False
 
-def read_amazon(fpath):
-    df = dd.read_csv(fpath, sample=10000000)
+def read_amazon(fpath, usecols=None, blocksize='64MB'):
+    df = dd.read_csv(fpath, sample=10000000, usecols=usecols, blocksize=blocksize)
     return df
 
+class UniqueRows:
+    '''
+    Running drop_duplicates over a stream of dataframe chunks, keeping first occurrences in stream order.
+    New chunks are deduplicated on their own and queued; the queue is only merged once it has grown past
+    the size of the last merge, so the total work stays linear and memory stays within about twice the unique rows.
+    With counted=True, the result also has a 'count' column: how many rows each unique row stood for.
+    '''
+    def __init__(self, counted=False):
+        self.frames = []
+        self.queued = 0
+        self.merged = 0
+        self.counted = counted
+    
+    def _dedup(self, df):
+        if not self.counted:
+            return df.drop_duplicates()
+        cols = [c for c in df.columns if c != 'count']
+        if 'count' not in df.columns:
+            df = df.assign(count=1)
+        return df.groupby(cols, sort=False, dropna=False)['count'].sum().reset_index()
+    
+    def add(self, chunk):
+        chunk = self._dedup(chunk)
+        self.frames.append(chunk)
+        self.queued += len(chunk)
+        if self.queued > max(self.merged, 1 << 20):
+            self.compact()
+    
+    def compact(self):
+        if len(self.frames) > 1:
+            self.frames = [self._dedup(pd.concat(self.frames, ignore_index=True))]
+        self.merged = sum(len(f) for f in self.frames)
+        self.queued = 0
+    
+    def result(self, columns):
+        self.compact()
+        if self.frames == []:
+            return pd.DataFrame(columns=columns + ['count'] if self.counted else columns)
+        return self.frames[0].reset_index(drop=True)
+
+def stream_person_con(fpath, outpath='amazon_raw_userhierarchy', resource_col=None, role_col='id', blocksize='64MB'):
+    '''
+    Out-of-core version of get_person_con for access logs too big for memory.
+    The CSV is read one dask partition at a time, and only the distinct (id, MGR_ID) edges are kept,
+    in order of first appearance. They are written as an edge store (see hierarchy_store).
+    When the data has no repeated rows, the store holds exactly the raw_adj_lst of get_person_con;
+    otherwise each repeated edge is listed once. The Added/Missed counts are still per row,
+    like get_person_con's: every edge keeps a count of the rows it came from.
+    
+    With resource_col (e.g., 'RESOURCE'), the same pass also collects the distinct (role_col, resource_col) pairs,
+    i.e. which resources each person (or each ROLE_TITLE, etc.) accessed. They are saved to outpath + '_resources.npz'.
+    Memory use depends on the number of distinct edges and pairs, not on the number of rows.
+    '''
+    fields = ['id', 'MGR_ID']
+    if resource_col is not None:
+        fields = fields + [c for c in [role_col, resource_col] if c not in fields]
+    ddf = read_amazon(fpath, usecols=fields, blocksize=blocksize)
+    
+    edges = UniqueRows(counted=True)
+    accesses = UniqueRows()
+    for part in ddf.to_delayed():
+        chunk = part.compute()
+        edges.add(chunk[['id', 'MGR_ID']])
+        if resource_col is not None:
+            accesses.add(chunk[[role_col, resource_col]])
+    
+    edge_df = edges.result(['id', 'MGR_ID'])
+    p_ids = edge_df['id'].to_numpy()
+    mgr_ids = edge_df['MGR_ID'].to_numpy()
+    row_cnt = edge_df['count'].to_numpy()
+    add_cnt = int(row_cnt[np.isin(mgr_ids, p_ids)].sum())
+    print("Added " + str(add_cnt) + " Nodes")
+    print("Missed " + str(int(row_cnt.sum()) - add_cnt) + " Nodes")
+    
+    save_edge_store(outpath, edges_to_store(p_ids, mgr_ids))
+    if resource_col is not None:
+        access_df = accesses.result([role_col, resource_col])
+        np.savez(outpath + '_resources.npz', role=access_df[role_col].to_numpy(), resource=access_df[resource_col].to_numpy())
+    
+    return load_edge_store(outpath)
+
+def load_resource_sets(fpath):
+    #the (role, resource) pairs saved by stream_person_con, as a set of resources per role
+    with np.load(fpath, allow_pickle=True) as data:
+        access_df = pd.DataFrame({'role' : data['role'], 'resource' : data['resource']})
+    return {k : set(v) for k, v in access_df.groupby('role')['resource']}
+
 #we only want the person columns of the amazon accesses, nothing else
 def read_amazon_roles(fpath):
     fields = ['id', 'MGR_ID', 'ROLE_TITLE']
@@ -140,7 +225,48 @@ def add_nodes(row, raw_adj_lst, roledf):
     return raw_adj_lst, True
         
 
-def get_person_con(fpath):
+def build_adj_lst_scan(df):
+    #the original per-row path: every row scans the whole roles dataframe for its manager,
+    #so this is quadratic in the number of rows. kept around for benchmarking against build_adj_lst.
+    raw_adj_lst = {}
+    add_cnt = 0
+    miss_cnt = 0
+    for row in df.to_dict(orient='records'):
+        raw_adj_lst, add_flag = add_nodes(row, raw_adj_lst, df)
+        if add_flag:
+            add_cnt += 1
+        else:
+            miss_cnt += 1
+    
+    return raw_adj_lst, add_cnt, miss_cnt
+
+def build_adj_lst(df):
+    '''
+    Indexed version of build_adj_lst_scan.
+    add_nodes only uses the manager lookup to decide whether a row counts as added or missed;
+    the adjacency update is the same either way. So we compute manager-ID membership
+    among person IDs once, as a vectorized isin, and then fill the lists in one linear pass.
+    Key order and list order match the scan path exactly.
+    '''
+    p_ids = df['id'].to_numpy()
+    mgr_ids = df['MGR_ID'].to_numpy()
+    has_mgr = np.isin(mgr_ids, p_ids)
+    add_cnt = int(has_mgr.sum())
+    miss_cnt = len(has_mgr) - add_cnt
+    
+    raw_adj_lst = {}
+    for p_id, mgr_id in zip(p_ids.tolist(), mgr_ids.tolist()):
+        if p_id not in raw_adj_lst:
+            raw_adj_lst[p_id] = {'parent' : [], 'child' : []}
+        raw_adj_lst[p_id]['child'].append(mgr_id)
+        
+        if mgr_id not in raw_adj_lst:
+            raw_adj_lst[mgr_id] = {'parent' : [], 'child' : []}
+        raw_adj_lst[mgr_id]['parent'].append(p_id)
+    
+    return raw_adj_lst, add_cnt, miss_cnt
+
+def get_person_con(fpath, method='indexed', outpath='amazon_raw_userhierarchy.json'):
     #keys are integer indices
     #each key will have a dictionary with key 'parent'
     #and a dictionary with key 'child'
@@ -150,30 +276,34 @@ def get_person_con(fpath):
     
     #procedure: first, construct the raw adjacency list for people
     #then, construct the role hierarchy from that using people's role codes.
-    #that's cleaner than trying to do both at the same time. Also, the dataset is small enough that efficiency
-    #will not be a problem.
-    
-    raw_adj_lst = {}
+    #that's cleaner than trying to do both at the same time.
+    #method='scan' is the original row-by-row lookup, which is quadratic and only usable on test.csv.
+    #method='indexed' gives the same adjacency list in near-linear time (see build_adj_lst).
+    #an outpath ending in .json gets the old repr dump; anything else is written as an edge store directory
+    #(see hierarchy_store), which loads much faster than literal_eval.
     
     df = read_amazon_roles(fpath)
-    add_cnt = 0
-    miss_cnt = 0
-    for row in df.to_dict(orient='records'):
-        raw_adj_lst, add_flag = add_nodes(row, raw_adj_lst, df)
-        if add_flag:
-            add_cnt += 1
-        else:
-            miss_cnt += 1
+    if method == 'indexed':
+        raw_adj_lst, add_cnt, miss_cnt = build_adj_lst(df)
+    elif method == 'scan':
+        raw_adj_lst, add_cnt, miss_cnt = build_adj_lst_scan(df)
+    else:
+        raise Exception("Unknown adjacency method: {}".format(method))
     
     print("Added " + str(add_cnt) + " Nodes")
     print("Missed " + str(miss_cnt) + " Nodes")
     
-    with open('amazon_raw_userhierarchy.json', 'w+') as fh:
-        print(raw_adj_lst, file=fh)
+    if outpath.endswith('.json'):
+        with open(outpath, 'w+') as fh:
+            print(raw_adj_lst, file=fh)
+    else:
+        save_edge_store(outpath, edges_to_store(df['id'].to_numpy(), df['MGR_ID'].to_numpy()))
+    
+    return raw_adj_lst
 
 def more_than_two(hier : dict):
     path_cnt = 0
-    all_nodes = copy.deepcopy(list(hier.keys()))
+    all_nodes = set(hier.keys())
     for k in hier:
         if k not in all_nodes: #already counted
             continue
@@ -193,22 +323,113 @@ def more_than_two(hier : dict):
         if ancestor_exists or descendant_exists:
             path_cnt += 1
         
-        all_nodes = [a for a in all_nodes if a != k]
+        all_nodes.discard(k)
     
     print("Number of nodes in a path of length greater than 2: {}".format(path_cnt))
     return path_cnt
         
 
+def hier_edge_arrays(hier):
+    #the hierarchy as arrays: its keys, and (person, manager) edges as positions into the keys.
+    #an edge store already has the edges as arrays; a raw_adj_lst dictionary needs one pass over its 'child' lists.
+    if hasattr(hier, 'lookup'):
+        return np.asarray(hier.nodes), hier.lookup(hier.person), hier.lookup(hier.manager)
+    
+    nodes = list(hier.keys())
+    pos = {k : i for i, k in enumerate(nodes)}
+    p_idx = []
+    m_idx = []
+    for k in nodes:
+        for m in hier[k]['child']:
+            p_idx.append(pos[k])
+            m_idx.append(pos[m])
+    return np.array(nodes), np.array(p_idx, dtype=np.int64), np.array(m_idx, dtype=np.int64)
+
+def expand_ranges(ptr, idx):
+    #concatenation of ptr[i]..ptr[i+1] for every i in idx, without a Python loop
+    starts = ptr[idx]
+    counts = ptr[idx + 1] - starts
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return offsets + np.arange(counts.sum())
+
+def longest_levels(n, src, dst):
+    '''
+    Longest path, counted in nodes, from any source (a node with no incoming edge) to every node,
+    over the edges src -> dst. This is level-synchronous: each round takes every node whose
+    incoming edges are all settled, and pushes its level along its outgoing edges in one vectorized step.
+    Nodes on a cycle, or below one, are never settled and get -1.
+    '''
+    order = np.argsort(src, kind='stable')
+    out_dst = dst[order]
+    out_ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=out_ptr[1:])
+    
+    waiting = np.bincount(dst, minlength=n)
+    level = np.full(n, -1, dtype=np.int64)
+    frontier = np.flatnonzero(waiting == 0)
+    level[frontier] = 1
+    best = np.ones(n, dtype=np.int64)
+    slot = np.empty(n, dtype=np.int64)
+    while len(frontier):
+        edges = expand_ranges(out_ptr, frontier)
+        targets = out_dst[edges]
+        np.maximum.at(best, targets, np.repeat(level[frontier], out_ptr[frontier + 1] - out_ptr[frontier]) + 1)
+        np.subtract.at(waiting, targets, 1)
+        
+        #nodes settled this round, each once (a node can be the target of several edges)
+        settled = targets[waiting[targets] == 0]
+        slot[settled] = np.arange(len(settled))
+        frontier = settled[slot[settled] == np.arange(len(settled))]
+        level[frontier] = best[frontier]
+    return level
+
+def path_length_analysis(hier):
+    '''
+    For every person in the raw hierarchy:
+    Depth: the longest management chain above them, counted in nodes (a person with no manager has depth 1).
+    Height: the longest chain of reports below them, also in nodes (a person with no reports has height 1).
+    Longest Chain: the longest chain through them, Depth + Height - 1.
+    Self-loops are ignored. People on a management cycle, below one (their depth is unbounded)
+    or above one (their height is unbounded) get -1 for all three.
+    '''
+    nodes, p_idx, m_idx = hier_edge_arrays(hier)
+    no_loop = p_idx != m_idx
+    p_idx = p_idx[no_loop]
+    m_idx = m_idx[no_loop]
+    
+    depth = longest_levels(len(nodes), m_idx, p_idx)
+    height = longest_levels(len(nodes), p_idx, m_idx)
+    chain = np.where((depth > 0) & (height > 0), depth + height - 1, -1)
+    depth[chain < 0] = -1
+    height[chain < 0] = -1
+    return pd.DataFrame({'Node' : nodes, 'Depth' : depth, 'Height' : height, 'Longest Chain' : chain})
+
+def chain_length_counts(path_df):
+    #for every k, the number of people on some chain of at least k nodes
+    chain = path_df['Longest Chain'].to_numpy()
+    chain = chain[chain > 0]
+    at_least = np.cumsum(np.bincount(chain)[::-1])[::-1]
+    return pd.DataFrame({'Path Length' : np.arange(1, len(at_least)), 'Nodes' : at_least[1:]})
+
 #Purpose: gauge whether this hierarchy is interesting.
 #a hierarchy is interesting if it has a high number of paths greater than length 2.
 #so, print all length-2 paths, and their count.
-def analyze_hierarchy(hier_path):
+#mode='count' is the original single count from more_than_two.
+#mode='distribution' returns the per-person depth and chain lengths from path_length_analysis,
+#and prints how many people are on a chain of each length.
+def analyze_hierarchy(hier_path, mode='count'):
+    
+    hier = load_hierarchy(hier_path)
     
-    hier = literal_eval(open(hier_path, 'r').read())
+    if mode == 'distribution':
+        path_df = path_length_analysis(hier)
+        print(chain_length_counts(path_df).to_string(index=False))
+        return path_df
     
     #actually, do something simple. just check for paths with length greater than 2.
     longpath_cnt = more_than_two(hier)
     print(longpath_cnt)
+    return longpath_cnt
 
 #whatever goes up...
 def traverse_parents(tree, hier, k, all_nodes):
@@ -254,29 +475,54 @@ def traverse_children(tree, hier, k, all_nodes):
     
     return new_tree, all_nodes
 
-def extract_hierarchy(hier_path):
-    '''
-    Design: we can use memory, so let us just construct the trees.
-    we will anyway want to do this to understand the hierarchy.
-    If we construct them in a depth-first fashion, we should avoid the need to 
-    merge disjoint trees we found, etc.
+#iterative version of traverse_children, for deep management chains.
+#visited is a set instead of the all_nodes list, and subtrees are built in place
+#rather than deep-copied into their parent, so the whole walk is O(nodes + edges).
+def traverse_children_iter(hier, k, visited):
+    root = kTree(k)
+    visited.add(k)
+    
+    #each stack entry is a tree and an iterator over the people it still has to visit.
+    #a person is checked against visited only when we reach it, exactly like the recursive version,
+    #so the forests come out the same tree for tree.
+    stack = [(root, iter(hier[k]['parent']))]
+    while stack:
+        cur_tree, hier_parents = stack[-1]
+        for p in hier_parents:
+            if p in visited:
+                continue
+            visited.add(p)
+            p_tree = kTree(p)
+            cur_tree.children.append(p_tree)
+            stack.append((p_tree, iter(hier[p]['parent'])))
+            break
+        else:
+            stack.pop()
     
-    So the procedure is: given a copy of the nodes, start with some node. follow the parents of that node.
-    then follow the children of that node. remove the nodes as you follow them.
-    once there are no more to follow, look at your list of remaining nodes. follow the next one.
-    if we do this, we can construct a spanning forest for the graph. each tree will be a hierarchy we can use.
+    return root
+
+def extract_forest(hier, method='iterative'):
+    #see extract_hierarchy. method='recursive' is the original traversal, which is quadratic
+    #and can hit the recursion limit, so it is only kept for comparison.
+    #only the count: listing every root floods the output (and the timings) on big hierarchies
+    roots = hier_roots(hier)
+    print("Roots: {}".format(len(roots)))
+    tree_dct = {}
+    tree_cnt = 0
     
-    UPDATE: the problem with this is if you traverse the whole graph when searching for parents.
-    Instead, let us make use of the fact that there are managers with no manager (naturally).
-    we will use these as root nodes, and find all children.
-    '''
+    if method == 'iterative':
+        visited = set()
+        for k in roots:
+            if k in visited:
+                continue
+            tree_dct[tree_cnt] = traverse_children_iter(hier, k, visited)
+            tree_cnt += 1
+        return tree_dct
+    
+    if method != 'recursive':
+        raise Exception("Unknown extraction method: {}".format(method))
     
-    hier = literal_eval(open(hier_path, 'r').read())
-    roots = [k for k in hier if hier[k]['child'] == []]
-    print("Roots: {}".format(roots))
     all_nodes = copy.deepcopy(list(hier.keys()))
-    tree_dct = {}
-    tree_cnt = 0
     for k in roots:
         if k not in all_nodes:
             continue
@@ -300,29 +546,119 @@ def extract_hierarchy(hier_path):
     
     return tree_dct
 
+def extract_hierarchy(hier_path, method='iterative', outpath=None, jobs=1):
+    '''
+    Design: we can use memory, so let us just construct the trees.
+    we will anyway want to do this to understand the hierarchy.
+    If we construct them in a depth-first fashion, we should avoid the need to 
+    merge disjoint trees we found, etc.
+    
+    So the procedure is: given a copy of the nodes, start with some node. follow the parents of that node.
+    then follow the children of that node. remove the nodes as you follow them.
+    once there are no more to follow, look at your list of remaining nodes. follow the next one.
+    if we do this, we can construct a spanning forest for the graph. each tree will be a hierarchy we can use.
+    
+    UPDATE: the problem with this is if you traverse the whole graph when searching for parents.
+    Instead, let us make use of the fact that there are managers with no manager (naturally).
+    we will use these as root nodes, and find all children.
+    
+    UPDATE 2: the traversal is now iterative by default (traverse_children_iter), with a visited set
+    instead of filtering all_nodes at every step. it gives the same forest in O(nodes + edges).
+    
+    If outpath is given (e.g., amazon_spanningforest.pkl), the forest is pickled there, and the tree catalog
+    next to it (amazon_spanningforest_catalog.db, see tree_catalog.py) is rebuilt to match.
+    
+    With jobs > 1, the trees are extracted across that many processes (see parallel_forest.py, iterative only),
+    and the forest comes back as the ForestStore the workers' arrays make up: its trees are kTreeViews,
+    which stand in for kTree everywhere downstream. It is pickled (and catalogued) as arrays,
+    so no kTree is built in this process.
+    '''
+    
+    if jobs > 1:
+        if method != 'iterative':
+            raise Exception("Only the iterative method runs across processes, not {} with jobs={}".format(method, jobs))
+        from parallel_forest import parallel_extract_forest
+        spanning_forest = parallel_extract_forest(hier_path, jobs=jobs)
+    else:
+        hier = load_hierarchy(hier_path)
+        spanning_forest = extract_forest(hier, method=method)
+    if outpath is not None:
+        with open(outpath, 'wb') as fh:
+            pickle.dump(spanning_forest, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        build_catalog(spanning_forest, forest_stats(spanning_forest, jobs=jobs), catalog_path_for(outpath))
+    return spanning_forest
+
 def person2roles(fpath, tree):
     df = read_amazon_roles(fpath)
 
-def print_tree_stats(forest):
-    out_schema = ['Key', 'Max Depth', 'Min Depth', 'Nodes']
+def tree_stats(tree):
+    '''
+    All the per-tree statistics in one iterative, level-by-level pass:
+    max and min depth (counted in nodes, so a lone root has depth 1, and min depth is the shallowest leaf),
+    node count, leaf count, the fan-out histogram (entry i counts nodes with i children),
+    and the width of every level, root first.
+    Works on kTree and on anything with the same children attribute, e.g., kTreeView.
+    '''
+    level = [tree]
+    level_widths = []
+    fanout_hist = []
+    leaves = 0
+    min_depth = None
+    while level:
+        level_widths.append(len(level))
+        next_level = []
+        for node in level:
+            children = node.children
+            fanout = len(children)
+            while len(fanout_hist) <= fanout:
+                fanout_hist.append(0)
+            fanout_hist[fanout] += 1
+            if fanout == 0:
+                leaves += 1
+                if min_depth is None:
+                    min_depth = len(level_widths)
+            next_level.extend(children)
+        level = next_level
+    
+    return {'max_depth' : len(level_widths),
+            'min_depth' : min_depth,
+            'nodes' : sum(level_widths),
+            'leaves' : leaves,
+            'fanout_hist' : fanout_hist,
+            'level_widths' : level_widths}
+
+def forest_stats(forest, jobs=1):
+    #tree_stats for every tree in the forest, keyed like the forest.
+    #a kForest computes these for all its trees at once, in vectorized passes over its arrays.
+    #with jobs > 1, chunks of trees are computed that way in separate processes (see parallel_forest.py)
+    if jobs > 1:
+        from parallel_forest import parallel_forest_stats
+        return parallel_forest_stats(forest, jobs=jobs)
+    if hasattr(forest, 'tree_stats'):
+        return forest.tree_stats()
+    return {k : tree_stats(forest[k]) for k in forest}
+
+def print_tree_stats(forest, outpath='amazon_tree_stats.csv', jobs=1):
+    out_schema = ['Key', 'Max Depth', 'Min Depth', 'Nodes', 'Leaves', 'Max Fan-out', 'Fan-out Histogram', 'Level Widths']
     stat_dct = {}
     for o in out_schema:
         stat_dct[o] = []
     
-    for k in forest:
-        cur_tree = forest[k]
-        cur_depth = cur_tree.max_depth()
-        cur_min = cur_tree.min_depth()
-        cur_nodes = cur_tree.num_nodes()
+    all_stats = forest_stats(forest, jobs=jobs)
+    for k in all_stats:
+        cur_stats = all_stats[k]
         stat_dct['Key'].append(k)
-        stat_dct['Max Depth'].append(cur_depth)
-        stat_dct['Min Depth'].append(cur_min)
-        stat_dct['Nodes'].append(cur_nodes)
+        stat_dct['Max Depth'].append(cur_stats['max_depth'])
+        stat_dct['Min Depth'].append(cur_stats['min_depth'])
+        stat_dct['Nodes'].append(cur_stats['nodes'])
+        stat_dct['Leaves'].append(cur_stats['leaves'])
+        stat_dct['Max Fan-out'].append(len(cur_stats['fanout_hist']) - 1)
+        stat_dct['Fan-out Histogram'].append(str(cur_stats['fanout_hist']))
+        stat_dct['Level Widths'].append(str(cur_stats['level_widths']))
     
     stat_df = pd.DataFrame(stat_dct)
-    stat_df.to_csv('amazon_tree_stats.csv', index=False)
-    
-    
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
 
 if __name__=='__main__':
     #get all the person connections from raw data
@@ -337,10 +673,8 @@ if __name__=='__main__':
     #     with open('amazon_spanningforest.pkl', 'rb') as fh:
     #         spanning_forest = pickle.load(fh)
     # else:
-    #     spanning_forest = extract_hierarchy('amazon_raw_userhierarchy.json')
-    #     #dump as a pkl
-    #     with open('amazon_spanningforest.pkl', 'wb') as fh:
-    #         pickle.dump(spanning_forest, fh)
+    #     #dump as a pkl, and catalog the trees
+    #     spanning_forest = extract_hierarchy('amazon_raw_userhierarchy.json', outpath='amazon_spanningforest.pkl')
     
     # print("Length of Spanning forest: {}".format(len(spanning_forest)))
     # print("Tree Depths:")
@@ -0,0 +1,633 @@
+import numpy as np
+import pandas as pd
+import argparse
+import time
+import os
+import tempfile
+import shutil
+import pickle
+import tracemalloc
+import resource
+import sys
+import contextlib
+import queue as queue_mod
+import multiprocessing as mp
+from ast import literal_eval
+
+from amazon_access import read_amazon_roles, build_adj_lst, build_adj_lst_scan, extract_forest, \
+    get_person_con, analyze_hierarchy, extract_hierarchy, print_tree_stats
+from kforest import kforest_from_ktrees, save_kforest, load_kforest, save_forest_store, load_trees
+from tree_index import TreeIndex
+from hierarchy_store import edges_to_store, save_edge_store, load_edge_store
+from privileges import random_bitsets, effective_privileges, subset_violations
+from synth_hierarchy import shapes, gen_shape
+from rolehier_gen import treeid_to_roles
+
+'''
+Purpose: benchmark the hierarchy pipeline on synthetic inputs shaped like the Kaggle
+Amazon access data (id, MGR_ID, ROLE_TITLE), so that we can see how each stage scales
+well past the size of test.csv.
+'''
+
+def gen_synthetic_roles(nrows, outpath, root_frac=0.01, skew=2.0, seed=0):
+    '''
+    Write a Kaggle-shaped CSV with nrows rows.
+    Each row is a distinct person. A person's manager is an earlier row, picked with
+    index floor(i * u^skew), so early rows (the top of the organisation) get most of the reports
+    and fan-out falls off with depth. A root_frac share of rows instead report to a manager ID that
+    is not a person, like the Kaggle data, and these become the roots of the forest.
+    '''
+    rng = np.random.default_rng(seed)
+    ids = rng.permutation(nrows).astype(np.int64) + 1
+    pos = np.arange(nrows)
+    mgr_pos = np.floor(pos * rng.random(nrows) ** skew).astype(np.int64)
+    mgr_ids = ids[mgr_pos]
+
+    #the first row has nobody above it, so it is always a root
+    is_root = rng.random(nrows) < root_frac
+    is_root[0] = True
+    mgr_ids[is_root] = nrows + 1 + rng.integers(0, max(1, int(nrows * root_frac)), is_root.sum())
+
+    role_titles = rng.integers(100000, 100000 + max(10, nrows // 50), nrows)
+    df = pd.DataFrame({'id' : ids, 'MGR_ID' : mgr_ids, 'ROLE_TITLE' : role_titles})
+    df.to_csv(outpath, index=False)
+    return outpath
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    res = func(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+def time_load(func, *args):
+    #wall time and peak traced allocation while loading. numpy reports its buffers to tracemalloc,
+    #so both kTree pickles and kForest arrays are counted.
+    tracemalloc.start()
+    res, elapsed = time_call(func, *args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+def peak_rss():
+    #VmHWM starts over when the worker execs, while ru_maxrss keeps the high-water mark of the
+    #parent that forked it, so prefer VmHWM where /proc exists.
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    #ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _isolated_worker(queue, func, args, quiet, with_result):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        res, elapsed = time_call(func, *args)
+    queue.put((elapsed, peak_rss(), res if with_result else None))
+
+def run_isolated(func, *args, quiet=False, with_result=False):
+    #run func in a fresh interpreter, so its peak RSS is not polluted by earlier stages.
+    #func has to be a module-level function, and its result is thrown away unless with_result.
+    #quiet drops whatever func prints (the progress and summary lines of every pipeline stage, for instance).
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_isolated_worker, args=(queue, func, args, quiet, with_result))
+    proc.start()
+    while True:
+        try:
+            elapsed, peak_rss, res = queue.get(timeout=1)
+            break
+        except queue_mod.Empty:
+            if not proc.is_alive():
+                raise Exception("{} died in its worker process (exit code {})".format(func.__name__, proc.exitcode))
+    proc.join()
+    if with_result:
+        return elapsed, peak_rss, res
+    return elapsed, peak_rss
+
+def noop():
+    pass
+
+def synthetic_forest(nrows, tmpdir, seed=0):
+    #run the real pipeline (adjacency, then extraction) over a synthetic CSV
+    csv_path = gen_synthetic_roles(nrows, os.path.join(tmpdir, 'roles_' + str(nrows) + '.csv'), seed=seed)
+    raw_adj_lst, _, _ = build_adj_lst(read_amazon_roles(csv_path))
+    return extract_forest(raw_adj_lst)
+
+def load_pickle(fpath):
+    with open(fpath, 'rb') as fh:
+        return pickle.load(fh)
+
+def bench_forest_repr(sizes, seed=0, outpath='bench_forest_repr.csv'):
+    #file size, load time and peak load memory of a pickled dictionary of kTrees vs. a kForest .npz
+    out_schema = ['Rows', 'Pickle Bytes', 'kForest Bytes', 'Pickle Load (s)', 'kForest Load (s)',
+                  'Pickle Peak Mem', 'kForest Peak Mem']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            forest = synthetic_forest(nrows, tmpdir, seed=seed)
+            pkl_path = os.path.join(tmpdir, 'forest_' + str(nrows) + '.pkl')
+            with open(pkl_path, 'wb') as fh:
+                pickle.dump(forest, fh)
+            npz_path = os.path.join(tmpdir, 'forest_' + str(nrows) + '.npz')
+            save_kforest(kforest_from_ktrees(forest), npz_path)
+            del forest
+
+            _, pkl_time, pkl_peak = time_load(load_pickle, pkl_path)
+            _, npz_time, npz_peak = time_load(load_kforest, npz_path)
+
+            stat_dct['Rows'].append(nrows)
+            stat_dct['Pickle Bytes'].append(os.path.getsize(pkl_path))
+            stat_dct['kForest Bytes'].append(os.path.getsize(npz_path))
+            stat_dct['Pickle Load (s)'].append(pkl_time)
+            stat_dct['kForest Load (s)'].append(npz_time)
+            stat_dct['Pickle Peak Mem'].append(pkl_peak)
+            stat_dct['kForest Peak Mem'].append(npz_peak)
+            print("{} rows: pickle {:.3f}s / {} bytes, kForest {:.3f}s / {} bytes".format(nrows, pkl_time, pkl_peak, npz_time, npz_peak))
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+def bench_extraction(sizes, recursive_limit=20000, seed=0, outpath='bench_extraction.csv'):
+    #iterative vs. recursive spanning-forest extraction. the recursive path is quadratic,
+    #so only run it up to recursive_limit rows, and check the forests agree wherever both run.
+    out_schema = ['Rows', 'Iterative (s)', 'Recursive (s)', 'Speedup']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            csv_path = gen_synthetic_roles(nrows, os.path.join(tmpdir, 'roles_' + str(nrows) + '.csv'), seed=seed)
+            raw_adj_lst, _, _ = build_adj_lst(read_amazon_roles(csv_path))
+            iter_forest, iter_time = time_call(extract_forest, raw_adj_lst, method='iterative')
+
+            rec_time = np.nan
+            if nrows <= recursive_limit:
+                rec_forest, rec_time = time_call(extract_forest, raw_adj_lst, method='recursive')
+                if list(rec_forest) != list(iter_forest) or \
+                        any(rec_forest[k].tree2dict() != iter_forest[k].tree2dict() for k in rec_forest):
+                    raise Exception("Iterative forest does not match recursive forest at {} rows".format(nrows))
+
+            stat_dct['Rows'].append(nrows)
+            stat_dct['Iterative (s)'].append(iter_time)
+            stat_dct['Recursive (s)'].append(rec_time)
+            stat_dct['Speedup'].append(rec_time / iter_time)
+            print("{} rows: iterative {:.3f}s, recursive {:.3f}s".format(nrows, iter_time, rec_time))
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+def load_repr_hier(fpath):
+    return literal_eval(open(fpath, 'r').read())
+
+def load_store_index(dirpath):
+    #open the memory-mapped store and build the lookup index
+    hier = load_edge_store(dirpath)
+    hier._build()
+    return hier
+
+def load_store_full(dirpath):
+    #open the store and materialize the whole dictionary, for a like-for-like comparison
+    return load_edge_store(dirpath).to_dict()
+
+def bench_hier_format(sizes, seed=0, outpath='bench_hier_format.csv'):
+    #load time and peak RSS of the repr file (literal_eval) vs. the edge store.
+    #each load runs in its own process; 'Baseline RSS' is an interpreter that only imports this module.
+    out_schema = ['Rows', 'Repr Bytes', 'Store Bytes', 'Repr Load (s)', 'Store Index (s)', 'Store Full (s)',
+                  'Baseline RSS', 'Repr RSS', 'Store Index RSS', 'Store Full RSS']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    _, base_rss = run_isolated(noop)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            csv_path = gen_synthetic_roles(nrows, os.path.join(tmpdir, 'roles_' + str(nrows) + '.csv'), seed=seed)
+            df = read_amazon_roles(csv_path)
+            raw_adj_lst, _, _ = build_adj_lst(df)
+            repr_path = os.path.join(tmpdir, 'hier_' + str(nrows) + '.json')
+            with open(repr_path, 'w+') as fh:
+                print(raw_adj_lst, file=fh)
+            del raw_adj_lst
+            store_path = os.path.join(tmpdir, 'hier_' + str(nrows))
+            save_edge_store(store_path, edges_to_store(df['id'].to_numpy(), df['MGR_ID'].to_numpy()))
+
+            repr_time, repr_rss = run_isolated(load_repr_hier, repr_path)
+            index_time, index_rss = run_isolated(load_store_index, store_path)
+            full_time, full_rss = run_isolated(load_store_full, store_path)
+
+            stat_dct['Rows'].append(nrows)
+            stat_dct['Repr Bytes'].append(os.path.getsize(repr_path))
+            stat_dct['Store Bytes'].append(sum(os.path.getsize(os.path.join(store_path, f)) for f in os.listdir(store_path)))
+            stat_dct['Repr Load (s)'].append(repr_time)
+            stat_dct['Store Index (s)'].append(index_time)
+            stat_dct['Store Full (s)'].append(full_time)
+            stat_dct['Baseline RSS'].append(base_rss)
+            stat_dct['Repr RSS'].append(repr_rss)
+            stat_dct['Store Index RSS'].append(index_rss)
+            stat_dct['Store Full RSS'].append(full_rss)
+            print("{} rows: literal_eval {:.3f}s, store index {:.3f}s, store full {:.3f}s".format(nrows, repr_time, index_time, full_time))
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+def load_tree_pickle(pkl_path, k):
+    #what the __main__ blocks used to do for one tree: unpickle everything, keep one
+    return load_pickle(pkl_path)[k]
+
+def load_tree_store(dirpath, k):
+    return load_trees(dirpath, [k])[k]
+
+def load_ktree_store(dirpath, k):
+    return load_trees(dirpath, [k])[k].to_ktree()
+
+def bench_tree_load(sizes, seed=0, outpath='bench_tree_load.csv'):
+    #cold-start time and peak RSS of loading one median-sized tree (like the handful rolehier_gen labels),
+    #from the pickle vs. the ForestStore
+    #(as a view, and converted to a kTree). every load runs in a fresh process, like a __main__ block.
+    out_schema = ['Rows', 'Trees', 'Tree Nodes', 'Pickle Bytes', 'Store Bytes', 'Pickle Load (s)', 'Store View (s)',
+                  'Store kTree (s)', 'Baseline RSS', 'Pickle RSS', 'Store View RSS', 'Store kTree RSS']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    _, base_rss = run_isolated(noop)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            forest = synthetic_forest(nrows, tmpdir, seed=seed)
+            pkl_path = os.path.join(tmpdir, 'forest_' + str(nrows) + '.pkl')
+            with open(pkl_path, 'wb') as fh:
+                pickle.dump(forest, fh)
+            store_path = os.path.join(tmpdir, 'forest_' + str(nrows) + '_store')
+            compact_forest = kforest_from_ktrees(forest)
+            save_forest_store(compact_forest, store_path)
+            n_trees = len(forest)
+            del forest
+
+            tree_sizes = np.bincount(compact_forest.node_depths()[1], minlength=n_trees)
+            k = int(np.argsort(tree_sizes, kind='stable')[n_trees // 2])
+            pkl_time, pkl_rss = run_isolated(load_tree_pickle, pkl_path, k)
+            view_time, view_rss = run_isolated(load_tree_store, store_path, k)
+            ktree_time, ktree_rss = run_isolated(load_ktree_store, store_path, k)
+
+            stat_dct['Rows'].append(nrows)
+            stat_dct['Trees'].append(n_trees)
+            stat_dct['Tree Nodes'].append(int(tree_sizes[k]))
+            stat_dct['Pickle Bytes'].append(os.path.getsize(pkl_path))
+            stat_dct['Store Bytes'].append(sum(os.path.getsize(os.path.join(store_path, f)) for f in os.listdir(store_path)))
+            stat_dct['Pickle Load (s)'].append(pkl_time)
+            stat_dct['Store View (s)'].append(view_time)
+            stat_dct['Store kTree (s)'].append(ktree_time)
+            stat_dct['Baseline RSS'].append(base_rss)
+            stat_dct['Pickle RSS'].append(pkl_rss)
+            stat_dct['Store View RSS'].append(view_rss)
+            stat_dct['Store kTree RSS'].append(ktree_rss)
+            print("{} rows, tree of {} nodes: pickle {:.3f}s / {} RSS, store view {:.3f}s / {} RSS, store kTree {:.3f}s / {} RSS".format(
+                nrows, int(tree_sizes[k]), pkl_time, pkl_rss, view_time, view_rss, ktree_time, ktree_rss))
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+def bench_ancestry(sizes, n_pairs=1000000, seed=0, outpath='bench_ancestry.csv'):
+    #index build time, and batched is_ancestor / lca throughput over random ID pairs
+    out_schema = ['Rows', 'Index Build (s)', 'is_ancestor pairs/s', 'lca pairs/s']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            compact_forest = kforest_from_ktrees(synthetic_forest(nrows, tmpdir, seed=seed))
+            index, build_time = time_call(TreeIndex, compact_forest)
+            a = rng.choice(compact_forest.person, n_pairs)
+            b = rng.choice(compact_forest.person, n_pairs)
+            _, anc_time = time_call(index.is_ancestor, a, b)
+            _, lca_time = time_call(index.lca, a, b)
+
+            stat_dct['Rows'].append(nrows)
+            stat_dct['Index Build (s)'].append(build_time)
+            stat_dct['is_ancestor pairs/s'].append(n_pairs / anc_time)
+            stat_dct['lca pairs/s'].append(n_pairs / lca_time)
+            print("{} rows: build {:.3f}s, is_ancestor {:.0f} pairs/s, lca {:.0f} pairs/s".format(nrows, build_time, n_pairs / anc_time, n_pairs / lca_time))
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+def bench_privileges(sizes, n_privileges=4096, per_node=8, seed=0, outpath='bench_privileges.csv'):
+    #effective privilege propagation and subset auditing over random privilege sets
+    out_schema = ['Rows', 'Nodes', 'Privileges', 'Bitset MB', 'Effective (s)', 'Audit (s)', 'Violating Edges']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            compact_forest = kforest_from_ktrees(synthetic_forest(nrows, tmpdir, seed=seed))
+            bits = random_bitsets(compact_forest, n_privileges, per_node=per_node, seed=seed)
+            _, eff_time = time_call(effective_privileges, compact_forest, bits)
+            violations, audit_time = time_call(subset_violations, compact_forest, bits)
+
+            stat_dct['Rows'].append(nrows)
+            stat_dct['Nodes'].append(compact_forest.num_nodes())
+            stat_dct['Privileges'].append(n_privileges)
+            stat_dct['Bitset MB'].append(bits.nbytes / 2**20)
+            stat_dct['Effective (s)'].append(eff_time)
+            stat_dct['Audit (s)'].append(audit_time)
+            stat_dct['Violating Edges'].append(len(violations))
+            print("{} rows, {} nodes: effective {:.3f}s, audit {:.3f}s".format(nrows, compact_forest.num_nodes(), eff_time, audit_time))
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+def bench_synth(sizes, n_trees=10, seed=0, outpath='bench_synth.csv'):
+    #generation time of every synthetic shape, written to (and read back from) disk
+    out_schema = ['Nodes', 'Shape', 'Levels', 'Generate (s)', 'Stats (s)', 'MB on Disk']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_nodes in sizes:
+            for shape in shapes:
+                outdir = os.path.join(tmpdir, shape + '_' + str(n_nodes))
+                synth_forest, gen_time = time_call(gen_shape, shape, n_nodes, outdir, n_trees=n_trees, seed=seed)
+                _, stats_time = time_call(synth_forest.tree_stats)
+                disk = sum(os.path.getsize(os.path.join(outdir, f)) for f in os.listdir(outdir))
+
+                stat_dct['Nodes'].append(n_nodes)
+                stat_dct['Shape'].append(shape)
+                stat_dct['Levels'].append(len(synth_forest.level_ranges()))
+                stat_dct['Generate (s)'].append(gen_time)
+                stat_dct['Stats (s)'].append(stats_time)
+                stat_dct['MB on Disk'].append(disk / 2**20)
+                print("{} nodes, {}: generate {:.3f}s, stats {:.3f}s".format(n_nodes, shape, gen_time, stats_time))
+                del synth_forest
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+#the pipeline stages, one per process. each one loads its input like the __main__ blocks do,
+#but only times the call itself, and returns that time
+def pipeline_get_person_con(csv_path, store_path):
+    _, elapsed = time_call(get_person_con, csv_path, outpath=store_path)
+    return elapsed
+
+def pipeline_analyze_hierarchy(store_path):
+    _, elapsed = time_call(analyze_hierarchy, store_path)
+    return elapsed
+
+def pipeline_extract_hierarchy(store_path, pkl_path, jobs=1):
+    _, elapsed = time_call(extract_hierarchy, store_path, outpath=pkl_path, jobs=jobs)
+    return elapsed
+
+def pipeline_print_tree_stats(pkl_path, stats_path, jobs=1):
+    forest = load_pickle(pkl_path)
+    _, elapsed = time_call(print_tree_stats, forest, outpath=stats_path, jobs=jobs)
+    return elapsed
+
+def pipeline_treeid_to_roles(pkl_path, label_path, outpref):
+    forest = load_pickle(pkl_path)
+    id_map = load_pickle(label_path)
+    label_maps = {k : id_map for k in forest}
+    _, elapsed = time_call(treeid_to_roles, forest, outpref, label_maps=label_maps)
+    return elapsed
+
+pipeline_stages = ['get_person_con', 'analyze_hierarchy', 'extract_hierarchy', 'print_tree_stats', 'treeid_to_roles']
+#the stages that take jobs (see parallel_forest.py); the others run once per size, as Jobs 1
+parallel_stages = ['extract_hierarchy', 'print_tree_stats']
+
+def synthetic_label_map(csv_path, label_path):
+    #stand-in for the LLM labels: every ID gets a role named after its ROLE_TITLE,
+    #and the roots (managers that are not in the id column) get a generic top role
+    df = read_amazon_roles(csv_path)
+    id_map = {p : ('Role ' + str(t), 'Synthetic role with title ' + str(t)) for p, t in zip(df['id'].tolist(), df['ROLE_TITLE'].tolist())}
+    for m in df['MGR_ID'].tolist():
+        if m not in id_map:
+            id_map[m] = ('Executive', 'Synthetic top-level role')
+    with open(label_path, 'wb') as fh:
+        pickle.dump(id_map, fh)
+
+def scaling_exponents(stat_df):
+    #slope of log(seconds) against log(rows) per stage and jobs: ~1 is linear, ~2 quadratic
+    out = {'Stage' : [], 'Jobs' : [], 'Time Exponent' : [], 'Memory Exponent' : []}
+    for (stage, jobs), grp in stat_df.groupby(['Stage', 'Jobs'], sort=False):
+        grp = grp.sort_values('Rows')
+        out['Stage'].append(stage)
+        out['Jobs'].append(jobs)
+        if len(grp) < 2:
+            out['Time Exponent'].append(np.nan)
+            out['Memory Exponent'].append(np.nan)
+            continue
+        log_rows = np.log(grp['Rows'].to_numpy(dtype=np.float64))
+        out['Time Exponent'].append(np.polyfit(log_rows, np.log(np.maximum(grp['Seconds'].to_numpy(), 1e-6)), 1)[0])
+        out['Memory Exponent'].append(np.polyfit(log_rows, np.log(np.maximum(grp['Stage RSS'].to_numpy(), 1)), 1)[0])
+    return pd.DataFrame(out)
+
+def parallel_speedup(stat_df):
+    #for every stage and size run with several jobs values: seconds with the fewest jobs over seconds with each.
+    #linear scaling is a speedup equal to the ratio of jobs, which needs that many cores (see 'Cores')
+    out = {'Stage' : [], 'Rows' : [], 'Jobs' : [], 'Seconds' : [], 'Speedup' : [], 'Cores' : []}
+    for (stage, nrows), grp in stat_df.groupby(['Stage', 'Rows'], sort=False):
+        if grp['Jobs'].nunique() < 2:
+            continue
+        grp = grp.sort_values('Jobs')
+        base = grp['Seconds'].iloc[0]
+        for jobs, seconds in zip(grp['Jobs'].tolist(), grp['Seconds'].tolist()):
+            out['Stage'].append(stage)
+            out['Rows'].append(nrows)
+            out['Jobs'].append(jobs)
+            out['Seconds'].append(seconds)
+            out['Speedup'].append(base / seconds)
+            out['Cores'].append(os.cpu_count())
+    return pd.DataFrame(out)
+
+def plot_scaling(stat_df, outpath):
+    #log-log scaling curves, if matplotlib is around
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, so no plot; the curves are in the CSV")
+        return
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for (stage, jobs), grp in stat_df.groupby(['Stage', 'Jobs'], sort=False):
+        grp = grp.sort_values('Rows')
+        label = stage if jobs == 1 else '{} (jobs={})'.format(stage, jobs)
+        axes[0].plot(grp['Rows'], grp['Seconds'], marker='o', label=label)
+        axes[1].plot(grp['Rows'], grp['Stage RSS'] / 2**20, marker='o', label=label)
+    for ax, ylabel in zip(axes, ['Seconds', 'Peak RSS above baseline (MB)']):
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('Rows')
+        ax.set_ylabel(ylabel)
+    axes[0].legend()
+    fig.tight_layout()
+    fig.savefig(outpath)
+    plt.close(fig)
+
+def check_baseline(stat_df, baseline_path, threshold=1.5, min_seconds=0.05, min_rss=32 * 2**20):
+    '''
+    Compare a bench_pipeline run to a stored baseline run, for every (stage, rows, jobs) in both.
+    A stage regresses if it got more than threshold times slower (and slower by at least min_seconds),
+    or needs more than threshold times the memory (and at least min_rss more), so that noise on
+    tiny inputs does not count. Returns the regressions as a DataFrame.
+    '''
+    base_df = pd.read_csv(baseline_path)
+    if 'Jobs' not in base_df:
+        #baselines from before the jobs dimension ran everything serially
+        base_df['Jobs'] = 1
+    both = stat_df.merge(base_df, on=['Stage', 'Rows', 'Jobs'], suffixes=('', ' Baseline'))
+    slower = (both['Seconds'] > threshold * both['Seconds Baseline']) & \
+             (both['Seconds'] - both['Seconds Baseline'] > min_seconds)
+    bigger = (both['Stage RSS'] > threshold * both['Stage RSS Baseline']) & \
+             (both['Stage RSS'] - both['Stage RSS Baseline'] > min_rss)
+    regressed = both[slower | bigger]
+    print("Checked {} stage runs against {}: {} regressions".format(len(both), baseline_path, len(regressed)))
+    return regressed[['Stage', 'Rows', 'Jobs', 'Seconds', 'Seconds Baseline', 'Stage RSS', 'Stage RSS Baseline']]
+
+def bench_pipeline(sizes, seed=0, outpath='bench_pipeline.csv', jobs=(1,)):
+    '''
+    The pipeline end to end on synthetic Kaggle-shaped CSVs (gen_synthetic_roles), every stage
+    in its own process: get_person_con (to an edge store), analyze_hierarchy, extract_hierarchy
+    (pickle and catalog), print_tree_stats and treeid_to_roles, each reading what the previous one wrote.
+    Seconds is the stage's own call; Peak RSS is the whole process, inputs included, and Stage RSS
+    is that minus an interpreter that only imports this module.
+    extract_hierarchy and print_tree_stats run once per value in jobs, each on its own pickle;
+    treeid_to_roles reads the pickle of the first one.
+    Writes one row per (stage, rows, jobs), plus the fitted scaling exponents, the speedup over the fewest jobs
+    (when jobs has more than one value) and (with matplotlib) a plot.
+    '''
+    out_schema = ['Stage', 'Rows', 'Jobs', 'Seconds', 'Peak RSS', 'Stage RSS']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    _, base_rss = run_isolated(noop)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            size_dir = os.path.join(tmpdir, str(nrows))
+            os.makedirs(size_dir)
+            def path(name):
+                return os.path.join(size_dir, name)
+            csv_path = gen_synthetic_roles(nrows, path('roles.csv'), seed=seed)
+            synthetic_label_map(csv_path, path('labels.pkl'))
+
+            def forest_path(j):
+                return path('forest_jobs{}.pkl'.format(j))
+
+            stage_args = {'get_person_con' : lambda j: (pipeline_get_person_con, csv_path, path('hier')),
+                          'analyze_hierarchy' : lambda j: (pipeline_analyze_hierarchy, path('hier')),
+                          'extract_hierarchy' : lambda j: (pipeline_extract_hierarchy, path('hier'), forest_path(j), j),
+                          'print_tree_stats' : lambda j: (pipeline_print_tree_stats, forest_path(j), path('stats.csv'), j),
+                          'treeid_to_roles' : lambda j: (pipeline_treeid_to_roles, forest_path(jobs[0]), path('labels.pkl'), path('out'))}
+            for stage in pipeline_stages:
+                for j in (jobs if stage in parallel_stages else [1]):
+                    _, stage_peak, elapsed = run_isolated(*stage_args[stage](j), quiet=True, with_result=True)
+                    stat_dct['Stage'].append(stage)
+                    stat_dct['Rows'].append(nrows)
+                    stat_dct['Jobs'].append(j)
+                    stat_dct['Seconds'].append(elapsed)
+                    stat_dct['Peak RSS'].append(stage_peak)
+                    stat_dct['Stage RSS'].append(max(0, stage_peak - base_rss))
+                    print("{} rows, {}, jobs {}: {:.3f}s, peak RSS {:.1f} MB".format(nrows, stage, j, elapsed, stage_peak / 2**20))
+            #the largest sizes take gigabytes of disk, so don't keep them around for the rest of the run
+            shutil.rmtree(size_dir)
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    exp_df = scaling_exponents(stat_df)
+    exp_df.to_csv(os.path.splitext(outpath)[0] + '_scaling.csv', index=False)
+    print(exp_df.to_string(index=False))
+    speedup_df = parallel_speedup(stat_df)
+    if len(speedup_df) > 0:
+        speedup_df.to_csv(os.path.splitext(outpath)[0] + '_parallel.csv', index=False)
+        print(speedup_df.to_string(index=False))
+    plot_scaling(stat_df, os.path.splitext(outpath)[0] + '.png')
+    return stat_df
+
+def bench_adjacency(sizes, scan_limit=20000, seed=0, outpath='bench_adjacency.csv'):
+    #the scan path is quadratic, so only run it up to scan_limit rows.
+    #wherever both run, check that they agree exactly.
+    out_schema = ['Rows', 'Indexed (s)', 'Scan (s)', 'Speedup']
+    stat_dct = {}
+    for o in out_schema:
+        stat_dct[o] = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in sizes:
+            csv_path = gen_synthetic_roles(nrows, os.path.join(tmpdir, 'roles_' + str(nrows) + '.csv'), seed=seed)
+            df = read_amazon_roles(csv_path)
+            fast_res, fast_time = time_call(build_adj_lst, df)
+
+            scan_time = np.nan
+            if nrows <= scan_limit:
+                scan_res, scan_time = time_call(build_adj_lst_scan, df)
+                if scan_res != fast_res or list(scan_res[0]) != list(fast_res[0]):
+                    raise Exception("Indexed adjacency does not match scan adjacency at {} rows".format(nrows))
+
+            stat_dct['Rows'].append(nrows)
+            stat_dct['Indexed (s)'].append(fast_time)
+            stat_dct['Scan (s)'].append(scan_time)
+            stat_dct['Speedup'].append(scan_time / fast_time)
+            print("{} rows: indexed {:.3f}s, scan {:.3f}s".format(nrows, fast_time, scan_time))
+
+    stat_df = pd.DataFrame(stat_dct)
+    stat_df.to_csv(outpath, index=False)
+    return stat_df
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the role hierarchy pipeline on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000, 100000, 1000000],
+                        help='row counts for every stage but pipeline. these start small so that the quadratic '
+                             'reference paths (scan adjacency, recursive extraction) run on a few of them')
+    parser.add_argument('--pipeline-sizes', type=int, nargs='+', default=[10000, 100000, 1000000, 10000000],
+                        help='row counts for the pipeline stage. 10M rows take several GB of disk and memory')
+    parser.add_argument('--scan-limit', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', default=['adjacency', 'extraction', 'forest_repr', 'hier_format', 'ancestry',
+                                                        'privileges', 'synth', 'tree_load', 'pipeline'])
+    parser.add_argument('--baseline', default='bench_pipeline_baseline.csv',
+                        help='stored pipeline run to check for regressions against (skipped if the file does not exist)')
+    parser.add_argument('--save-baseline', action='store_true', help='store this pipeline run as the baseline')
+    parser.add_argument('--threshold', type=float, default=1.5, help='slowdown or memory growth factor that counts as a regression')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1],
+                        help='process counts for the pipeline stage\'s extract_hierarchy and print_tree_stats, e.g., 1 8 32; '
+                             'the speedups go to bench_pipeline_parallel.csv')
+    args = parser.parse_args()
+
+    if 'adjacency' in args.stages:
+        bench_adjacency(args.sizes, scan_limit=args.scan_limit, seed=args.seed)
+    if 'extraction' in args.stages:
+        bench_extraction(args.sizes, recursive_limit=args.scan_limit, seed=args.seed)
+    if 'forest_repr' in args.stages:
+        bench_forest_repr(args.sizes, seed=args.seed)
+    if 'hier_format' in args.stages:
+        bench_hier_format(args.sizes, seed=args.seed)
+    if 'ancestry' in args.stages:
+        bench_ancestry(args.sizes, seed=args.seed)
+    if 'privileges' in args.stages:
+        bench_privileges(args.sizes, seed=args.seed)
+    if 'synth' in args.stages:
+        bench_synth(args.sizes, seed=args.seed)
+    if 'tree_load' in args.stages:
+        bench_tree_load(args.sizes, seed=args.seed)
+    if 'pipeline' in args.stages:
+        pipeline_df = bench_pipeline(args.pipeline_sizes, seed=args.seed, jobs=args.jobs)
+        if args.save_baseline:
+            pipeline_df.to_csv(args.baseline, index=False)
+            print("Saved the baseline to {}".format(args.baseline))
+        elif os.path.exists(args.baseline):
+            regressed = check_baseline(pipeline_df, args.baseline, threshold=args.threshold)
+            if len(regressed) > 0:
+                raise Exception("Pipeline regressions against {}:\n{}".format(args.baseline, regressed.to_string(index=False)))
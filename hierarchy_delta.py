@@ -0,0 +1,435 @@
+import pandas as pd
+import os
+
+from amazon_access import kTree
+from hierarchy_store import HierarchyOverlay, load_hierarchy, read_delta, save_delta
+from tree_catalog import ForestCatalog, catalog_path_for
+
+'''
+Purpose: keep the spanning forest up to date as people are hired, leave or change managers,
+without re-running get_person_con and extract_hierarchy over the whole organization.
+
+A delta is a list of (op, id, MGR_ID) rows (see HierarchyOverlay.apply_rows, and read_delta for the CSV format).
+IncrementalForest applies it to the adjacency (a HierarchyOverlay, so an edge store is patched, not rewritten)
+and then moves only the subtrees of the people whose manager changed:
+- a person whose manager changed is cut from the old manager's node and hung under the new one,
+  with everyone below them coming along;
+- a person left without a manager becomes the root of a new tree (a split);
+- a root that gets a manager hangs its whole tree under them, and its tree goes away (a merge);
+- a person whose new manager is below them would close a cycle. Like in extract_forest,
+  nobody in the cycle is reachable from a root, so their subtree leaves the forest until the cycle is broken.
+
+Every tree keeps its level widths, leaves per level and fan-out histogram, so the tree_stats of
+a changed tree come from adding and subtracting the profile of the moved subtree, not from a new
+traversal of the tree. The cost of a delta is the size of the subtrees it moves, plus the depth
+of the nodes it touches.
+
+update_hierarchy keeps both sides on disk, so neither is read or rewritten whole: the hierarchy's changed keys
+go to the edge store's delta.db, and the forest is kept in its catalog, which knows the tree of every person.
+A delta then only loads and rewrites the trees it touches.
+
+As in extract_forest, a person with several managers sits under one of them; here it is the one
+they already sit under, if that row is still there, or else the first one. Trees split off get new keys
+(one past the largest key), and nodes hung under a manager go after that manager's other children,
+so keys and the order of children can differ from a fresh extract_forest, but the trees themselves do not.
+'''
+
+def subtree_profile(node):
+    #level widths, leaves per level and fan-out counts of the subtree at node, top level first
+    level_widths = []
+    leaf_levels = []
+    fanout = {}
+    level = [node]
+    while level:
+        level_widths.append(len(level))
+        leaves = 0
+        next_level = []
+        for x in level:
+            f = len(x.children)
+            fanout[f] = fanout.get(f, 0) + 1
+            if f == 0:
+                leaves += 1
+            next_level.extend(x.children)
+        leaf_levels.append(leaves)
+        level = next_level
+    return level_widths, leaf_levels, fanout
+
+def add_profile(tree_prof, prof, offset, sign=1):
+    #add (sign=1) or subtract (sign=-1) a subtree profile whose top sits at depth offset (0 is the root)
+    level_widths, leaf_levels, fanout = prof
+    need = offset + len(level_widths)
+    while len(tree_prof['level_widths']) < need:
+        tree_prof['level_widths'].append(0)
+        tree_prof['leaf_levels'].append(0)
+    for i in range(len(level_widths)):
+        tree_prof['level_widths'][offset + i] += sign * level_widths[i]
+        tree_prof['leaf_levels'][offset + i] += sign * leaf_levels[i]
+    for f in fanout:
+        tree_prof['fanout'][f] = tree_prof['fanout'].get(f, 0) + sign * fanout[f]
+
+def profile_stats(tree_prof):
+    #a tree profile as a tree_stats dictionary
+    level_widths = list(tree_prof['level_widths'])
+    while level_widths and level_widths[-1] == 0:
+        level_widths.pop()
+    leaf_levels = tree_prof['leaf_levels']
+    min_depth = next((d + 1 for d in range(len(level_widths)) if leaf_levels[d] > 0), None)
+    max_fanout = max([f for f in tree_prof['fanout'] if tree_prof['fanout'][f] > 0], default=0)
+    return {'max_depth' : len(level_widths),
+            'min_depth' : min_depth,
+            'nodes' : sum(level_widths),
+            'leaves' : sum(leaf_levels),
+            'fanout_hist' : [tree_prof['fanout'].get(f, 0) for f in range(max_fanout + 1)],
+            'level_widths' : level_widths}
+
+class IncrementalForest:
+    '''
+    A spanning forest kept in sync with a hierarchy (raw_adj_lst, EdgeHierarchy or HierarchyOverlay) as deltas arrive.
+    The forest is either a dictionary of kTree (as extract_hierarchy returns it), changed in place, so that
+    self.forest is always the current forest; or a ForestCatalog (see tree_catalog.py), from which only the trees
+    a delta touches are loaded, into self.forest, and written back by save.
+    Indexing a dictionary is one pass over the forest, and the hierarchy is never scanned: people that
+    extract_forest never reached (in or below a manager cycle) only get nodes once a delta gets to them.
+    After that, apply costs what it moves.
+    '''
+    def __init__(self, hier, forest=None, catalog=None):
+        self.hier = hier if isinstance(hier, HierarchyOverlay) else HierarchyOverlay(hier)
+        self.catalog = catalog
+        self.forest = {}
+        self.node = {}
+        self.up = {}
+        self.root_key = {}
+        self.cut = set()
+        self.cut_key = {}
+        self.prof = {}
+        #changes not written to the catalog yet: trees, and the tops of the subtrees that moved
+        self.unsaved = set()
+        self.unsaved_removed = set()
+        self.moved = {}
+        self.gone = set()
+
+        if catalog is not None:
+            self.next_key = catalog.meta('next_key')
+            self.next_cut_key = catalog.meta('next_cut_key')
+            return
+        self.forest = forest
+        for k in forest:
+            self._index(forest[k])
+            self._add_tree(k, forest[k])
+        self.next_key = max(forest) + 1 if forest else 0
+
+    def _index(self, top):
+        #node and up entries for a tree or cut subtree
+        self.up[top.person] = None
+        stack = [top]
+        while stack:
+            cur = stack.pop()
+            self.node[cur.person] = cur
+            for c in cur.children:
+                self.up[c.person] = cur.person
+                stack.append(c)
+
+    def _add_tree(self, k, root):
+        self.forest[k] = root
+        self.root_key[root.person] = k
+        level_widths, leaf_levels, fanout = subtree_profile(root)
+        self.prof[k] = {'level_widths' : level_widths, 'leaf_levels' : leaf_levels, 'fanout' : fanout}
+
+    def _ensure(self, p):
+        #load the tree (or cut subtree) p is in from the catalog, if it is there and not loaded yet
+        if self.catalog is None or p in self.node:
+            return
+        k = self.catalog.key_of(p)
+        if k is None:
+            return
+        top = self.catalog.load(k)
+        self._index(top)
+        if k >= 0:
+            self._add_tree(k, top)
+        else:
+            self.cut.add(top.person)
+            self.cut_key[top.person] = k
+
+    def _materialize(self, m):
+        #nodes for m, which nothing placed yet, and for the managers above it up to someone who is placed
+        #(or around a cycle), each then placed under their manager like any other node
+        chain = []
+        x = m
+        while True:
+            self._ensure(x)
+            if x in self.node or x not in self.hier:
+                break
+            self.node[x] = kTree(x)
+            self.up[x] = None
+            chain.append(x)
+            managers = self.hier[x]['child']
+            if not managers:
+                break
+            x = managers[0]
+        for x in reversed(chain):
+            self._place(x, self._manager(x), outside=True)
+
+    def _pull_in(self, p):
+        #p's subtree is joining a tree: the people below it in the hierarchy that have no node yet
+        #(never reached, see _materialize) join too, as extract_forest would reach them through p
+        stack = [p]
+        while stack:
+            x = stack.pop()
+            x_node = self.node[x]
+            stack.extend(c.person for c in x_node.children)
+            for r in self.hier[x]['parent'] if x in self.hier else []:
+                self._ensure(r)
+                if r in self.node:
+                    continue
+                self.node[r] = kTree(r)
+                self.up[r] = x
+                x_node.children.append(self.node[r])
+                stack.append(r)
+
+    def _locate(self, p):
+        #the top of p's subtree (a root, a cut node, or a node not placed yet) and p's depth below it
+        d = 0
+        while self.up[p] is not None:
+            p = self.up[p]
+            d += 1
+        return p, d
+
+    def tree_of(self, p):
+        #key of the tree p is in, or None if p is not in the forest
+        self._ensure(p)
+        if p not in self.node:
+            return None
+        top, _ = self._locate(p)
+        return self.root_key.get(top)
+
+    def _touch(self, k):
+        #remember a tree's stats before the first change of this delta
+        if k not in self._before and k not in self._added:
+            self._before[k] = profile_stats(self.prof[k])
+
+    def _manager(self, p):
+        #the manager p should sit under: the current one while that row exists, or else the first one
+        managers = self.hier[p]['child'] if p in self.hier else []
+        if not managers:
+            return None
+        cur = self.up[p]
+        return cur if cur in managers else managers[0]
+
+    def _detach(self, p):
+        #take p's subtree out of wherever it is, leaving p as a top that is not placed yet
+        top, d = self._locate(p)
+        k = self.root_key.get(top)
+        u = self.up[p]
+        if u is None:
+            if k is not None:
+                self._touch(k)
+                del self.root_key[p]
+                del self.forest[k]
+                del self.prof[k]
+                if k in self._added:
+                    self._added.remove(k)
+                else:
+                    self._removed.add(k)
+            self.cut.discard(p)
+            return
+        parent_node = self.node[u]
+        parent_node.children.remove(self.node[p])
+        self.up[p] = None
+        if k is not None:
+            self._touch(k)
+            tree_prof = self.prof[k]
+            add_profile(tree_prof, subtree_profile(self.node[p]), d, -1)
+            f = len(parent_node.children) + 1
+            tree_prof['fanout'][f] -= 1
+            tree_prof['fanout'][f - 1] = tree_prof['fanout'].get(f - 1, 0) + 1
+            if f == 1:
+                tree_prof['leaf_levels'][d - 1] += 1
+
+    def _place(self, p, m, outside=False):
+        #hang the top p under m, make it a new tree (m is None), or cut it if m is below p.
+        #outside means p's subtree was not in the forest before, so people below it may have to be pulled in
+        if self.catalog is not None:
+            self.moved[p] = None
+        if m is None:
+            if outside:
+                self._pull_in(p)
+            k = self.next_key
+            self.next_key += 1
+            self._add_tree(k, self.node[p])
+            self._added.add(k)
+            return
+        self._ensure(m)
+        if m not in self.node:
+            self._materialize(m)
+        top, d = self._locate(m)
+        if top == p:
+            self.cut.add(p)
+            return
+        k = self.root_key.get(top)
+        if k is not None and outside:
+            self._pull_in(p)
+        parent_node = self.node[m]
+        f = len(parent_node.children)
+        parent_node.children.append(self.node[p])
+        self.up[p] = m
+        if k is not None:
+            self._touch(k)
+            tree_prof = self.prof[k]
+            tree_prof['fanout'][f] -= 1
+            tree_prof['fanout'][f + 1] = tree_prof['fanout'].get(f + 1, 0) + 1
+            if f == 0:
+                tree_prof['leaf_levels'][d] -= 1
+            add_profile(tree_prof, subtree_profile(self.node[p]), d + 1)
+
+    def _retry_cut(self):
+        #cut nodes whose cycle a change may have broken. placing one can load more from the catalog
+        tried = set()
+        while True:
+            todo = [p for p in self.cut if p not in tried]
+            if todo == []:
+                return
+            for p in todo:
+                tried.add(p)
+                if p in self.cut:
+                    self.cut.discard(p)
+                    self._place(p, self._manager(p), outside=True)
+
+    def apply(self, delta_rows):
+        '''
+        Apply delta rows to the hierarchy and the forest.
+        Returns a DataFrame with one row per tree that changed, was added or was removed,
+        and its statistics before and after.
+        '''
+        self._before = {}
+        self._added = set()
+        self._removed = set()
+        touched = self.hier.apply_rows(delta_rows)
+
+        #new people (and people never reached before) first, so that everyone's new manager has a node to hang under
+        for p in touched:
+            self._ensure(p)
+            if p in self.hier and p not in self.node:
+                self.node[p] = kTree(p)
+                self.up[p] = None
+                self.gone.discard(p)
+        gone = []
+        for p in touched:
+            if p not in self.node:
+                continue
+            if p not in self.hier:
+                self._detach(p)
+                gone.append(p)
+                continue
+            m = self._manager(p)
+            if p in self.root_key and m is None:
+                continue
+            if self.up[p] is not None and self.up[p] == m:
+                continue
+            outside = self.tree_of(p) is None
+            self._detach(p)
+            self._place(p, m, outside=outside)
+        for p in gone:
+            #nobody reports to someone without rows, so their node has no children left
+            del self.node[p]
+            del self.up[p]
+            self.gone.add(p)
+        self._retry_cut()
+
+        self.unsaved.update(self._before)
+        self.unsaved.update(self._added)
+        self.unsaved_removed.update(self._removed)
+        return self._diff()
+
+    def save(self):
+        '''
+        Write the trees changed since the last save, and every loaded cut subtree, back to the catalog,
+        with the new tree of everyone in a subtree that moved. Nothing else in the catalog is read or written.
+        '''
+        if self.catalog is None:
+            raise Exception("Only a forest kept in a catalog can be saved; a dictionary is changed in place")
+        dropped = [self.cut_key.pop(top) for top in list(self.cut_key) if top not in self.cut]
+        cut_trees = {}
+        for top in self.cut:
+            if top not in self.cut_key:
+                self.cut_key[top] = self.next_cut_key
+                self.next_cut_key -= 1
+            cut_trees[self.cut_key[top]] = self.node[top]
+
+        members = {}
+        for p in self.moved:
+            if p not in self.node:
+                continue
+            top, _ = self._locate(p)
+            k = self.root_key[top] if top in self.root_key else self.cut_key[top]
+            stack = [self.node[p]]
+            while stack:
+                cur = stack.pop()
+                members[cur.person] = k
+                stack.extend(cur.children)
+        trees = {k : self.forest[k] for k in self.unsaved if k in self.forest}
+        self.catalog.save(trees, self.stats(trees), cut_trees, sorted(self.unsaved_removed) + dropped, members, self.gone,
+                          {'next_key' : self.next_key, 'next_cut_key' : self.next_cut_key})
+        self.unsaved = set()
+        self.unsaved_removed = set()
+        self.moved = {}
+        self.gone = set()
+
+    def _diff(self):
+        stat_names = [('nodes', 'Nodes'), ('leaves', 'Leaves'), ('max_depth', 'Max Depth'), ('min_depth', 'Min Depth')]
+        rows = []
+        for k in sorted(set(self._before) | self._added):
+            if k in self._removed:
+                change = 'removed'
+            elif k in self._added:
+                change = 'added'
+            else:
+                change = 'changed'
+            before = self._before.get(k)
+            after = profile_stats(self.prof[k]) if k in self.prof else None
+            row = {'Key' : k, 'Change' : change}
+            for stat, name in stat_names:
+                row[name + ' Before'] = before[stat] if before is not None else None
+                row[name + ' After'] = after[stat] if after is not None else None
+            rows.append(row)
+        cols = ['Key', 'Change'] + [name + s for _, name in stat_names for s in [' Before', ' After']]
+        return pd.DataFrame(rows, columns=cols)
+
+    def stats(self, keys=None):
+        #tree_stats of the given trees (all of them by default), from the maintained profiles
+        if keys is None:
+            keys = self.forest.keys()
+        return {k : profile_stats(self.prof[k]) for k in keys}
+
+def update_hierarchy(hier_path, forest_path, delta_path, diff_path='amazon_tree_diff.csv'):
+    '''
+    Apply a delta CSV to a stored hierarchy and its spanning forest. hier_path is an edge store directory,
+    whose delta.db gets the changed keys; forest_path is the forest's catalog (.db), or the pickle it was
+    built next to (see catalog_path_for), whose changed trees' rows are replaced. Neither is read or written
+    beyond what the delta touches, so the pickle stays as extract_hierarchy wrote it, and
+    load_forest(catalog) gives the current forest. Returns the diff, also written to diff_path.
+    '''
+    if not os.path.isdir(hier_path):
+        raise Exception("{} is not an edge store; convert it with convert_repr_hierarchy first".format(hier_path))
+    catalog_path = forest_path if forest_path.endswith('.db') else catalog_path_for(forest_path)
+    if not os.path.exists(catalog_path):
+        raise Exception("No catalog at {}; extract_hierarchy (or build_catalog) writes one".format(catalog_path))
+
+    delta_rows = read_delta(delta_path)
+    catalog = ForestCatalog(catalog_path)
+    try:
+        inc = IncrementalForest(load_hierarchy(hier_path), catalog=catalog)
+        diff = inc.apply(delta_rows)
+        inc.save()
+    finally:
+        catalog.close()
+    save_delta(hier_path, inc.hier)
+
+    print("Delta rows: {}, Trees changed: {}, added: {}, removed: {}".format(
+        len(delta_rows), (diff['Change'] == 'changed').sum(), (diff['Change'] == 'added').sum(),
+        (diff['Change'] == 'removed').sum()))
+    if diff_path is not None:
+        diff.to_csv(diff_path, index=False)
+    return diff
+
+if __name__=='__main__':
+    update_hierarchy('amazon_raw_userhierarchy', 'amazon_spanningforest_catalog.db', 'amazon_delta.csv')
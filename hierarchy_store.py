@@ -0,0 +1,454 @@
+import numpy as np
+import pandas as pd
+import os
+import shutil
+import sqlite3
+import json
+from ast import literal_eval
+from collections import defaultdict, deque
+
+'''
+Purpose: a compact on-disk format for the raw user hierarchy, in place of the
+Python repr that get_person_con used to print to amazon_raw_userhierarchy.json.
+
+The store is a directory of .npy arrays, so every array can be memory-mapped:
+
+person, manager: the (id, MGR_ID) edge list, one entry per row of the access data, in row order.
+nodes:           the keys of raw_adj_lst, in the same order as the dictionary.
+parent_order:    a permutation of the edges that gives every manager's 'parent' list in order.
+                 for edges written straight from the data this is just the edges grouped by manager,
+                 but a dictionary converted from the repr file may not be in row order, so we store it.
+
+EdgeHierarchy reads the store and behaves like the raw_adj_lst dictionary
+(hier[k]['parent'], hier[k]['child'], iteration over keys). The CSR index behind it is only built on
+first access, and each lookup only materializes the lists it asks for.
+
+save_edge_store also writes that index (INDEX_ARRAYS), so a loaded store looks keys up with binary searches
+over memory-mapped arrays instead of sorting every key first: a lookup only reads the pages it needs.
+Stores written before that still load, and build the index in memory as before.
+
+Changes to the data (people hired, leaving or changing managers) are kept in delta.db in the store
+directory rather than rewriting the arrays: one row per changed key, which HierarchyOverlay looks up
+on top of the arrays (see hierarchy_delta.py). compact_store folds them back into the arrays.
+'''
+
+STORE_ARRAYS = ['nodes', 'person', 'manager', 'parent_order']
+INDEX_ARRAYS = ['sorted_nodes', 'node_order', 'child_order', 'child_ptr', 'parent_ptr']
+
+def first_seen_nodes(person, manager):
+    #raw_adj_lst inserts the person, then the manager, for every row.
+    #so its keys are the distinct IDs of the interleaved edge list, in order of first appearance.
+    inter = np.empty(2 * len(person), dtype=np.result_type(person, manager))
+    inter[0::2] = person
+    inter[1::2] = manager
+    uniq, first = np.unique(inter, return_index=True)
+    return uniq[np.argsort(first)]
+
+class EdgeHierarchy:
+    def __init__(self, nodes, person, manager, parent_order, index=None):
+        self.nodes = nodes
+        self.person = person
+        self.manager = manager
+        self.parent_order = parent_order
+        self._built = False
+        if index is not None:
+            #a saved index: the lists are read through the orders, a slice at a time, rather than gathered up front
+            self._sorted_nodes = index['sorted_nodes']
+            self._order = index['node_order']
+            self._child_order = index['child_order']
+            self._child_ptr = index['child_ptr']
+            self._parent_ptr = index['parent_ptr']
+            self._child_vals = None
+            self._built = True
+
+    def edge_positions(self):
+        #the (person, manager) edges as positions into nodes, looked up once
+        if not hasattr(self, '_p_idx'):
+            self._p_idx = self.lookup(self.person)
+            self._m_idx = self.lookup(self.manager)
+        return self._p_idx, self._m_idx
+
+    def _build(self):
+        if self._built:
+            return
+        n = len(self.nodes)
+        p_idx, m_idx = self.edge_positions()
+
+        #'child' lists: each person's managers in edge order
+        self._child_order = np.argsort(p_idx, kind='stable')
+        self._child_vals = self.manager[self._child_order]
+        self._child_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(p_idx, minlength=n), out=self._child_ptr[1:])
+
+        #'parent' lists: each manager's people, in the stored order
+        self._parent_vals = self.person[self.parent_order]
+        self._parent_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(m_idx, minlength=n), out=self._parent_ptr[1:])
+        self._built = True
+
+    def _build_order(self):
+        #sorted copy of the keys, so IDs can be looked up with a binary search
+        if not hasattr(self, '_order'):
+            self._order = np.argsort(self.nodes, kind='stable')
+            self._sorted_nodes = self.nodes[self._order]
+
+    def lookup(self, ids):
+        #positions of ids in nodes, vectorized. every id must be a key.
+        #binary searches in random order miss cache on every probe, so sort big batches first
+        self._build_order()
+        ids = np.asarray(ids)
+        if ids.ndim == 0 or len(ids) < 4096:
+            return self._order[np.searchsorted(self._sorted_nodes, ids)]
+        id_order = np.argsort(ids, kind='stable')
+        pos = np.empty(len(ids), dtype=np.int64)
+        pos[id_order] = np.searchsorted(self._sorted_nodes, ids[id_order])
+        return self._order[pos]
+
+    def index_of(self, k):
+        self._build_order()
+        pos = np.searchsorted(self._sorted_nodes, k)
+        if pos >= len(self._sorted_nodes) or self._sorted_nodes[pos] != k:
+            raise KeyError(k)
+        return int(self._order[pos])
+
+    def __getitem__(self, k):
+        self._build()
+        i = self.index_of(k)
+        if self._child_vals is None:
+            return {'parent' : self.person[self.parent_order[self._parent_ptr[i]:self._parent_ptr[i + 1]]].tolist(),
+                    'child' : self.manager[self._child_order[self._child_ptr[i]:self._child_ptr[i + 1]]].tolist()}
+        return {'parent' : self._parent_vals[self._parent_ptr[i]:self._parent_ptr[i + 1]].tolist(),
+                'child' : self._child_vals[self._child_ptr[i]:self._child_ptr[i + 1]].tolist()}
+
+    def index_arrays(self):
+        #the lookup index, as saved next to the store arrays
+        self._build()
+        return {'sorted_nodes' : self._sorted_nodes, 'node_order' : self._order, 'child_order' : self._child_order,
+                'child_ptr' : self._child_ptr, 'parent_ptr' : self._parent_ptr}
+
+    def __contains__(self, k):
+        try:
+            self.index_of(k)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        #go through the keys a chunk at a time, so a memory-mapped store is never copied whole
+        chunk = 1 << 16
+        for lo in range(0, len(self.nodes), chunk):
+            yield from self.nodes[lo:lo + chunk].tolist()
+
+    def keys(self):
+        return iter(self)
+
+    def num_edges(self):
+        return len(self.person)
+
+    def roots(self):
+        #keys with an empty 'child' list (people with no manager), in key order, from one count over the edges
+        has_manager = np.bincount(self.edge_positions()[0], minlength=len(self.nodes)) > 0
+        return self.nodes[~has_manager].tolist()
+
+    def to_dict(self):
+        return {k : self[k] for k in self}
+
+def edges_to_store(person, manager):
+    #store arrays for edges in row order (what get_person_con sees)
+    person = np.asarray(person)
+    manager = np.asarray(manager)
+    nodes = first_seen_nodes(person, manager)
+    store = EdgeHierarchy(nodes, person, manager, None)
+    parent_order = np.argsort(store.lookup(manager), kind='stable')
+    return {'nodes' : nodes, 'person' : person, 'manager' : manager, 'parent_order' : parent_order}
+
+def adj_lst_to_store(raw_adj_lst):
+    '''
+    Store arrays for an existing raw_adj_lst dictionary, e.g., one read back from the repr file.
+    Edges are listed person by person, following each 'child' list, and parent_order is
+    recovered by matching each 'parent' list entry to its edge, so the dictionary round-trips exactly.
+    '''
+    nodes = list(raw_adj_lst.keys())
+    person = []
+    manager = []
+    edge_pos = defaultdict(deque)
+    for p in raw_adj_lst:
+        for m in raw_adj_lst[p]['child']:
+            edge_pos[(p, m)].append(len(person))
+            person.append(p)
+            manager.append(m)
+
+    parent_order = []
+    for m in raw_adj_lst:
+        for p in raw_adj_lst[m]['parent']:
+            if not edge_pos[(p, m)]:
+                raise Exception("Inconsistent hierarchy: {} lists {} as a parent, but not the other way around".format(m, p))
+            parent_order.append(edge_pos[(p, m)].popleft())
+
+    return {'nodes' : np.array(nodes), 'person' : np.array(person), 'manager' : np.array(manager),
+            'parent_order' : np.array(parent_order, dtype=np.int64)}
+
+def save_edge_store(dirpath, store_arrays):
+    #new arrays replace the store, so changes saved on top of the old ones no longer apply
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    if os.path.exists(os.path.join(dirpath, DELTA_DB)):
+        os.remove(os.path.join(dirpath, DELTA_DB))
+    for a in STORE_ARRAYS:
+        np.save(os.path.join(dirpath, a + '.npy'), store_arrays[a])
+    index = EdgeHierarchy(*[store_arrays[a] for a in STORE_ARRAYS]).index_arrays()
+    for a in INDEX_ARRAYS:
+        np.save(os.path.join(dirpath, a + '.npy'), index[a])
+
+def load_edge_store(dirpath, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    arrs = [np.load(os.path.join(dirpath, a + '.npy'), mmap_mode=mmap_mode) for a in STORE_ARRAYS]
+    index = None
+    if all(os.path.exists(os.path.join(dirpath, a + '.npy')) for a in INDEX_ARRAYS):
+        index = {a : np.load(os.path.join(dirpath, a + '.npy'), mmap_mode=mmap_mode) for a in INDEX_ARRAYS}
+    return EdgeHierarchy(*arrs, index=index)
+
+def convert_repr_hierarchy(repr_path, dirpath):
+    #converter for the old amazon_raw_userhierarchy.json (a Python repr, read with literal_eval)
+    raw_adj_lst = literal_eval(open(repr_path, 'r').read())
+    save_edge_store(dirpath, adj_lst_to_store(raw_adj_lst))
+
+DELTA_DB = 'delta.db'
+
+class HierarchyOverlay:
+    '''
+    A raw_adj_lst (dictionary or EdgeHierarchy) with edges added and removed on top, without copying it.
+    Only the keys a change touches are copied into patched; keys whose lists both become empty
+    disappear, as they would from get_person_con. Iteration gives the base keys, then the new ones.
+
+    saved is an SQLite file from save (e.g., an edge store's delta.db) with earlier changes. Its rows are
+    read one key at a time as keys are looked up, and all at once only when the keys are iterated over,
+    so applying a delta on top costs what the delta touches, however many changes came before.
+    '''
+    def __init__(self, base, saved=None):
+        self.base = base
+        self.patched = {}
+        self.removed = set()
+        self.new_keys = {}
+        self.saved = saved if saved is not None and os.path.exists(saved) else None
+        self.fetched = set()
+        self.all_fetched = self.saved is None
+        self.dirty = {}
+
+    def _fetch(self, k):
+        #the saved state of k, the first time k is looked up
+        if self.all_fetched or k in self.fetched:
+            return
+        self.fetched.add(k)
+        conn = sqlite3.connect(self.saved)
+        try:
+            row = conn.execute('SELECT state, parent, child FROM overlay WHERE key = ?', (k,)).fetchone()
+        finally:
+            conn.close()
+        if row is not None:
+            self._load_row(k, *row)
+
+    def _load_row(self, k, state, parent, child):
+        if state == 'removed':
+            self.removed.add(k)
+            return
+        self.patched[k] = {'parent' : json.loads(parent), 'child' : json.loads(child)}
+        if state == 'new':
+            self.new_keys[k] = None
+
+    def _fetch_all(self):
+        #every saved row, for iteration. keys already looked up keep their state here;
+        #new keys stay in the order they were first saved, followed by the ones not saved yet
+        if self.all_fetched:
+            return
+        conn = sqlite3.connect(self.saved)
+        try:
+            rows = conn.execute('SELECT key, state, parent, child FROM overlay ORDER BY seq').fetchall()
+        finally:
+            conn.close()
+        saved_new = []
+        for k, state, parent, child in rows:
+            if k not in self.fetched:
+                self._load_row(k, state, parent, child)
+            if state == 'new':
+                saved_new.append(k)
+        ordered = [k for k in saved_new if k in self.new_keys]
+        self.new_keys = dict.fromkeys(ordered + [k for k in self.new_keys if k not in set(ordered)])
+        self.all_fetched = True
+
+    def __contains__(self, k):
+        self._fetch(k)
+        if k in self.patched:
+            return True
+        if k in self.removed:
+            return False
+        return k in self.base
+
+    def __getitem__(self, k):
+        self._fetch(k)
+        if k in self.patched:
+            return self.patched[k]
+        if k in self.removed:
+            raise KeyError(k)
+        return self.base[k]
+
+    def __iter__(self):
+        self._fetch_all()
+        for k in self.base:
+            if k not in self.removed:
+                yield k
+        yield from list(self.new_keys)
+
+    def __len__(self):
+        self._fetch_all()
+        return len(self.base) - len(self.removed) + len(self.new_keys)
+
+    def keys(self):
+        return iter(self)
+
+    def _entry(self, k):
+        self._fetch(k)
+        self.dirty[k] = None
+        if k not in self.patched:
+            if k in self.removed or k not in self.base:
+                self.removed.discard(k)
+                if k not in self.base:
+                    self.new_keys[k] = None
+                self.patched[k] = {'parent' : [], 'child' : []}
+            else:
+                cur = self.base[k]
+                self.patched[k] = {'parent' : list(cur['parent']), 'child' : list(cur['child'])}
+        return self.patched[k]
+
+    def _drop_if_empty(self, k):
+        entry = self.patched.get(k)
+        if entry is not None and entry['parent'] == [] and entry['child'] == []:
+            del self.patched[k]
+            if k in self.new_keys:
+                del self.new_keys[k]
+            else:
+                self.removed.add(k)
+
+    def add_edge(self, p, m):
+        self._entry(p)['child'].append(m)
+        self._entry(m)['parent'].append(p)
+
+    def remove_edge(self, p, m):
+        #one (p, m) row; the same row may be in the data several times
+        if p not in self or m not in self[p]['child']:
+            raise Exception("No row with id {} and MGR_ID {} to remove".format(p, m))
+        self._entry(p)['child'].remove(m)
+        self._entry(m)['parent'].remove(p)
+        self._drop_if_empty(p)
+        self._drop_if_empty(m)
+
+    def apply_rows(self, delta_rows):
+        '''
+        Apply (op, id, MGR_ID) rows, in order:
+        add:    a new (id, MGR_ID) row.
+        remove: one (id, MGR_ID) row. With MGR_ID None, every row of id (the person left).
+        change: id now reports to MGR_ID instead of its current managers.
+        Returns the IDs whose managers changed, or that appeared or disappeared, in order of first change.
+        '''
+        touched = {}
+        for op, p, m in delta_rows:
+            if op == 'add':
+                self.add_edge(p, m)
+            elif op == 'remove' and m is not None:
+                self.remove_edge(p, m)
+            elif op in ['remove', 'change']:
+                if p in self:
+                    for old_m in list(self[p]['child']):
+                        self.remove_edge(p, old_m)
+                        touched[old_m] = None
+                if op == 'change':
+                    self.add_edge(p, m)
+            else:
+                raise Exception("Unknown delta op: {}".format(op))
+            touched[p] = None
+            if m is not None:
+                touched[m] = None
+        return list(touched)
+
+    def save(self, db_path):
+        '''
+        Write the keys changed since this overlay was loaded to db_path (created if needed),
+        in one transaction. Every other saved row is left alone.
+        '''
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                conn.execute('''CREATE TABLE IF NOT EXISTS overlay (key PRIMARY KEY, seq INTEGER, state TEXT,
+                                parent TEXT, child TEXT)''')
+                seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM overlay').fetchone()[0]
+                for k in self.dirty:
+                    if k in self.patched:
+                        seq += 1
+                        state = 'new' if k in self.new_keys else 'patched'
+                        conn.execute('''INSERT INTO overlay VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET
+                                        state = excluded.state, parent = excluded.parent, child = excluded.child''',
+                                     (k, seq, state, json.dumps(self.patched[k]['parent']), json.dumps(self.patched[k]['child'])))
+                    elif k in self.removed:
+                        conn.execute('INSERT OR REPLACE INTO overlay VALUES (?, 0, ?, NULL, NULL)', (k, 'removed'))
+                    else:
+                        #a key added and dropped again
+                        conn.execute('DELETE FROM overlay WHERE key = ?', (k,))
+        finally:
+            conn.close()
+        self.dirty = {}
+
+    def to_dict(self):
+        return {k : self[k] for k in self}
+
+def _to_id(v):
+    #pandas reads an ID column with gaps as floats
+    if v is None or pd.isna(v):
+        return None
+    if isinstance(v, (float, np.floating)) and float(v).is_integer():
+        return int(v)
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+def read_delta(fpath):
+    #a delta file is a CSV with op, id and MGR_ID columns (MGR_ID may be empty for remove)
+    delta_df = pd.read_csv(fpath)
+    return [(op, _to_id(p), _to_id(m)) for op, p, m in zip(delta_df['op'], delta_df['id'], delta_df['MGR_ID'])]
+
+def save_delta(dirpath, hier):
+    #the changes in an overlay over the edge store at dirpath go to its delta.db; the arrays stay as they are
+    hier.save(os.path.join(dirpath, DELTA_DB))
+
+def compact_store(dirpath):
+    #fold delta.db back into the store arrays. this is a full rewrite, so do it now and then, not per delta
+    hier = load_hierarchy(dirpath)
+    if not isinstance(hier, HierarchyOverlay):
+        return
+    store_arrays = adj_lst_to_store(hier.to_dict())
+    tmp_path = dirpath.rstrip(os.sep) + '.compact'
+    save_edge_store(tmp_path, store_arrays)
+    del hier
+    shutil.rmtree(dirpath)
+    os.replace(tmp_path, dirpath)
+
+def hier_roots(hier):
+    #the roots extract_forest starts from, for any form of the hierarchy
+    if hasattr(hier, 'roots'):
+        return hier.roots()
+    return [k for k in hier if hier[k]['child'] == []]
+
+def load_hierarchy(hier_path):
+    #either format: an edge store directory (with the changes in its delta.db on top, if there are any), or the old repr file
+    if os.path.isdir(hier_path):
+        store = load_edge_store(hier_path)
+        db_path = os.path.join(hier_path, DELTA_DB)
+        if not os.path.exists(db_path):
+            return store
+        return HierarchyOverlay(store, saved=db_path)
+    return literal_eval(open(hier_path, 'r').read())
+
+if __name__=='__main__':
+    convert_repr_hierarchy('amazon_raw_userhierarchy.json', 'amazon_raw_userhierarchy')
@@ -0,0 +1,526 @@
+import numpy as np
+import pickle
+import os
+
+from amazon_access import kTree
+from tree_catalog import catalog_keys, load_trees as catalog_trees
+
+'''
+Purpose: a compact, array-backed alternative to a dictionary of kTree objects.
+The whole spanning forest is stored as a few flat NumPy arrays instead of one Python object per person:
+
+person:    the ID of every node, in breadth-first order over the whole forest. So the roots come first
+           (node t is the root of tree t), then every root's children, and so on.
+parent:    index of every node's parent, -1 for roots.
+child_ptr: CSR offsets. Because the layout is breadth-first, the children of node i are exactly the
+           nodes child_ptr[i]..child_ptr[i+1], in their original order.
+keys:      the forest keys (what extract_hierarchy numbers the trees with).
+
+Breadth-first layout also means that the descendants of any node at a given level are contiguous,
+so walking a subtree only takes one slice per level.
+'''
+
+def _to_array(values):
+    #IDs are integers in the Kaggle data, but relabelled trees hold (title, description) tuples,
+    #which np.asarray would turn into a 2-d array. so fall back to an object array, element by element.
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values):
+        return np.array(values, dtype=np.int64)
+    arr = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        arr[i] = v
+    return arr
+
+def _to_value(v):
+    #hand back plain Python values, so views compare and hash like kTree persons
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+class kTreeView:
+    '''
+    Read-only stand-in for kTree over one node of a kForest.
+    It has the same attributes and methods as kTree (person, children, tree2dict, max_depth,
+    min_depth, num_nodes, contains), so code written against kTree can take either.
+    '''
+    def __init__(self, forest, idx):
+        self.forest = forest
+        self.idx = idx
+
+    @property
+    def person(self):
+        return _to_value(self.forest.person[self.idx])
+
+    @property
+    def children(self):
+        lo = self.forest.child_ptr[self.idx]
+        hi = self.forest.child_ptr[self.idx + 1]
+        return [kTreeView(self.forest, c) for c in range(lo, hi)]
+
+    def __deepcopy__(self, memo):
+        #views never modify the arrays underneath them, so a copy can share them
+        return self
+
+    def levels(self):
+        #yield the (lo, hi) node range of this subtree at each depth, top first
+        child_ptr = self.forest.child_ptr
+        lo = self.idx
+        hi = self.idx + 1
+        while lo < hi:
+            yield lo, hi
+            lo, hi = child_ptr[lo], child_ptr[hi]
+
+    def max_depth(self):
+        return sum(1 for _ in self.levels())
+
+    def min_depth(self):
+        #shallowest leaf, as in kTree.min_depth
+        child_ptr = self.forest.child_ptr
+        for d, (lo, hi) in enumerate(self.levels()):
+            if (child_ptr[lo + 1:hi + 1] == child_ptr[lo:hi]).any():
+                return d + 1
+
+    def num_nodes(self):
+        return int(sum(hi - lo for lo, hi in self.levels()))
+
+    def contains(self, person_value):
+        person = self.forest.person
+        for lo, hi in self.levels():
+            if person.dtype == object:
+                found = any(p == person_value for p in person[lo:hi])
+            else:
+                found = bool((person[lo:hi] == person_value).any())
+            if found:
+                return True
+        return False
+
+    def node_range(self):
+        #all node indices of this subtree, level by level
+        return np.concatenate([np.arange(lo, hi) for lo, hi in self.levels()])
+
+    def _build(self, make_node, add_child):
+        #bottom-up, without recursion: nodes are visited in reverse breadth-first order,
+        #so every node's children are built before the node itself.
+        forest = self.forest
+        nodes = self.node_range()
+        built = {}
+        for i in nodes[::-1].tolist():
+            cur = make_node(_to_value(forest.person[i]))
+            for c in range(forest.child_ptr[i], forest.child_ptr[i + 1]):
+                add_child(cur, built.pop(c))
+            built[i] = cur
+        return built[self.idx]
+
+    def tree2dict(self):
+        def make_node(p):
+            return {p : []}
+        def add_child(node, child):
+            next(iter(node.values())).append(child)
+        return self._build(make_node, add_child)
+
+    def to_ktree(self):
+        def add_child(node, child):
+            node.children.append(child)
+        return self._build(kTree, add_child)
+
+class kForest:
+    def __init__(self, keys, person, parent, child_ptr):
+        self.keys_arr = keys
+        self.person = person
+        self.parent = parent
+        self.child_ptr = child_ptr
+        self._key_pos = None
+
+    def _positions(self):
+        if self._key_pos is None:
+            self._key_pos = {_to_value(k) : i for i, k in enumerate(self.keys_arr)}
+        return self._key_pos
+
+    def __len__(self):
+        return len(self.keys_arr)
+
+    def __iter__(self):
+        return iter(self._positions())
+
+    def __contains__(self, k):
+        return k in self._positions()
+
+    def __getitem__(self, k):
+        t = self._positions()[k]
+        return kTreeView(self, t)
+
+    def keys(self):
+        return self._positions().keys()
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def num_nodes(self):
+        return len(self.person)
+
+    def nbytes(self):
+        return sum(a.nbytes for a in [self.keys_arr, self.person, self.parent, self.child_ptr])
+
+    def to_ktrees(self):
+        return {k : self[k].to_ktree() for k in self}
+
+    def level_ranges(self):
+        #the (lo, hi) node range of every level of the forest, roots first
+        levels = []
+        lo, hi = 0, len(self.keys_arr)
+        while lo < hi:
+            levels.append((lo, hi))
+            lo, hi = int(self.child_ptr[lo]), int(self.child_ptr[hi])
+        return levels
+
+    def node_depths(self):
+        #depth (a root has depth 1) and tree position of every node, filled in one slice per level
+        n = len(self.person)
+        depth = np.empty(n, dtype=np.int64)
+        tree = np.empty(n, dtype=np.int64)
+        lo = 0
+        hi = len(self.keys_arr)
+        tree[lo:hi] = np.arange(hi)
+        d = 1
+        while lo < hi:
+            depth[lo:hi] = d
+            next_lo, next_hi = self.child_ptr[lo], self.child_ptr[hi]
+            tree[next_lo:next_hi] = tree[self.parent[next_lo:next_hi]]
+            lo, hi = next_lo, next_hi
+            d += 1
+        return depth, tree
+
+    def tree_stats(self):
+        '''
+        Same statistics as amazon_access.tree_stats, for every tree at once.
+        depths come from one pass over the levels; everything else is a grouped count over the node arrays.
+        '''
+        n_trees = len(self.keys_arr)
+        depth, tree = self.node_depths()
+        fanout = np.diff(self.child_ptr).astype(np.int64)
+        is_leaf = fanout == 0
+
+        nodes = np.bincount(tree, minlength=n_trees)
+        leaves = np.bincount(tree[is_leaf], minlength=n_trees)
+        max_depth = np.zeros(n_trees, dtype=np.int64)
+        np.maximum.at(max_depth, tree, depth)
+        min_depth = np.full(n_trees, np.iinfo(np.int64).max)
+        np.minimum.at(min_depth, tree[is_leaf], depth[is_leaf])
+
+        #(tree, depth) and (tree, fan-out) pairs, encoded as one integer so np.unique sorts by tree first
+        depth_span = int(depth.max()) + 1 if len(depth) else 1
+        width_keys, widths = np.unique(tree * depth_span + depth, return_counts=True)
+        width_ptr = np.searchsorted(width_keys // depth_span, np.arange(n_trees + 1))
+        fanout_span = int(fanout.max()) + 1 if len(fanout) else 1
+        fanout_keys, fanout_cnts = np.unique(tree * fanout_span + fanout, return_counts=True)
+        fanout_ptr = np.searchsorted(fanout_keys // fanout_span, np.arange(n_trees + 1))
+
+        out = {}
+        for t, k in enumerate(self.keys_arr.tolist()):
+            cur_fanouts = fanout_keys[fanout_ptr[t]:fanout_ptr[t + 1]] % fanout_span
+            fanout_hist = np.zeros(cur_fanouts[-1] + 1, dtype=np.int64)
+            fanout_hist[cur_fanouts] = fanout_cnts[fanout_ptr[t]:fanout_ptr[t + 1]]
+            out[k] = {'max_depth' : int(max_depth[t]),
+                      'min_depth' : int(min_depth[t]),
+                      'nodes' : int(nodes[t]),
+                      'leaves' : int(leaves[t]),
+                      'fanout_hist' : fanout_hist.tolist(),
+                      'level_widths' : widths[width_ptr[t]:width_ptr[t + 1]].tolist()}
+        return out
+
+def kforest_from_ktrees(forest):
+    '''
+    Convert a dictionary of kTree (e.g., the output of extract_hierarchy) into a kForest.
+    Children keep their order, so to_ktrees gives back the same trees.
+    '''
+    keys = list(forest.keys())
+    queue = [forest[k] for k in keys]
+    persons = [t.person for t in queue]
+    parents = [-1] * len(queue)
+    child_ptr = []
+
+    #the queue doubles as the breadth-first node order of the forest
+    pos = 0
+    while pos < len(queue):
+        node = queue[pos]
+        child_ptr.append(len(persons))
+        for c in node.children:
+            queue.append(c)
+            persons.append(c.person)
+            parents.append(pos)
+        pos += 1
+    child_ptr.append(len(persons))
+
+    idx_type = np.int32 if len(persons) < np.iinfo(np.int32).max else np.int64
+    return kForest(_to_array(keys),
+                   _to_array(persons),
+                   np.array(parents, dtype=idx_type),
+                   np.array(child_ptr, dtype=idx_type))
+
+def save_kforest(forest, fpath):
+    #uncompressed, so loading is a straight read of each array
+    np.savez(fpath, keys=forest.keys_arr, person=forest.person,
+             parent=forest.parent, child_ptr=forest.child_ptr)
+
+def load_kforest(fpath):
+    #object arrays (relabelled trees) can only be stored by pickling them
+    with np.load(fpath, allow_pickle=True) as data:
+        return kForest(data['keys'], data['person'], data['parent'], data['child_ptr'])
+
+KFOREST_ARRAYS = ['keys', 'person', 'parent', 'child_ptr']
+
+def save_kforest_dir(forest, dirpath):
+    #one .npy per array, so a large forest can be memory-mapped instead of read whole
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    for a, arr in zip(KFOREST_ARRAYS, [forest.keys_arr, forest.person, forest.parent, forest.child_ptr]):
+        np.save(os.path.join(dirpath, a + '.npy'), arr)
+
+def _load_npy(fpath, mmap_mode):
+    #object arrays (relabelled trees) are pickled, and can't be memory-mapped
+    try:
+        return np.load(fpath, mmap_mode=mmap_mode)
+    except ValueError:
+        return np.load(fpath, allow_pickle=True)
+
+def load_kforest_dir(dirpath, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    return kForest(*[_load_npy(os.path.join(dirpath, a + '.npy'), mmap_mode) for a in KFOREST_ARRAYS])
+
+class ForestStore:
+    '''
+    Random-access forest, for when only a few trees are needed (e.g., the ones rolehier_gen labels).
+    Unlike kForest, every tree is one contiguous segment, in its own breadth-first order:
+
+    node_off:  tree t is nodes node_off[t]..node_off[t+1] (the offset table).
+    person:    the ID of every node.
+    parent:    index of every node's parent within its tree, -1 for the root.
+    child_ptr: CSR offsets within the tree, n_t + 1 of them for a tree of n_t nodes,
+               so tree t's offsets start at node_off[t] + t.
+
+    With the arrays memory-mapped, loading tree k only reads the pages of tree k's segments.
+    '''
+    def __init__(self, keys, node_off, person, parent, child_ptr):
+        self.keys_arr = keys
+        self.node_off = node_off
+        self.person = person
+        self.parent = parent
+        self.child_ptr = child_ptr
+        self._key_pos = None
+
+    def _positions(self):
+        if self._key_pos is None:
+            self._key_pos = {_to_value(k) : i for i, k in enumerate(self.keys_arr)}
+        return self._key_pos
+
+    def __len__(self):
+        return len(self.keys_arr)
+
+    def __iter__(self):
+        return iter(self._positions())
+
+    def __contains__(self, k):
+        return k in self._positions()
+
+    def keys(self):
+        return self._positions().keys()
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def tree_forest(self, k):
+        #tree k alone, as a one-tree kForest over copies of its segments
+        t = self._positions()[k]
+        lo, hi = int(self.node_off[t]), int(self.node_off[t + 1])
+        return kForest(self.keys_arr[t:t + 1].copy(), np.array(self.person[lo:hi]),
+                       np.array(self.parent[lo:hi]), np.array(self.child_ptr[lo + t:hi + t + 1]))
+
+    def __getitem__(self, k):
+        return self.tree_forest(k)[k]
+
+    def tree_size(self, k):
+        t = self._positions()[k]
+        return int(self.node_off[t + 1] - self.node_off[t])
+
+    def num_nodes(self):
+        return len(self.person)
+
+    def arrays(self):
+        return {'keys' : self.keys_arr, 'node_off' : self.node_off, 'person' : self.person,
+                'parent' : self.parent, 'child_ptr' : self.child_ptr}
+
+    def to_kforest(self):
+        return store_to_kforest(self.arrays())
+
+    def tree_stats(self):
+        #same as kForest.tree_stats, so forest_stats is vectorized for a store too
+        return self.to_kforest().tree_stats()
+
+def forest_store_arrays(forest):
+    '''
+    ForestStore arrays for a kForest or a dictionary of kTree (a ForestStore's are returned as they are).
+    Restricting kForest's breadth-first order to one tree gives that tree's breadth-first order,
+    so the segments are a stable sort of the nodes by tree, and a node's children start right after
+    the children of every node before it in its tree.
+    '''
+    if isinstance(forest, ForestStore):
+        return forest.arrays()
+    if not isinstance(forest, kForest):
+        forest = kforest_from_ktrees(forest)
+    n_trees = len(forest.keys_arr)
+    _, tree = forest.node_depths()
+    order = np.argsort(tree, kind='stable')
+    node_off = np.zeros(n_trees + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tree, minlength=n_trees), out=node_off[1:])
+
+    new_pos = np.empty(len(order), dtype=np.int64)
+    new_pos[order] = np.arange(len(order))
+    sorted_tree = tree[order]
+    parent = forest.parent[order].astype(np.int64)
+    has_parent = parent >= 0
+    parent[has_parent] = new_pos[parent[has_parent]] - node_off[sorted_tree[has_parent]]
+
+    fanout = np.diff(forest.child_ptr.astype(np.int64))[order]
+    child_ptr = store_child_ptr(fanout, node_off)
+
+    idx_type = np.int32 if len(order) < np.iinfo(np.int32).max else np.int64
+    return {'keys' : forest.keys_arr, 'node_off' : node_off, 'person' : forest.person[order],
+            'parent' : parent.astype(idx_type), 'child_ptr' : child_ptr.astype(idx_type)}
+
+def store_child_ptr(fanout, node_off):
+    #ForestStore child offsets from the fan-out of every node in store order.
+    #per tree: [1, 1 + fan-out of node 0, ...], i.e., the tree's exclusive cumsum of fan-outs shifted by one
+    n_trees = len(node_off) - 1
+    sorted_tree = np.repeat(np.arange(n_trees), np.diff(node_off))
+    ends = np.cumsum(fanout)
+    tree_base = np.zeros(n_trees, dtype=np.int64)
+    tree_base[1:] = ends[node_off[1:-1] - 1]
+    child_ptr = np.empty(len(fanout) + n_trees, dtype=np.int64)
+    child_ptr[np.arange(len(fanout)) + sorted_tree] = 1 + ends - fanout - tree_base[sorted_tree]
+    child_ptr[node_off[1:] + np.arange(n_trees)] = node_off[1:] - node_off[:-1]
+    return child_ptr
+
+def _ranges(starts, counts):
+    #concatenation of starts[i]..starts[i]+counts[i] for every i
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return offsets + np.arange(counts.sum())
+
+def store_subset(store_arrays, tree_idx):
+    '''
+    ForestStore arrays of the trees at positions tree_idx (in that order), e.g., one chunk of a forest
+    for a worker process. parent and child_ptr are tree-local, so the segments are copied as they are.
+    '''
+    node_off = np.asarray(store_arrays['node_off'], dtype=np.int64)
+    tree_idx = np.asarray(tree_idx, dtype=np.int64)
+    sizes = node_off[tree_idx + 1] - node_off[tree_idx]
+    nodes = _ranges(node_off[tree_idx], sizes)
+    slots = _ranges(node_off[tree_idx] + tree_idx, sizes + 1)
+    new_off = np.zeros(len(tree_idx) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=new_off[1:])
+    return {'keys' : np.asarray(store_arrays['keys'])[tree_idx], 'node_off' : new_off,
+            'person' : np.asarray(store_arrays['person'])[nodes], 'parent' : np.asarray(store_arrays['parent'])[nodes],
+            'child_ptr' : np.asarray(store_arrays['child_ptr'])[slots]}
+
+def concat_stores(all_store_arrays):
+    #ForestStore arrays of several forests, one after the other
+    sizes = np.concatenate([np.diff(np.asarray(a['node_off'], dtype=np.int64)) for a in all_store_arrays])
+    node_off = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=node_off[1:])
+    out = {'node_off' : node_off}
+    for a in ['keys', 'person', 'parent', 'child_ptr']:
+        out[a] = np.concatenate([np.asarray(cur[a]) for cur in all_store_arrays])
+    return out
+
+def store_depths(node_off, child_ptr):
+    #depth of every node (a root has depth 1), one pass per level over all the trees at once
+    node_off = np.asarray(node_off, dtype=np.int64)
+    n_trees = len(node_off) - 1
+    depth = np.empty(int(node_off[-1]), dtype=np.int64)
+    live = np.arange(n_trees)
+    lo = np.zeros(n_trees, dtype=np.int64)
+    hi = np.ones(n_trees, dtype=np.int64)
+    d = 1
+    while len(live):
+        depth[_ranges(node_off[live] + lo, hi - lo)] = d
+        slot_base = node_off[live] + live
+        lo, hi = child_ptr[slot_base + lo].astype(np.int64), child_ptr[slot_base + hi].astype(np.int64)
+        more = lo < hi
+        live, lo, hi = live[more], lo[more], hi[more]
+        d += 1
+    return depth
+
+def store_to_kforest(store_arrays):
+    '''
+    The kForest of ForestStore arrays. Sorting the nodes by depth, stably, interleaves the trees' breadth-first
+    orders level by level, which is exactly kForest's forest-wide breadth-first layout.
+    '''
+    node_off = np.asarray(store_arrays['node_off'], dtype=np.int64)
+    child_ptr = np.asarray(store_arrays['child_ptr'])
+    n_trees = len(node_off) - 1
+    n = int(node_off[-1])
+    tree = np.repeat(np.arange(n_trees), np.diff(node_off))
+    order = np.argsort(store_depths(node_off, child_ptr), kind='stable')
+    new_pos = np.empty(n, dtype=np.int64)
+    new_pos[order] = np.arange(n)
+
+    parent = np.asarray(store_arrays['parent']).astype(np.int64)
+    has_parent = parent >= 0
+    parent[has_parent] = new_pos[parent[has_parent] + node_off[tree[has_parent]]]
+    slot = np.arange(n) + tree
+    fanout = (child_ptr[slot + 1] - child_ptr[slot]).astype(np.int64)
+    new_ptr = np.full(n + 1, n_trees, dtype=np.int64)
+    np.cumsum(fanout[order], out=new_ptr[1:])
+    new_ptr[1:] += n_trees
+
+    idx_type = np.int32 if n < np.iinfo(np.int32).max else np.int64
+    return kForest(np.asarray(store_arrays['keys']), np.asarray(store_arrays['person'])[order],
+                   parent[order].astype(idx_type), new_ptr.astype(idx_type))
+
+FOREST_STORE_ARRAYS = ['keys', 'node_off', 'person', 'parent', 'child_ptr']
+
+def save_forest_store(forest, dirpath):
+    store_arrays = forest_store_arrays(forest)
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    for a in FOREST_STORE_ARRAYS:
+        np.save(os.path.join(dirpath, a + '.npy'), store_arrays[a])
+
+def load_forest_store(dirpath, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    return ForestStore(*[_load_npy(os.path.join(dirpath, a + '.npy'), mmap_mode) for a in FOREST_STORE_ARRAYS])
+
+def migrate_pickle(pkl_path, dirpath):
+    #convert a pickled dictionary of kTrees (e.g., amazon_spanningforest.pkl) to a ForestStore directory
+    with open(pkl_path, 'rb') as fh:
+        spanning_forest = pickle.load(fh)
+    save_forest_store(spanning_forest, dirpath)
+
+def load_forest(fpath):
+    #load a spanning forest in any form: a ForestStore or kForest directory, a kForest .npz,
+    #a tree catalog (.db, see tree_catalog.py), or the original pickle of kTrees
+    if fpath.endswith('.db'):
+        return catalog_trees(fpath, catalog_keys(fpath))
+    if os.path.isdir(fpath):
+        if os.path.exists(os.path.join(fpath, 'node_off.npy')):
+            return load_forest_store(fpath)
+        return load_kforest_dir(fpath)
+    if fpath.endswith('.npz'):
+        return load_kforest(fpath)
+    with open(fpath, 'rb') as fh:
+        return pickle.load(fh)
+
+def load_trees(fpath, keys):
+    #just the trees in keys. a ForestStore or a catalog only reads those trees, every other format is loaded whole
+    if fpath.endswith('.db'):
+        return catalog_trees(fpath, keys)
+    spanning_forest = load_forest(fpath)
+    return {k : spanning_forest[k] for k in keys}
+
+if __name__=='__main__':
+    #convert the pickled spanning forest to the compact form, and to the random-access store
+    with open('amazon_spanningforest.pkl', 'rb') as fh:
+        spanning_forest = pickle.load(fh)
+
+    compact_forest = kforest_from_ktrees(spanning_forest)
+    save_kforest(compact_forest, 'amazon_spanningforest.npz')
+    print("Trees: {}, Nodes: {}, Bytes: {}".format(len(compact_forest), compact_forest.num_nodes(), compact_forest.nbytes()))
+    save_forest_store(compact_forest, 'amazon_spanningforest_store')
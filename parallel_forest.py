@@ -0,0 +1,214 @@
+import numpy as np
+import heapq
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+from hierarchy_store import load_hierarchy, hier_roots
+from kforest import (ForestStore, forest_store_arrays, store_child_ptr, store_subset, concat_stores,
+                     store_to_kforest, _to_array)
+
+'''
+Purpose: forest extraction and tree statistics across a process pool.
+Once the roots are known, every tree is independent work, so the roots (or trees) are split into
+chunks of about equal total size, and each worker process handles whole chunks.
+
+Nothing made of kTree objects crosses a process boundary:
+- extraction workers get the path of the edge store (which they memory-map) and a list of roots,
+  and send back their trees as ForestStore arrays (see kforest.py);
+- stats workers get the ForestStore segments of their trees.
+The results are put back in root (or key) order, so they are the same as the serial functions'
+(extract_forest, forest_stats), down to the order of every node's children.
+
+A tree is never split, so one tree that dominates the forest is one worker's job. Relabelling is not here:
+it is a dictionary lookup per node, and sending a worker the labels of its trees takes the same lookups.
+'''
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+def process_pool(jobs):
+    #workers are forked wherever that is possible, even from a process that was itself spawned
+    #(which would otherwise spawn them too): they inherit the parent's modules and indexed hierarchy
+    #instead of importing everything again, which takes seconds per pool
+    ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else None
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=ctx)
+
+def balanced_chunks(sizes, n_chunks):
+    '''
+    Positions 0..len(sizes)-1 split into at most n_chunks chunks of about equal total size:
+    biggest first, each to the chunk with the least so far. Every chunk is sorted,
+    so a worker goes through its roots in the same order the serial traversal does.
+    '''
+    sizes = np.asarray(sizes)
+    n_chunks = max(1, min(n_chunks, len(sizes)))
+    heap = [(0, c) for c in range(n_chunks)]
+    members = [[] for _ in range(n_chunks)]
+    for i in np.argsort(-sizes, kind='stable').tolist():
+        total, c = heapq.heappop(heap)
+        members[c].append(i)
+        heapq.heappush(heap, (total + int(sizes[i]), c))
+    return [np.array(sorted(m), dtype=np.int64) for m in members if m]
+
+def root_size_estimates(hier, roots):
+    '''
+    Estimated tree size of every root. With an edge store, every node follows one of its managers
+    up to a root by pointer jumping (a few vectorized passes), which is exact when everyone has
+    one manager. Otherwise, the estimate is the root's direct reports plus one.
+    '''
+    if not hasattr(hier, 'edge_positions'):
+        return np.array([len(hier[r]['parent']) + 1 for r in roots], dtype=np.int64)
+    n = len(hier.nodes)
+    p_idx, m_idx = hier.edge_positions()
+    up = np.arange(n)
+    up[p_idx] = m_idx
+    #after log2(n) doublings every node that reaches a root points at it. nodes in manager cycles
+    #never settle, so the passes are bounded rather than run until nothing changes
+    for _ in range(max(1, int(np.ceil(np.log2(max(n, 2)))))):
+        nxt = up[up]
+        if np.array_equal(nxt, up):
+            break
+        up = nxt
+    counts = np.bincount(up, minlength=n)
+    return counts[hier.lookup(np.asarray(roots))]
+
+def traverse_roots(hier, roots, visited=None):
+    '''
+    The trees of roots, traversed exactly like traverse_children_iter (and sharing visited the same way),
+    as ForestStore arrays. Roots already visited give no tree, as in extract_forest.
+    Returns (positions in roots of the trees made, store arrays).
+    '''
+    if visited is None:
+        visited = set()
+    made = []
+    persons = []
+    parents = []
+    depths = []
+    trees = []
+    for i, r in enumerate(roots):
+        if r in visited:
+            continue
+        t = len(made)
+        made.append(i)
+        visited.add(r)
+        stack = [(len(persons), iter(hier[r]['parent']))]
+        persons.append(r)
+        parents.append(-1)
+        depths.append(0)
+        trees.append(t)
+        while stack:
+            cur, hier_parents = stack[-1]
+            for p in hier_parents:
+                if p in visited:
+                    continue
+                visited.add(p)
+                stack.append((len(persons), iter(hier[p]['parent'])))
+                persons.append(p)
+                parents.append(cur)
+                depths.append(depths[cur] + 1)
+                trees.append(t)
+                break
+            else:
+                stack.pop()
+
+    #depth-first discovery order, sorted stably by (tree, depth), is every tree's breadth-first order:
+    #a node's children are found in order, and all of them before anything its later siblings lead to
+    n = len(persons)
+    tree = np.array(trees, dtype=np.int64)
+    parent = np.array(parents, dtype=np.int64)
+    order = np.lexsort((np.array(depths, dtype=np.int64), tree))
+    new_pos = np.empty(n, dtype=np.int64)
+    new_pos[order] = np.arange(n)
+    node_off = np.zeros(len(made) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tree, minlength=len(made)), out=node_off[1:])
+
+    has_parent = parent >= 0
+    fanout = np.bincount(new_pos[parent[has_parent]], minlength=n)
+    parent[has_parent] = new_pos[parent[has_parent]] - node_off[tree[has_parent]]
+    idx_type = np.int32 if n < np.iinfo(np.int32).max else np.int64
+    return made, {'keys' : np.arange(len(made)), 'node_off' : node_off, 'person' : _to_array(persons)[order],
+                  'parent' : parent[order].astype(idx_type),
+                  'child_ptr' : store_child_ptr(fanout, node_off).astype(idx_type)}
+
+_worker_hier = {}
+
+def _extract_chunk(hier_path, roots):
+    #each worker loads (memory-maps) the hierarchy once, however many chunks it gets,
+    #unless it was forked from a process that already had it
+    if hier_path not in _worker_hier:
+        _worker_hier[hier_path] = load_hierarchy(hier_path)
+    return traverse_roots(_worker_hier[hier_path], roots)
+
+def parallel_extract_forest(hier_path, jobs=None, chunks_per_job=4):
+    '''
+    extract_forest over a process pool, as a ForestStore. hier_path should be an edge store directory
+    (see hierarchy_store.py): every worker memory-maps it, where a repr file would be parsed by each one.
+    The roots are split into jobs * chunks_per_job chunks (more chunks than workers, so a worker that
+    finishes early takes another one).
+
+    Workers keep their own visited sets, so when someone has several managers, two trees can claim them.
+    That never happens when everyone has one manager; when it does, the trees are gone through in root order
+    and each one that overlaps the trees before it is traversed again, here, with the shared visited set,
+    exactly as extract_forest would.
+    '''
+    if jobs is None:
+        jobs = default_jobs()
+    hier = load_hierarchy(hier_path)
+    roots = hier_roots(hier)
+    print("Roots: {}".format(len(roots)))
+    if not roots:
+        return ForestStore(**traverse_roots(hier, [])[1])
+    chunks = balanced_chunks(root_size_estimates(hier, roots), jobs * chunks_per_job)
+
+    #index the edge store once, here: forked workers inherit it, instead of each one building its own
+    if hasattr(hier, '_build'):
+        hier._build()
+    _worker_hier[hier_path] = hier
+    with process_pool(jobs) as pool:
+        results = list(pool.map(_extract_chunk, [hier_path] * len(chunks), [[roots[i] for i in c] for c in chunks]))
+    del _worker_hier[hier_path]
+    root_pos = np.concatenate([c[np.asarray(made, dtype=np.int64)] for c, (made, _) in zip(chunks, results)])
+    store_arrays = concat_stores([arrays for _, arrays in results])
+    by_root = np.argsort(root_pos, kind='stable')
+
+    person = store_arrays['person']
+    sorted_person = np.sort(person)
+    if not (sorted_person[1:] == sorted_person[:-1]).any():
+        store_arrays = store_subset(store_arrays, by_root)
+    else:
+        pieces = []
+        visited = set()
+        node_off = store_arrays['node_off']
+        for t in by_root.tolist():
+            tree_persons = person[node_off[t]:node_off[t + 1]].tolist()
+            if visited.isdisjoint(tree_persons):
+                visited.update(tree_persons)
+                pieces.append(store_subset(store_arrays, [t]))
+                continue
+            made, arrays = traverse_roots(hier, [roots[root_pos[t]]], visited)
+            if made:
+                pieces.append(arrays)
+        store_arrays = concat_stores(pieces)
+    store_arrays['keys'] = np.arange(len(store_arrays['node_off']) - 1)
+    return ForestStore(**store_arrays)
+
+def _stats_chunk(store_arrays):
+    return store_to_kforest(store_arrays).tree_stats()
+
+def parallel_forest_stats(forest, jobs=None, chunks_per_job=4):
+    '''
+    forest_stats over a process pool, keyed and ordered like the forest. Workers get their trees'
+    ForestStore segments and compute the stats vectorized (kForest.tree_stats).
+    A dictionary of kTree is flattened first, in this process; a ForestStore (e.g., from
+    parallel_extract_forest) is sent as it is.
+    '''
+    if jobs is None:
+        jobs = default_jobs()
+    store_arrays = forest_store_arrays(forest)
+    chunks = balanced_chunks(np.diff(store_arrays['node_off']), jobs * chunks_per_job)
+    with process_pool(jobs) as pool:
+        results = list(pool.map(_stats_chunk, [store_subset(store_arrays, c) for c in chunks]))
+    all_stats = {}
+    for cur_stats in results:
+        all_stats.update(cur_stats)
+    return {k : all_stats[k] for k in ForestStore(**store_arrays)}
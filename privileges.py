@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+
+from kforest import kForest, kforest_from_ktrees, _to_array, _to_value
+
+'''
+Purpose: check that privileges nest along the spanning forest, i.e., that a parent's privileges
+are always a subset of each of its children's privileges (see amazon_access.py).
+
+Every node's privilege set is one row of a bitset matrix: privilege j of node i is bit j % 64
+of the uint64 word bits[i, j // 64]. With a few thousand privileges a row is a few hundred bytes,
+so set union is a bitwise OR of two rows, and a subset test is (parent & ~child) == 0.
+
+kForest lays the nodes out level by level, so both effective privileges and the audit
+are one vectorized operation per level (or over all edges at once), never a loop over Python sets.
+'''
+
+def n_words(n_privileges):
+    return max(1, (n_privileges + 63) // 64)
+
+def as_kforest(forest):
+    #a kForest, a dictionary of kTree, or a single tree
+    if isinstance(forest, kForest):
+        return forest
+    if isinstance(forest, dict):
+        return kforest_from_ktrees(forest)
+    return kforest_from_ktrees({0 : forest})
+
+def node_lookup(forest, ids):
+    #node indices of ids in the forest, -1 for IDs that are not in it (e.g., people in manager cycles)
+    if forest.person.dtype == object or np.asarray(ids).dtype == object:
+        id_pos = {_to_value(p) : i for i, p in enumerate(forest.person)}
+        return np.array([id_pos.get(p, -1) for p in ids], dtype=np.int64)
+
+    ids = np.asarray(ids)
+    if forest.num_nodes() == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    order = np.argsort(forest.person, kind='stable')
+    sorted_person = forest.person[order]
+    found = np.minimum(np.searchsorted(sorted_person, ids), len(sorted_person) - 1)
+    return np.where(sorted_person[found] == ids, order[found], -1)
+
+def privilege_bitsets(forest, assignments, privileges=None):
+    '''
+    Bitset rows for an assignment of privileges to the nodes of forest.
+    assignments is either a dictionary (ID -> iterable of privileges, e.g., from load_resource_sets),
+    or a pair of equal-length arrays (IDs, privileges), e.g., the role and resource arrays from stream_person_con.
+    privileges fixes the column order; by default it is every privilege that appears, sorted.
+    Nodes without an assignment get an empty row. Assignments to IDs that are not in the forest
+    (people in manager cycles never make it into the spanning forest) are skipped, and counted in a printed note.
+    Returns (bits, privileges).
+    '''
+    forest = as_kforest(forest)
+    if isinstance(assignments, dict):
+        ids = []
+        privs = []
+        for k in assignments:
+            for p in assignments[k]:
+                ids.append(k)
+                privs.append(p)
+        ids = _to_array(ids)
+        privs = np.array(privs)
+    else:
+        ids, privs = assignments
+        privs = np.asarray(privs)
+
+    rows = node_lookup(forest, ids) if len(privs) else np.zeros(0, dtype=np.int64)
+    unknown = rows < 0
+    if unknown.any():
+        unknown_ids = pd.unique(np.asarray(ids)[unknown])
+        print("Skipped {} assignments to {} IDs not in the forest, e.g., {}".format(
+            int(unknown.sum()), len(unknown_ids), [_to_value(p) for p in unknown_ids[:10]]))
+        rows = rows[~unknown]
+        privs = privs[~unknown]
+
+    if privileges is None:
+        privileges = np.unique(privs)
+        cols = np.searchsorted(privileges, privs)
+    else:
+        privileges = np.asarray(privileges)
+        order = np.argsort(privileges, kind='stable')
+        found = np.minimum(np.searchsorted(privileges[order], privs), len(privileges) - 1)
+        bad = privileges[order][found] != privs
+        if bad.any():
+            raise Exception("Unknown privileges: {}".format(privs[bad][:10].tolist()))
+        cols = order[found]
+
+    bits = np.zeros((forest.num_nodes(), n_words(len(privileges))), dtype=np.uint64)
+    cols = cols.astype(np.uint64)
+    np.bitwise_or.at(bits, (rows, (cols >> np.uint64(6)).astype(np.int64)), np.uint64(1) << (cols & np.uint64(63)))
+    return bits, privileges
+
+def random_bitsets(forest, n_privileges, per_node=4, seed=0):
+    #every node gets about per_node privileges, uniformly at random. for synthesis and benchmarks
+    forest = as_kforest(forest)
+    rng = np.random.default_rng(seed)
+    n = forest.num_nodes()
+    rows = np.repeat(np.arange(n), per_node)
+    cols = rng.integers(0, n_privileges, size=len(rows)).astype(np.uint64)
+    bits = np.zeros((n, n_words(n_privileges)), dtype=np.uint64)
+    np.bitwise_or.at(bits, (rows, (cols >> np.uint64(6)).astype(np.int64)), np.uint64(1) << (cols & np.uint64(63)))
+    return bits
+
+def effective_privileges(forest, bits):
+    '''
+    Every node's own privileges plus everything it inherits from its ancestors.
+    Roots keep their own rows; every lower level is its own rows OR its parents' effective rows,
+    which are already final because the level above was done first.
+    '''
+    forest = as_kforest(forest)
+    eff = bits.copy()
+    parent = forest.parent
+    for lo, hi in forest.level_ranges()[1:]:
+        eff[lo:hi] |= eff[parent[lo:hi]]
+    return eff
+
+def popcount(bits):
+    #number of set bits in every row
+    if len(bits) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int64)
+    return np.unpackbits(np.ascontiguousarray(bits).view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+
+def decode_bits(row, privileges):
+    #the privileges in one bitset row
+    cols = np.flatnonzero(np.unpackbits(row.view(np.uint8), bitorder='little'))
+    return [_to_value(p) for p in privileges[cols[cols < len(privileges)]]]
+
+def subset_violations(forest, bits, privileges=None, chunk=1 << 16):
+    '''
+    Every parent-child edge where the parent has a privilege the child lacks.
+    Edges are checked a chunk at a time, so the (parent & ~child) rows never exist for the whole forest at once.
+    Returns a DataFrame with the tree key, the two IDs and the number of missing privileges,
+    plus the missing privileges themselves if privileges (the column order of bits) is given.
+    '''
+    forest = as_kforest(forest)
+    n = forest.num_nodes()
+    n_roots = len(forest.keys_arr)
+    parent = forest.parent
+
+    bad_child = []
+    bad_cnt = []
+    for lo in range(n_roots, n, chunk):
+        hi = min(n, lo + chunk)
+        missing = bits[parent[lo:hi]] & ~bits[lo:hi]
+        bad = np.flatnonzero(missing.any(axis=1))
+        bad_child.append(lo + bad)
+        bad_cnt.append(popcount(missing[bad]))
+    bad_child = np.concatenate(bad_child) if bad_child else np.zeros(0, dtype=np.int64)
+    bad_cnt = np.concatenate(bad_cnt) if bad_cnt else np.zeros(0, dtype=np.int64)
+
+    _, tree = forest.node_depths()
+    bad_parent = parent[bad_child]
+    out = pd.DataFrame({'Tree' : forest.keys_arr[tree[bad_child]],
+                        'Parent' : forest.person[bad_parent],
+                        'Child' : forest.person[bad_child],
+                        'Missing Count' : bad_cnt})
+    if privileges is not None:
+        out['Missing'] = [decode_bits(bits[p] & ~bits[c], privileges) for p, c in zip(bad_parent, bad_child)]
+    return out
+
+def audit_privileges(forest, assignments, privileges=None, outpath=None):
+    '''
+    Assign privileges to forest (see privilege_bitsets), report the edges that break the subset rule,
+    and compute effective privileges. The violations are written to outpath if it is given.
+    Returns (effective bits, privileges, violations).
+    '''
+    forest = as_kforest(forest)
+    bits, privileges = privilege_bitsets(forest, assignments, privileges=privileges)
+    violations = subset_violations(forest, bits, privileges=privileges)
+    eff = effective_privileges(forest, bits)
+
+    n_edges = forest.num_nodes() - len(forest.keys_arr)
+    print("Nodes: {}, Privileges: {}, Edges: {}, Violating Edges: {}".format(
+        forest.num_nodes(), len(privileges), n_edges, len(violations)))
+    if outpath is not None:
+        violations.to_csv(outpath, index=False)
+    return eff, privileges, violations
+
+if __name__=='__main__':
+    from kforest import load_forest
+    from amazon_access import load_resource_sets
+
+    spanning_forest = load_forest('amazon_spanningforest.pkl')
+    resource_sets = load_resource_sets('amazon_raw_userhierarchy_resources.npz')
+    audit_privileges(spanning_forest, resource_sets, outpath='amazon_privilege_violations.csv')
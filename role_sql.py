@@ -0,0 +1,164 @@
+import re
+import time
+import pickle
+
+'''
+Purpose: turn the role trees from rolehier_gen (e.g., amazon_roletrees.pkl) into a role hierarchy on Postgres.
+
+Every node becomes a role, and every edge becomes GRANT parent TO child. In Postgres this makes the child
+a member of the parent, so the child inherits the parent's privileges; that is exactly our assumption that
+parents have fewer privileges than their children.
+
+Trees are walked level by level, so a role is always created before it is granted, and the statements are
+streamed straight to the output a transaction at a time, so even very large hierarchies never sit in memory
+as one SQL string. Every statement is on its own line.
+'''
+
+max_ident_len = 63 #Postgres truncates identifiers longer than this
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def quote_literal(text):
+    #one line per statement, so newlines in descriptions become spaces
+    return "'" + text.replace("'", "''").replace('\n', ' ') + "'"
+
+def snake_case(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+def role_name(tree_name, person, used, node_index=None):
+    #a unique, readable role name: the tree name and the role title, in lower snake case.
+    #repeated titles get a numeric suffix, and every name fits in max_ident_len.
+    #used maps every name taken so far to the last suffix tried for it, so repeats don't rescan from 2.
+    #if neither the tree name nor the title has a letter or digit, the name is role_<node_index>
+    #(the node's breadth-first position in its tree), or just role; the description is never used
+    title = person[0] if isinstance(person, tuple) else str(person)
+    base = snake_case(str(tree_name) + '_' + title)
+    if base == '':
+        base = 'role' if node_index is None else 'role_' + str(node_index)
+    base = base[:max_ident_len]
+    if base not in used:
+        used[base] = 1
+        return base
+
+    suffix = used[base]
+    while True:
+        suffix += 1
+        tail = '_' + str(suffix)
+        name = base[:max_ident_len - len(tail)] + tail
+        if name not in used:
+            break
+    used[base] = suffix
+    used[name] = 1
+    return name
+
+def iter_role_statements(trees : dict, grant_batch=100, comments=True):
+    '''
+    Statements for every tree in trees (tree name -> kTree or kTreeView), one level at a time:
+    CREATE ROLE (plus COMMENT ON ROLE with the description) for every role on the level,
+    then GRANT parent TO child for the edges into the level, with all the children of a parent
+    packed into one GRANT, grant_batch at a time.
+    Yields (kind, sql, edges) triples, where kind is 'create', 'comment' or 'grant',
+    and edges is how many parent-child edges the statement covers.
+    '''
+    used = {}
+    for tree_name in trees:
+        root = trees[tree_name]
+        level = [(root, role_name(tree_name, root.person, used, 0), None)]
+        n_named = 1
+        while level != []:
+            for node, role, _ in level:
+                yield 'create', 'CREATE ROLE {};'.format(quote_ident(role)), 0
+                if comments and isinstance(node.person, tuple) and len(node.person) > 1:
+                    yield 'comment', 'COMMENT ON ROLE {} IS {};'.format(quote_ident(role), quote_literal(node.person[1])), 0
+
+            #children of the same parent are next to each other on a level
+            start = 0
+            while start < len(level):
+                parent_role = level[start][2]
+                end = start
+                while end < len(level) and level[end][2] == parent_role:
+                    end += 1
+                if parent_role is not None:
+                    for i in range(start, end, grant_batch):
+                        grantees = [quote_ident(role) for _, role, _ in level[i:min(end, i + grant_batch)]]
+                        yield 'grant', 'GRANT {} TO {};'.format(quote_ident(parent_role), ', '.join(grantees)), len(grantees)
+                start = end
+
+            next_level = []
+            for node, role, _ in level:
+                for c in node.children:
+                    next_level.append((c, role_name(tree_name, c.person, used, n_named), role))
+                    n_named += 1
+            level = next_level
+
+def iter_role_sql(trees : dict, stat_dct : dict, txn_size=1000, grant_batch=100, comments=True):
+    #the statements of iter_role_statements, wrapped in transactions of up to txn_size statements.
+    #counts go into stat_dct as they are produced.
+    for k in ['Roles', 'Comments', 'Grants', 'Grant Edges', 'Statements', 'Transactions']:
+        stat_dct[k] = 0
+    kind_key = {'create' : 'Roles', 'comment' : 'Comments', 'grant' : 'Grants'}
+
+    in_txn = 0
+    for kind, sql, edges in iter_role_statements(trees, grant_batch=grant_batch, comments=comments):
+        if in_txn == 0:
+            yield 'BEGIN;'
+            stat_dct['Transactions'] += 1
+        yield sql
+        stat_dct[kind_key[kind]] += 1
+        stat_dct['Statements'] += 1
+        stat_dct['Grant Edges'] += edges
+        in_txn += 1
+        if in_txn == txn_size:
+            yield 'COMMIT;'
+            in_txn = 0
+    if in_txn > 0:
+        yield 'COMMIT;'
+
+def write_role_sql(trees : dict, outpath, **kwargs):
+    #stream the SQL for trees to outpath. returns (and prints) what was emitted and how long it took
+    stat_dct = {}
+    start = time.perf_counter()
+    with open(outpath, 'w+') as fh:
+        for line in iter_role_sql(trees, stat_dct, **kwargs):
+            print(line, file=fh)
+    stat_dct['Seconds'] = time.perf_counter() - start
+
+    print("Emitted {} statements ({} roles, {} grants covering {} edges) in {} transactions, {:.3f}s".format(
+        stat_dct['Statements'], stat_dct['Roles'], stat_dct['Grants'], stat_dct['Grant Edges'],
+        stat_dct['Transactions'], stat_dct['Seconds']))
+    return stat_dct
+
+def run_role_sql(sql_path, dsn):
+    '''
+    Execute a file from write_role_sql against Postgres, e.g., dsn='dbname=rolebench'.
+    Runs in autocommit mode, so the file's own BEGIN/COMMIT lines set the transactions.
+    psycopg2 is only needed for this step.
+    '''
+    try:
+        import psycopg2
+    except ImportError:
+        raise Exception("run_role_sql needs psycopg2 (pip install psycopg2-binary)")
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    stmt_cnt = 0
+    start = time.perf_counter()
+    try:
+        with conn.cursor() as cur, open(sql_path, 'r') as fh:
+            for line in fh:
+                if line.strip() == '':
+                    continue
+                cur.execute(line)
+                stmt_cnt += 1
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    print("Ran {} statements in {:.3f}s".format(stmt_cnt, elapsed))
+    return stmt_cnt, elapsed
+
+if __name__=='__main__':
+    with open('amazon_roletrees.pkl', 'rb') as fh:
+        roletrees = pickle.load(fh)
+
+    write_role_sql(roletrees, 'amazon_roletrees.sql')
@@ -1,14 +1,25 @@
 import pandas as pd
-from utils.chat_utils import OpenAIHandler
-from amazon_access import kTree
+from amazon_access import kTree, tree_stats
+from kforest import load_trees
 import pickle
-import copy
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-handler = OpenAIHandler('gpt-4o')
+def default_handler():
+    #the LLM client is only needed to label new trees, so it is imported (and set up) on first use.
+    #everything else in this module works without it
+    from utils.chat_utils import OpenAIHandler
+    return OpenAIHandler('gpt-4o')
 
 #TODO: we will manually prompt GPT4 and store the hardcoded values here.
 #but the results would be the same as if we had used a program, which we should do
 #later.
+#UPDATE: gen_roletree/gen_roletrees below now do this through the handler. these maps are kept
+#as they are, since the wide/deep/balance role trees were generated from them.
 ceo_pair = ('CEO', 'The highest-ranking executive in a company or organization, responsible for the overall success and strategic direction of the organization.')
 wide_map = {91342 : ('CEO', 'The highest-ranking executive in a company or organization, responsible for the overall success and strategic direction of the organization.'),
         2249 : ('Chief Operating Officer', 'Oversees the company\'s day-to-day operations and ensures that business processes are efficient and effective.'),
@@ -65,52 +76,305 @@ id2roledesc = {'wide' : wide_map,
                'deep' : deep_map,
                'balance' : balance_map}
 
-def gen_roletree(cur_tree, tree_id, outpref):
-    outfile = outpref + '_id' + str(tree_id) + '.pkl'
-    raise Exception("To be implemented")
+label_sys = ('You are designing a realistic role hierarchy for a company\'s access control policy. '
+             'Every role reports to its manager role, and has fewer privileges than it.')
+
+label_instr = ('For each employee below, give a job title that would report to the given manager title, '
+               'and a one-sentence description of the job. Titles should be distinct from each other '
+               'and from their managers. Answer only with a JSON list of objects with the keys '
+               '"id", "title" and "description", one per employee, in the same order.\n')
+
+class LabelCache:
+    '''
+    Persistent cache of LLM labels, keyed on a hash of the model name and the full prompt.
+    Entries are appended to a JSON-lines file as soon as they arrive,
+    so an interrupted run loses nothing and a rerun only pays for prompts it has not seen.
+    '''
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.entries = {}
+        if os.path.exists(fpath):
+            with open(fpath, 'r') as fh:
+                for line in fh:
+                    if line.strip() != '':
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry['labels']
+    
+    @staticmethod
+    def make_key(model_name, messages):
+        content = json.dumps({'model' : model_name, 'messages' : messages}, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        return self.entries.get(key)
     
+    def put(self, key, labels):
+        self.entries[key] = labels
+        with open(self.fpath, 'a') as fh:
+            print(json.dumps({'key' : key, 'labels' : labels}), file=fh)
 
-def gen_roletrees(ktree_path, outpref, tree_ids):
-    with open(ktree_path, 'rb') as fh:
-        spanning_forest2 = pickle.load(fh)
+class RateLimiter:
+    #at most max_concurrency requests in flight, started at most requests_per_sec per second.
+    #requests run on the limiter's own threads, since the default executor may have fewer than max_concurrency
+    def __init__(self, max_concurrency=8, requests_per_sec=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.sem = asyncio.Semaphore(max_concurrency)
+        self.interval = 1.0 / requests_per_sec if requests_per_sec else 0.0
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
     
-    for tree_id in tree_ids:
-        cur_tree = spanning_forest2[tree_id]
-        gen_roletree(cur_tree, tree_id, outpref)
+    async def __aenter__(self):
+        await self.sem.acquire()
+        async with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.next_start - now)
+            self.next_start = max(now, self.next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.sem.release()
 
-def insert_from_map(cur_tree, cur_map, out_tree):
-    #assume the root node has already been translated, and only the children need translation now
-    new_out = copy.deepcopy(out_tree)
+def parse_labels(response, batch):
+    #the JSON list in the response, as {ID: (title, description)}. None if it is unusable
+    start = response.find('[')
+    end = response.rfind(']')
+    if start < 0 or end < start:
+        return None
+    try:
+        entries = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return None
     
-    if cur_tree.children == []:
-        return new_out
+    by_str = {str(p) : p for p, _ in batch}
+    labels = {}
+    for e in entries:
+        if not isinstance(e, dict) or str(e.get('id')) not in by_str or 'title' not in e or 'description' not in e:
+            continue
+        labels[by_str[str(e['id'])]] = (e['title'], e['description'])
+    if len(labels) != len(batch):
+        return None
+    return labels
+
+async def label_batch(batch, labels, cur_handler, cache, limiter, max_retries=3, backoff=1.0):
+    '''
+    Label one batch of (person, manager) pairs from the same level of a tree, whose managers are already labelled.
+    Unusable responses and handler errors (rate limits, network errors, ...) are retried, up to max_retries tries,
+    waiting backoff, 2 * backoff, ... seconds after each error before queueing on the limiter again.
+    Returns the labels, or None if every try failed, so the other batches carry on.
+    '''
+    employees = [{'id' : str(p), 'manager_title' : labels[m][0], 'manager_description' : labels[m][1]} for p, m in batch]
+    messages = [{'role' : 'system', 'content' : label_sys},
+                {'role' : 'user', 'content' : label_instr + json.dumps(employees, indent=1)}]
+    key = LabelCache.make_key(getattr(cur_handler, 'model_name', ''), messages)
+    cached = cache.get(key)
+    if cached is not None:
+        return {p : tuple(cached[str(p)]) for p, _ in batch}
     
-    for c in cur_tree.children:
-        c_cpy = copy.deepcopy(c)
-        init_tree = kTree(cur_map[c_cpy.person])
-        new_tree = insert_from_map(c_cpy, cur_map, init_tree)
-        new_out.children.append(new_tree)
+    for attempt in range(max_retries):
+        try:
+            async with limiter:
+                #OpenAIHandler is synchronous, so each request runs in a worker thread
+                response = await asyncio.get_running_loop().run_in_executor(limiter.executor, cur_handler.get_response, messages)
+        except Exception as e:
+            print("Labelling request failed (try {} of {}): {!r}".format(attempt + 1, max_retries, e))
+            if attempt + 1 < max_retries:
+                await asyncio.sleep(backoff * 2 ** attempt)
+            continue
+        new_labels = parse_labels(response, batch)
+        if new_labels is not None:
+            cache.put(key, {str(p) : list(new_labels[p]) for p in new_labels})
+            return new_labels
     
-    return new_out
-        
+    return None
 
-def treeid_to_roles(indct : dict, outpref):
+async def label_tree_async(cur_tree, cur_handler, cache, limiter, known_labels=None, root_label=ceo_pair, batch_size=20,
+                           max_retries=3, backoff=1.0):
+    '''
+    Label every person in cur_tree, top level first, so each prompt can show the manager's title.
+    All the unlabelled people on a level are split into prompts of batch_size, which run concurrently.
+    People already in known_labels are kept as they are and cost nothing.
+    A batch that still fails after its retries leaves its people unlabelled, and everyone below them too,
+    since their prompts need their manager's title. Returns (labels, the people left unlabelled).
+    '''
+    labels = dict(known_labels) if known_labels is not None else {}
+    if cur_tree.person not in labels:
+        labels[cur_tree.person] = root_label
+    
+    failed = []
+    level = [(c, cur_tree.person) for c in cur_tree.children]
+    while level != []:
+        todo = [(c.person, m) for c, m in level if c.person not in labels and m in labels]
+        failed.extend(c.person for c, m in level if c.person not in labels and m not in labels)
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+        results = await asyncio.gather(*[label_batch(b, labels, cur_handler, cache, limiter,
+                                                     max_retries=max_retries, backoff=backoff) for b in batches])
+        for b, r in zip(batches, results):
+            if r is None:
+                failed.extend(p for p, _ in b)
+            else:
+                labels.update(r)
+        level = [(g, c.person) for c, _ in level for g in c.children]
+    
+    return labels, failed
+
+async def gen_roletrees_async(trees, outpref, cur_handler, cache_path, known_labels=None,
+                              max_concurrency=8, requests_per_sec=None, batch_size=20, max_retries=3, backoff=1.0):
+    '''
+    Label the trees concurrently and pickle every fully labelled role tree to outpref_id<tree>.pkl.
+    Trees with people that could not be labelled are not pickled; their unlabelled IDs are printed and
+    written to outpref_label_failures.json, and a rerun only asks for those (everything else is cached).
+    Returns {tree : ID -> (title, description) map}, partial for the trees that failed.
+    '''
+    cache = LabelCache(cache_path)
+    limiter = RateLimiter(max_concurrency=max_concurrency, requests_per_sec=requests_per_sec)
+    tree_ids = list(trees.keys())
+    try:
+        all_results = await asyncio.gather(*[label_tree_async(trees[t], cur_handler, cache, limiter,
+                                                              known_labels=known_labels, batch_size=batch_size,
+                                                              max_retries=max_retries, backoff=backoff)
+                                             for t in tree_ids])
+    finally:
+        limiter.executor.shutdown(wait=False)
+    
     outdct = {}
+    failures = {}
+    for tree_id, (labels, failed) in zip(tree_ids, all_results):
+        outdct[tree_id] = labels
+        if failed != []:
+            failures[str(tree_id)] = failed
+            continue
+        role_tree = relabel_tree(trees[tree_id], labels)
+        outfile = outpref + '_id' + str(tree_id) + '.pkl'
+        with open(outfile, 'wb') as fh:
+            pickle.dump(role_tree, fh)
+    
+    if failures != {}:
+        print("Could not label {} people in trees {}; see {}".format(
+            sum(len(f) for f in failures.values()), list(failures.keys()), outpref + '_label_failures.json'))
+        with open(outpref + '_label_failures.json', 'w+') as fh:
+            json.dump(failures, fh)
+    return outdct
+
+def gen_roletree(cur_tree, tree_id, outpref, cur_handler=None, cache_path='role_label_cache.jsonl', **kwargs):
+    #label one ID tree through the LLM and pickle the role tree. returns the ID -> (title, description) map
+    if cur_handler is None:
+        cur_handler = default_handler()
+    outdct = asyncio.run(gen_roletrees_async({tree_id : cur_tree}, outpref, cur_handler, cache_path, **kwargs))
+    return outdct[tree_id]
+
+def gen_roletrees(ktree_path, outpref, tree_ids, cur_handler=None, cache_path='role_label_cache.jsonl', **kwargs):
+    '''
+    Label many trees of a spanning forest (a kTree pickle, a kForest .npz, or a ForestStore directory,
+    which only reads the trees in tree_ids) concurrently.
+    kwargs go to gen_roletrees_async: known_labels, max_concurrency, requests_per_sec, batch_size,
+    max_retries and backoff.
+    '''
+    if cur_handler is None:
+        cur_handler = default_handler()
+    trees = load_trees(ktree_path, tree_ids)
+    return asyncio.run(gen_roletrees_async(trees, outpref, cur_handler, cache_path, **kwargs))
+
+def unmapped_ids(cur_tree, cur_map):
+    #every person in cur_tree without an entry in cur_map, in the order they are found
+    missing = []
+    stack = [cur_tree]
+    while stack:
+        node = stack.pop()
+        if node.person not in cur_map:
+            missing.append(node.person)
+        stack.extend(node.children)
+    return missing
+
+def relabel_tree(cur_tree, cur_map):
+    #walks the ID tree once and builds the labelled tree directly, without copying either tree.
+    #children keep their order.
+    out_tree = kTree(cur_map[cur_tree.person])
+    stack = [(cur_tree, out_tree)]
+    while stack:
+        src, dst = stack.pop()
+        for c in src.children:
+            new_c = kTree(cur_map[c.person])
+            dst.children.append(new_c)
+            stack.append((c, new_c))
+    return out_tree
+
+class RoleTreeView:
+    '''
+    Lazy relabelling: wraps an ID tree (kTree or kTreeView) and maps person through the label dictionary
+    on access, so no second tree is built. Has the same interface as kTree.
+    '''
+    def __init__(self, id_tree, cur_map):
+        self.id_tree = id_tree
+        self.cur_map = cur_map
+    
+    @property
+    def person(self):
+        return self.cur_map[self.id_tree.person]
+    
+    @property
+    def children(self):
+        return [RoleTreeView(c, self.cur_map) for c in self.id_tree.children]
+    
+    def tree2dict(self):
+        return relabel_tree(self.id_tree, self.cur_map).tree2dict()
+    
+    def max_depth(self):
+        return tree_stats(self.id_tree)['max_depth']
+    
+    def min_depth(self):
+        return tree_stats(self.id_tree)['min_depth']
+    
+    def num_nodes(self):
+        return tree_stats(self.id_tree)['nodes']
+    
+    def contains(self, person_value):
+        stack = [self.id_tree]
+        while stack:
+            node = stack.pop()
+            if self.cur_map[node.person] == person_value:
+                return True
+            stack.extend(node.children)
+        return False
+
+def relabel_trees(indct : dict, label_maps=None, lazy=False):
+    '''
+    Relabel many ID trees in one call. indct maps a tree name to its ID tree, and label_maps
+    (id2roledesc by default) maps the same name to that tree's ID -> (role, description) dictionary.
+    Every tree is checked before any work is done, and all the unmapped IDs are reported together.
+    With lazy=True, the trees are wrapped in RoleTreeView instead of being rebuilt.
+    '''
+    if label_maps is None:
+        label_maps = id2roledesc
+    
+    no_map = [k for k in indct if k not in label_maps]
+    if no_map != []:
+        raise Exception("No role mappings available: {}, {}".format(no_map, label_maps.keys()))
+    
+    missing = {}
     for k in indct:
-        if k not in id2roledesc:
-            raise Exception("No role mappings available: {}, {}".format(k, id2roledesc.keys()))
-        cur_map = id2roledesc[k]
-        cur_tree = indct[k]
-        out_tree = kTree(cur_map[cur_tree.person])
-        new_tree = insert_from_map(cur_tree, cur_map, out_tree)
-        outdct[k] = copy.deepcopy(new_tree)
+        cur_missing = unmapped_ids(indct[k], label_maps[k])
+        if cur_missing != []:
+            missing[k] = cur_missing
+    if missing != {}:
+        raise Exception("IDs without a role mapping, by tree: {}".format(missing))
+    
+    if lazy:
+        return {k : RoleTreeView(indct[k], label_maps[k]) for k in indct}
+    return {k : relabel_tree(indct[k], label_maps[k]) for k in indct}
+
+def treeid_to_roles(indct : dict, outpref, label_maps=None):
+    outdct = relabel_trees(indct, label_maps=label_maps)
     
     with open(outpref + '_roletrees.pkl', 'wb') as fh:
         pickle.dump(outdct, fh)
+    
+    return outdct
 
 if __name__=='__main__':
-    with open('amazon_spanningforest.pkl', 'rb') as fh:
-        spanning_forest2 = pickle.load(fh)
+    #the random-access store (see kforest.py) only reads these three trees; the pickle is read whole
+    forest_path = 'amazon_spanningforest_store' if os.path.isdir('amazon_spanningforest_store') else 'amazon_spanningforest.pkl'
+    spanning_forest2 = load_trees(forest_path, [180, 642, 634])
     
     intrees = {'wide' : spanning_forest2[180],
                'deep' : spanning_forest2[642],
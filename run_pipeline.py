@@ -0,0 +1,276 @@
+import numpy as np
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+from ast import literal_eval
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from amazon_access import read_amazon_roles, extract_hierarchy, print_tree_stats
+from hierarchy_store import edges_to_store, save_edge_store
+from kforest import save_forest_store, load_trees
+from rolehier_gen import id2roledesc, treeid_to_roles
+from role_sql import write_role_sql
+
+'''
+Purpose: run the whole pipeline (ingest -> adjacency -> forest -> stats, relabel -> output)
+from one command, instead of uncommenting blocks of amazon_access.__main__ and running rolehier_gen by hand.
+
+Every stage writes its artifact into its own directory under the cache (.pipeline_cache by default),
+named by a hash of the stage, its parameters, the hashes of the artifacts it reads, the contents
+of any input file it reads, and the source of the modules that do its work (stage_modules). So a stage whose
+inputs and code did not change is skipped, a changed stage gets a new hash, and so does everything downstream
+of it, but nothing else. Editing amazon_access.py, for instance, reruns everything from ingest down.
+Code the hash can't see (installed packages, modules not listed in stage_modules) needs --force. Changing only the label maps, for instance,
+reruns relabel and output and reuses the forest. Stages whose inputs are ready run in parallel processes.
+
+The artifacts of the last run are copied to --outdir at the end.
+
+    python run_pipeline.py --input ~/amazon_roles/kaggle/test.csv --trees wide=180 deep=642 balance=634
+'''
+
+#stage -> the stages it reads
+stage_deps = {'ingest' : [],
+              'adjacency' : ['ingest'],
+              'forest' : ['adjacency'],
+              'stats' : ['forest'],
+              'relabel' : ['forest'],
+              'output' : ['relabel']}
+stage_order = ['ingest', 'adjacency', 'forest', 'stats', 'relabel', 'output']
+
+#the modules whose code each stage runs; editing one invalidates the stage's cached artifact
+stage_modules = {'ingest' : ['amazon_access.py'],
+                 'adjacency' : ['hierarchy_store.py'],
+                 'forest' : ['amazon_access.py', 'hierarchy_store.py', 'kforest.py', 'tree_catalog.py'],
+                 'stats' : ['amazon_access.py', 'kforest.py'],
+                 'relabel' : ['rolehier_gen.py', 'kforest.py'],
+                 'output' : ['role_sql.py']}
+
+#what each stage leaves in --outdir
+stage_exports = {'stats' : ['amazon_tree_stats.csv'],
+                 'relabel' : ['amazon_roletrees.pkl'],
+                 'output' : ['amazon_roletrees.sql']}
+
+def run_ingest(outdir, inputs, params):
+    df = read_amazon_roles(params['input'])
+    np.savez(os.path.join(outdir, 'roles.npz'), id=df['id'].to_numpy(), MGR_ID=df['MGR_ID'].to_numpy(),
+             ROLE_TITLE=df['ROLE_TITLE'].to_numpy())
+    print("Ingested {} rows from {}".format(len(df), params['input']))
+
+def run_adjacency(outdir, inputs, params):
+    #the edge store get_person_con would write for the same rows
+    with np.load(os.path.join(inputs['ingest'], 'roles.npz')) as data:
+        store_arrays = edges_to_store(data['id'], data['MGR_ID'])
+    save_edge_store(os.path.join(outdir, 'hier'), store_arrays)
+    print("Stored {} edges between {} people".format(len(store_arrays['person']), len(store_arrays['nodes'])))
+
+def run_forest(outdir, inputs, params):
+    #the pickle (and its catalog), plus the random-access store, so relabel only reads the trees it needs
+    spanning_forest = extract_hierarchy(os.path.join(inputs['adjacency'], 'hier'), method=params['method'],
+                                        outpath=os.path.join(outdir, 'amazon_spanningforest.pkl'))
+    save_forest_store(spanning_forest, os.path.join(outdir, 'amazon_spanningforest_store'))
+    print("Length of Spanning forest: {}".format(len(spanning_forest)))
+
+def run_stats(outdir, inputs, params):
+    with open(os.path.join(inputs['forest'], 'amazon_spanningforest.pkl'), 'rb') as fh:
+        spanning_forest = pickle.load(fh)
+    print_tree_stats(spanning_forest, outpath=os.path.join(outdir, 'amazon_tree_stats.csv'))
+
+def load_label_maps(label_path):
+    #label maps are {tree name : {ID : (role, description)}}, as a pickle or as a Python literal.
+    #without a file, rolehier_gen's hardcoded maps are used
+    if label_path is None:
+        return id2roledesc
+    if label_path.endswith('.pkl'):
+        with open(label_path, 'rb') as fh:
+            return pickle.load(fh)
+    return literal_eval(open(label_path, 'r').read())
+
+def run_relabel(outdir, inputs, params):
+    trees = params['trees']
+    id_trees = load_trees(os.path.join(inputs['forest'], 'amazon_spanningforest_store'), list(trees.values()))
+    indct = {name : id_trees[trees[name]] for name in trees}
+    treeid_to_roles(indct, os.path.join(outdir, 'amazon'), label_maps=load_label_maps(params['labels']))
+
+def run_output(outdir, inputs, params):
+    with open(os.path.join(inputs['relabel'], 'amazon_roletrees.pkl'), 'rb') as fh:
+        roletrees = pickle.load(fh)
+    write_role_sql(roletrees, os.path.join(outdir, 'amazon_roletrees.sql'), txn_size=params['txn_size'])
+
+stage_funcs = {'ingest' : run_ingest,
+               'adjacency' : run_adjacency,
+               'forest' : run_forest,
+               'stats' : run_stats,
+               'relabel' : run_relabel,
+               'output' : run_output}
+
+def file_hash(fpath, cache_dir):
+    #sha256 of a file's contents, remembered by (path, size, mtime) so big inputs are only read once
+    memo_path = os.path.join(cache_dir, 'file_hashes.json')
+    memo = json.load(open(memo_path, 'r')) if os.path.exists(memo_path) else {}
+    st = os.stat(fpath)
+    memo_key = '{}|{}|{}'.format(os.path.abspath(fpath), st.st_size, st.st_mtime_ns)
+    if memo_key not in memo:
+        h = hashlib.sha256()
+        with open(fpath, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 24), b''):
+                h.update(block)
+        memo[memo_key] = h.hexdigest()
+        with open(memo_path, 'w+') as fh:
+            json.dump(memo, fh)
+    return memo[memo_key]
+
+def stage_params(args):
+    #the parameters each stage depends on. files are hashed by content, so editing one in place counts
+    return {'ingest' : {'input' : os.path.abspath(args.input)},
+            'adjacency' : {},
+            'forest' : {'method' : args.method},
+            'stats' : {},
+            'relabel' : {'trees' : args.trees,
+                         'labels' : os.path.abspath(args.labels) if args.labels is not None else None},
+            'output' : {'txn_size' : args.txn_size}}
+
+def stage_file_inputs(stage, params):
+    #files outside the cache that a stage reads
+    if stage == 'ingest':
+        return [params['input']]
+    if stage == 'relabel' and params['labels'] is not None:
+        return [params['labels']]
+    #without a file, the default label maps are in rolehier_gen.py, which stage_modules covers
+    return []
+
+def stage_sources(stage):
+    #the module files of a stage, next to this file
+    here = os.path.dirname(os.path.abspath(__file__))
+    return [os.path.join(here, m) for m in stage_modules[stage]]
+
+def stage_keys(all_params, cache_dir):
+    #hash of every stage, in dependency order, so a changed stage changes every stage below it
+    keys = {}
+    for stage in stage_order:
+        h = hashlib.sha256()
+        h.update(json.dumps({'stage' : stage,
+                             'params' : all_params[stage],
+                             'deps' : [keys[d] for d in stage_deps[stage]],
+                             'files' : [file_hash(f, cache_dir) for f in stage_file_inputs(stage, all_params[stage])],
+                             'code' : [file_hash(f, cache_dir) for f in stage_sources(stage)]},
+                            sort_keys=True).encode('utf-8'))
+        keys[stage] = h.hexdigest()[:16]
+    return keys
+
+def artifact_dir(cache_dir, stage, key):
+    return os.path.join(cache_dir, stage, key)
+
+def run_stage(stage, outdir, inputs, params):
+    #build the artifact next to its final place and move it in when done, so an interrupted stage
+    #never looks finished. everything the stage prints goes to stage.log in the artifact.
+    tmp_dir = outdir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    start = time.perf_counter()
+    with open(os.path.join(tmp_dir, 'stage.log'), 'w+') as log, contextlib.redirect_stdout(log):
+        stage_funcs[stage](tmp_dir, inputs, params)
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w+') as fh:
+        json.dump({'stage' : stage, 'params' : params, 'inputs' : inputs, 'seconds' : elapsed}, fh, indent=1)
+    os.replace(tmp_dir, outdir)
+    return elapsed
+
+def run_pipeline(all_params, cache_dir='.pipeline_cache', targets=stage_order, force=(), jobs=2):
+    '''
+    Run the target stages (and the stages they need), skipping the ones whose artifact is cached.
+    force lists stages to rerun anyway; the stages below them rerun too.
+    Up to jobs stages run at once, each in its own process.
+    Returns {stage : (artifact directory, 'cached' or seconds taken)}.
+    '''
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    keys = stage_keys(all_params, cache_dir)
+
+    needed = set()
+    todo = list(targets)
+    while todo:
+        s = todo.pop()
+        if s not in needed:
+            needed.add(s)
+            todo.extend(stage_deps[s])
+    forced = set()
+    for stage in stage_order:
+        if stage in force or any(d in forced for d in stage_deps[stage]):
+            forced.add(stage)
+
+    status = {}
+    pending = [s for s in stage_order if s in needed]
+    for stage in pending:
+        outdir = artifact_dir(cache_dir, stage, keys[stage])
+        if os.path.exists(outdir) and stage not in forced:
+            status[stage] = (outdir, 'cached')
+            print("{}: cached ({})".format(stage, keys[stage]))
+        elif os.path.exists(outdir):
+            shutil.rmtree(outdir)
+    pending = [s for s in pending if s not in status]
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for stage in [s for s in pending if all(d in status for d in stage_deps[s])]:
+                outdir = artifact_dir(cache_dir, stage, keys[stage])
+                inputs = {d : status[d][0] for d in stage_deps[stage]}
+                print("{}: running ({})".format(stage, keys[stage]))
+                running[pool.submit(run_stage, stage, outdir, inputs, all_params[stage])] = stage
+                pending.remove(stage)
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage = running.pop(fut)
+                try:
+                    elapsed = fut.result()
+                except Exception as e:
+                    raise Exception("Stage {} failed, see {}: {}".format(
+                        stage, os.path.join(artifact_dir(cache_dir, stage, keys[stage]) + '.tmp', 'stage.log'), e))
+                status[stage] = (artifact_dir(cache_dir, stage, keys[stage]), elapsed)
+                print("{}: done in {:.3f}s".format(stage, elapsed))
+    return status
+
+def export_artifacts(status, outdir):
+    #copy the final products of the run out of the cache
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    for stage in status:
+        for f in stage_exports.get(stage, []):
+            shutil.copy(os.path.join(status[stage][0], f), os.path.join(outdir, f))
+
+def parse_trees(tree_args):
+    #name=key pairs, with integer keys like the ones extract_hierarchy gives trees
+    trees = {}
+    for t in tree_args:
+        name, key = t.split('=')
+        trees[name] = int(key) if key.lstrip('-').isdigit() else key
+    return trees
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Run the role hierarchy pipeline, reusing cached stages.')
+    parser.add_argument('--input', default=os.path.expanduser('~/amazon_roles/kaggle/test.csv'), help='Kaggle-shaped CSV')
+    parser.add_argument('--trees', nargs='+', default=['wide=180', 'deep=642', 'balance=634'],
+                        help='name=tree key pairs to relabel')
+    parser.add_argument('--labels', default=None,
+                        help='label maps ({name : {ID : (role, description)}}) as .pkl or a Python literal; default: rolehier_gen.id2roledesc')
+    parser.add_argument('--method', default='iterative', help='extraction method')
+    parser.add_argument('--txn-size', type=int, default=1000)
+    parser.add_argument('--stages', nargs='+', choices=stage_order, default=stage_order,
+                        help='stages to produce; the stages they read are run (or reused) as needed')
+    parser.add_argument('--force', nargs='*', choices=stage_order, default=[], help='rerun these stages even if cached')
+    parser.add_argument('--jobs', type=int, default=2)
+    parser.add_argument('--cache-dir', default='.pipeline_cache')
+    parser.add_argument('--outdir', default='.')
+    args = parser.parse_args()
+    args.trees = parse_trees(args.trees)
+
+    start = time.perf_counter()
+    status = run_pipeline(stage_params(args), cache_dir=args.cache_dir, targets=args.stages, force=args.force, jobs=args.jobs)
+    export_artifacts(status, args.outdir)
+    print("Pipeline finished in {:.3f}s".format(time.perf_counter() - start))
@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+import os
+import argparse
+
+from kforest import load_kforest_dir
+
+'''
+Purpose: synthetic role hierarchies of any size and shape, so that we are not limited to scale-testing
+with the three Kaggle trees that rolehier_gen calls 'wide', 'deep' and 'balance'.
+
+A hierarchy is described by its level widths (how many nodes sit at each depth), plus how unevenly
+each level's nodes are shared out among the parents on the level above. The output is written
+straight into the kForest layout (breadth-first, see kforest.py): every level is one contiguous range,
+so a level's parents are one np.repeat and its child offsets one cumsum. Arrays are memory-mapped .npy
+files filled in a level at a time, so even 10M-node hierarchies never exist as Python objects.
+
+Widths either come from a shape ('wide', 'deep', 'balance'), or are copied from the level widths
+that tree_stats / print_tree_stats measure for a real tree, scaled to the target node count.
+'''
+
+shapes = ['wide', 'deep', 'balance']
+
+def geometric_widths(n_nodes, depth, n_trees=1):
+    #level widths n_trees * r^d for d < depth, with r chosen so that they add up to n_nodes
+    if n_nodes < depth * n_trees:
+        raise Exception("{} nodes are not enough for {} trees of depth {}".format(n_nodes, n_trees, depth))
+    if depth == 1:
+        if n_nodes != n_trees:
+            raise Exception("A forest of depth 1 has exactly one node per tree")
+        return np.array([n_trees], dtype=np.int64)
+
+    def total(r):
+        with np.errstate(over='ignore'):
+            return n_trees * np.sum(r ** np.arange(depth, dtype=np.float64))
+    lo, hi = 1.0, 2.0
+    while total(hi) < n_nodes:
+        hi *= 2
+    for _ in range(100):
+        mid = (lo + hi) / 2
+        if total(mid) < n_nodes:
+            lo = mid
+        else:
+            hi = mid
+
+    widths = np.maximum(n_trees, np.floor(n_trees * lo ** np.arange(depth))).astype(np.int64)
+    widths[0] = n_trees
+    fix_total(widths, n_nodes)
+    return widths
+
+def fix_total(widths, n_nodes):
+    #round-off goes to the widest levels below the roots, keeping every level at least 1 wide
+    diff = n_nodes - int(widths.sum())
+    for d in np.argsort(-widths[1:], kind='stable') + 1:
+        if diff == 0:
+            break
+        step = max(diff, 1 - int(widths[d]))
+        widths[d] += step
+        diff -= step
+    if diff != 0:
+        raise Exception("Can't fit {} nodes into {} levels".format(n_nodes, len(widths)))
+
+def shape_widths(shape, n_nodes, n_trees=1, depth=None, fanout=4):
+    '''
+    Level widths for one of the named shapes.
+    wide:    three levels, so almost everyone reports straight to a handful of managers.
+    deep:    about sqrt(n_nodes) levels of similar width.
+    balance: every node has about fanout children, so the depth is log base fanout of n_nodes.
+    depth overrides the depth the shape would pick.
+    '''
+    if shape not in shapes:
+        raise Exception("Unknown shape {}, expected one of {}".format(shape, shapes))
+    per_tree = max(1, n_nodes // n_trees)
+    if depth is None:
+        if shape == 'wide':
+            depth = 3
+        elif shape == 'deep':
+            depth = int(np.sqrt(per_tree))
+        else:
+            depth = int(np.ceil(np.log(per_tree * (fanout - 1) + 1) / np.log(fanout)))
+    depth = max(1, min(depth, per_tree))
+    return geometric_widths(n_nodes, depth, n_trees=n_trees)
+
+def stats_widths(stats, n_nodes=None, n_trees=1):
+    '''
+    Level widths of a real tree, given its tree_stats dictionary, scaled to n_nodes
+    (by default, the tree's own size) and repeated for n_trees trees.
+    The depth is kept exactly, and every width is scaled by the same factor.
+    '''
+    widths = np.array(stats['level_widths'], dtype=np.float64) * n_trees
+    if n_nodes is None:
+        n_nodes = int(widths.sum())
+    widths = np.maximum(1, np.round(widths * n_nodes / widths.sum())).astype(np.int64)
+    widths[0] = n_trees
+    fix_total(widths, n_nodes)
+    return widths
+
+def split_evenly(rng, total, n_parts):
+    #total split into n_parts whole numbers that differ by at most one, the extra ones going to random parts
+    counts = np.full(n_parts, total // n_parts, dtype=np.int64)
+    counts[rng.choice(n_parts, total % n_parts, replace=False)] += 1
+    return counts
+
+def child_counts(rng, tree_lvl, n_trees, n_children, fanout_hist=None, skew=1.0):
+    '''
+    How many of the n_children on the next level go to each parent on this level.
+    tree_lvl is the tree of every parent (non-decreasing, as in the breadth-first layout).
+    Every tree that reaches this level gets an even share of the next level, so the trees of a forest
+    all follow the level widths. Within a tree, parents are weighted: with a fanout histogram
+    (from tree_stats) every parent draws a fan-out from it, so the real fan-out distribution carries over;
+    otherwise the weights are u^skew for uniform u, so skew=0 splits the level evenly, and larger values
+    make a few parents much bigger than the rest. Weights are scaled to the tree's share and rounded down,
+    and the leftover children go one each to parents picked in proportion to what was rounded off.
+    '''
+    n_parents = len(tree_lvl)
+    per_tree = np.bincount(tree_lvl, minlength=n_trees)
+    alive = per_tree > 0
+    tree_total = np.zeros(n_trees, dtype=np.int64)
+    tree_total[alive] = split_evenly(rng, n_children, int(alive.sum()))
+
+    if fanout_hist is not None:
+        hist = np.asarray(fanout_hist, dtype=np.float64)
+        weights = rng.choice(len(hist), size=n_parents, p=hist / hist.sum()).astype(np.float64)
+    else:
+        weights = rng.random(n_parents) ** skew
+    weight_sum = np.bincount(tree_lvl, weights=weights, minlength=n_trees)
+    no_weight = alive & (weight_sum == 0)
+    if no_weight.any():
+        weights[no_weight[tree_lvl]] = 1.0
+        weight_sum = np.bincount(tree_lvl, weights=weights, minlength=n_trees)
+
+    scaled = weights * (tree_total[tree_lvl] / weight_sum[tree_lvl])
+    counts = np.floor(scaled).astype(np.int64)
+    frac = scaled - counts
+    left = tree_total - np.bincount(tree_lvl, weights=counts, minlength=n_trees).astype(np.int64)
+
+    #a weighted sample without replacement per tree: sort every tree's parents by log(u)/frac,
+    #and the first left[tree] of them get one more child
+    with np.errstate(divide='ignore'):
+        priority = np.where(frac > 0, np.log(rng.random(n_parents)) / frac, -np.inf)
+    order = np.lexsort((-priority, tree_lvl))
+    tree_start = np.cumsum(per_tree) - per_tree
+    rank = np.arange(n_parents) - tree_start[tree_lvl[order]]
+    counts[order[rank < left[tree_lvl[order]]]] += 1
+    return counts
+
+def gen_forest(widths, outdir, fanout_hist=None, skew=1.0, seed=0, shuffle_ids=True, id_start=1):
+    '''
+    Write a kForest with the given level widths to outdir (see save_kforest_dir), one level at a time,
+    and return it memory-mapped. widths[0] is the number of trees. Node IDs are id_start onwards,
+    shuffled unless shuffle_ids=False. The same arguments and seed always give the same forest.
+    '''
+    widths = np.asarray(widths, dtype=np.int64)
+    if len(widths) == 0 or widths.min() < 1:
+        raise Exception("Every level needs at least one node: {}".format(widths.tolist()))
+    rng = np.random.default_rng(seed)
+    n = int(widths.sum())
+    n_trees = int(widths[0])
+    offs = np.zeros(len(widths) + 1, dtype=np.int64)
+    np.cumsum(widths, out=offs[1:])
+    idx_type = np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    def open_arr(name, size, dtype):
+        return np.lib.format.open_memmap(os.path.join(outdir, name + '.npy'), mode='w+', dtype=dtype, shape=(size,))
+    keys = open_arr('keys', n_trees, np.int64)
+    person = open_arr('person', n, np.int64)
+    parent = open_arr('parent', n, idx_type)
+    child_ptr = open_arr('child_ptr', n + 1, idx_type)
+
+    keys[:] = np.arange(n_trees)
+    if shuffle_ids:
+        person[:] = rng.permutation(n) + id_start
+    else:
+        person[:] = np.arange(id_start, id_start + n)
+    parent[:n_trees] = -1
+    tree_lvl = np.arange(n_trees)
+    for d in range(len(widths)):
+        lo, hi = offs[d], offs[d + 1]
+        if d + 1 == len(widths):
+            child_ptr[lo:hi + 1] = n
+            break
+        counts = child_counts(rng, tree_lvl, n_trees, int(widths[d + 1]), fanout_hist=fanout_hist, skew=skew)
+        child_ptr[lo:hi] = hi + np.cumsum(counts) - counts
+        parent[hi:offs[d + 2]] = np.repeat(np.arange(lo, hi, dtype=idx_type), counts)
+        tree_lvl = np.repeat(tree_lvl, counts)
+
+    for arr in [keys, person, parent, child_ptr]:
+        arr.flush()
+    del keys, person, parent, child_ptr
+    return load_kforest_dir(outdir)
+
+def gen_shape(shape, n_nodes, outdir, n_trees=1, depth=None, fanout=4, seed=0):
+    #a forest of n_trees trees with a named shape. wide trees are very uneven, balanced ones even
+    widths = shape_widths(shape, n_nodes, n_trees=n_trees, depth=depth, fanout=fanout)
+    skew = {'wide' : 1.0, 'deep' : 2.0, 'balance' : 0.0}[shape]
+    return gen_forest(widths, outdir, skew=skew, seed=seed)
+
+def gen_like(stats, outdir, n_nodes=None, n_trees=1, seed=0):
+    #a forest shaped like a real tree: same depth and (scaled) level widths, and a fan-out
+    #distribution drawn from the tree's fan-out histogram. stats is the tree's tree_stats dictionary
+    widths = stats_widths(stats, n_nodes=n_nodes, n_trees=n_trees)
+    return gen_forest(widths, outdir, fanout_hist=stats['fanout_hist'], seed=seed)
+
+def write_roles_csv(forest, outpath, chunk=1 << 20, seed=0):
+    '''
+    Write a forest as a Kaggle-shaped (id, MGR_ID, ROLE_TITLE) CSV, chunk rows at a time,
+    so it can go through the real pipeline (get_person_con, extract_hierarchy, ...).
+    There is one row per non-root node. Like in the Kaggle data, the roots only ever appear as a MGR_ID,
+    so extract_hierarchy gives back the same trees.
+    A root without children would have no row at all and vanish from the pipeline, and there is no
+    row that keeps it a root, so such forests raise an Exception (in gen_forest, widths[1] >= widths[0] avoids them).
+    '''
+    n_roots = len(forest.keys_arr)
+    singletons = int((forest.child_ptr[1:n_roots + 1] == forest.child_ptr[:n_roots]).sum())
+    if singletons > 0:
+        raise Exception("{} of {} trees are a lone root, which a roles CSV can't represent".format(singletons, n_roots))
+    rng = np.random.default_rng(seed)
+    n = forest.num_nodes()
+    n_titles = max(10, n // 50)
+    for lo in range(len(forest.keys_arr), n, chunk):
+        hi = min(n, lo + chunk)
+        df = pd.DataFrame({'id' : forest.person[lo:hi], 'MGR_ID' : forest.person[forest.parent[lo:hi]],
+                           'ROLE_TITLE' : rng.integers(100000, 100000 + n_titles, hi - lo)})
+        first = lo == len(forest.keys_arr)
+        df.to_csv(outpath, index=False, mode='w' if first else 'a', header=first)
+    return outpath
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic role hierarchy.')
+    parser.add_argument('--shape', choices=shapes, default='balance')
+    parser.add_argument('--nodes', type=int, default=1000000)
+    parser.add_argument('--trees', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', default=None, help='also write the hierarchy as an (id, MGR_ID, ROLE_TITLE) CSV')
+    args = parser.parse_args()
+
+    outdir = 'synth_{}_{}'.format(args.shape, args.nodes)
+    synth_forest = gen_shape(args.shape, args.nodes, outdir, n_trees=args.trees, depth=args.depth,
+                             fanout=args.fanout, seed=args.seed)
+    print("Trees: {}, Nodes: {}, Levels: {}, written to {}".format(len(synth_forest), synth_forest.num_nodes(),
+                                                                   len(synth_forest.level_ranges()), outdir))
+    if args.csv is not None:
+        write_roles_csv(synth_forest, args.csv, seed=args.seed)
@@ -0,0 +1,136 @@
+import random
+import sys
+
+import pandas as pd
+
+from amazon_access import (build_adj_lst, build_adj_lst_scan, get_person_con, extract_forest, tree_stats, print_tree_stats,
+                           path_length_analysis, chain_length_counts, analyze_hierarchy)
+from kforest import kforest_from_ktrees
+from test_kforest import random_forest
+
+def random_roles(seed, n=60, multi=0.2, dup=0.2):
+    '''
+    A Kaggle-shaped roles DataFrame: people 1..n, each reporting to an earlier person or to a manager ID
+    that is not a person (a root). Some people have a second manager, and some rows are repeated.
+    '''
+    rng = random.Random(seed)
+    rows = []
+    for p in range(1, n + 1):
+        managers = [rng.randrange(1, p) if p > 1 and rng.random() < 0.85 else 1000 + rng.randrange(3)]
+        if rng.random() < multi:
+            managers.append(rng.randrange(1, n + 1))
+        for m in managers:
+            rows.extend([(p, m, rng.randrange(5))] * (2 if rng.random() < dup else 1))
+    rng.shuffle(rows)
+    return pd.DataFrame(rows, columns=['id', 'MGR_ID', 'ROLE_TITLE'])
+
+def test_indexed_adjacency_matches_scan():
+    for seed in range(5):
+        df = random_roles(seed)
+        fast = build_adj_lst(df)
+        scan = build_adj_lst_scan(df)
+        assert fast == scan
+        #same keys in the same order, and the same lists in the same order
+        assert list(fast[0]) == list(scan[0])
+        assert all(fast[0][k] == scan[0][k] for k in fast[0])
+
+def test_get_person_con_methods_agree(tmp_path, capsys):
+    df = random_roles(7)
+    df.to_csv(tmp_path / 'roles.csv', index=False)
+    scan = get_person_con(str(tmp_path / 'roles.csv'), method='scan', outpath=str(tmp_path / 'scan.json'))
+    scan_out = capsys.readouterr().out
+    fast = get_person_con(str(tmp_path / 'roles.csv'), outpath=str(tmp_path / 'fast.json'))
+    assert fast == scan and list(fast) == list(scan)
+    assert capsys.readouterr().out == scan_out
+    assert (tmp_path / 'scan.json').read_text() == (tmp_path / 'fast.json').read_text()
+
+def test_iterative_extraction_matches_recursive():
+    for seed in range(5):
+        hier = build_adj_lst(random_roles(seed))[0]
+        iterative = extract_forest(hier)
+        recursive = extract_forest(hier, method='recursive')
+        assert list(iterative) == list(recursive)
+        assert all(iterative[k].tree2dict() == recursive[k].tree2dict() for k in iterative)
+
+def test_iterative_extraction_handles_deep_chains():
+    #a management chain well past the recursion limit
+    n = sys.getrecursionlimit() + 500
+    df = pd.DataFrame({'id' : range(1, n + 1), 'MGR_ID' : range(0, n), 'ROLE_TITLE' : 0})
+    forest = extract_forest(build_adj_lst(df)[0])
+    assert list(forest) == [0]
+    assert tree_stats(forest[0])['max_depth'] == n + 1
+
+def brute_force_stats(tree):
+    #every node with its depth, from a plain recursive walk
+    nodes = []
+    def walk(node, d):
+        nodes.append((node, d))
+        for c in node.children:
+            walk(c, d + 1)
+    walk(tree, 1)
+    depths = [d for _, d in nodes]
+    leaf_depths = [d for x, d in nodes if x.children == []]
+    fanouts = [len(x.children) for x, _ in nodes]
+    return {'max_depth' : max(depths), 'min_depth' : min(leaf_depths), 'nodes' : len(nodes), 'leaves' : len(leaf_depths),
+            'fanout_hist' : [fanouts.count(f) for f in range(max(fanouts) + 1)],
+            'level_widths' : [depths.count(d) for d in range(1, max(depths) + 1)]}
+
+def test_tree_stats_match_brute_force(tmp_path):
+    forest = random_forest(4, n_trees=6)
+    for k in forest:
+        assert tree_stats(forest[k]) == brute_force_stats(forest[k])
+        assert forest[k].min_depth() == brute_force_stats(forest[k])['min_depth']
+
+    stat_df = print_tree_stats(forest, outpath=str(tmp_path / 'stats.csv'))
+    assert stat_df['Key'].tolist() == list(forest)
+    assert stat_df['Nodes'].tolist() == [brute_force_stats(forest[k])['nodes'] for k in forest]
+    assert stat_df['Level Widths'].tolist() == [str(brute_force_stats(forest[k])['level_widths']) for k in forest]
+    #a kForest gives the same file
+    print_tree_stats(kforest_from_ktrees(forest), outpath=str(tmp_path / 'stats_kforest.csv'))
+    assert (tmp_path / 'stats.csv').read_text() == (tmp_path / 'stats_kforest.csv').read_text()
+
+def brute_force_paths(hier):
+    #longest chain above and below every person, in nodes, by depth-first search; None where a cycle makes it unbounded
+    up = {k : [m for m in hier[k]['child'] if m != k] for k in hier}
+    down = {k : [p for p in hier[k]['parent'] if p != k] for k in hier}
+    def reach(adj, x):
+        seen = set()
+        stack = list(adj[x])
+        while stack:
+            y = stack.pop()
+            if y not in seen:
+                seen.add(y)
+                stack.extend(adj[y])
+        return seen
+    on_cycle = {k for k in hier if k in reach(up, k)}
+    def longest(adj, x):
+        if on_cycle & (reach(adj, x) | {x}):
+            return None
+        return 1 + max([longest(adj, y) for y in adj[x]], default=0)
+    out = {}
+    for k in hier:
+        depth, height = longest(up, k), longest(down, k)
+        if depth is None or height is None:
+            out[k] = (-1, -1, -1)
+        else:
+            out[k] = (depth, height, depth + height - 1)
+    return out
+
+def test_path_lengths_match_brute_force(tmp_path):
+    for seed in range(5):
+        df = random_roles(seed, n=40)
+        hier = build_adj_lst(df)[0]
+        path_df = path_length_analysis(hier)
+        expect = brute_force_paths(hier)
+        assert path_df['Node'].tolist() == list(hier)
+        assert [tuple(r) for r in path_df[['Depth', 'Height', 'Longest Chain']].values.tolist()] == [expect[k] for k in hier]
+
+        chain = [c for _, _, c in expect.values() if c > 0]
+        counts = chain_length_counts(path_df)
+        assert counts['Path Length'].tolist() == list(range(1, max(chain) + 1))
+        assert counts['Nodes'].tolist() == [sum(c >= k for c in chain) for k in range(1, max(chain) + 1)]
+
+        #the edge store gives the same analysis
+        df.to_csv(tmp_path / 'roles.csv', index=False)
+        get_person_con(str(tmp_path / 'roles.csv'), outpath=str(tmp_path / 'hier_{}'.format(seed)))
+        assert analyze_hierarchy(str(tmp_path / 'hier_{}'.format(seed)), mode='distribution').equals(path_df)
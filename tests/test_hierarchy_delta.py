@@ -0,0 +1,60 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from amazon_access import extract_forest, extract_hierarchy, get_person_con
+from hierarchy_delta import update_hierarchy
+from hierarchy_store import DELTA_DB, compact_store, load_hierarchy
+from kforest import load_forest
+
+def canon(t):
+    return (t.person, tuple(sorted(canon(c) for c in t.children)))
+
+def write_delta(path, rows):
+    pd.DataFrame(rows, columns=['op', 'id', 'MGR_ID']).to_csv(path, index=False)
+
+def test_update_matches_fresh_extraction(tmp_path):
+    #two trees: 1 -> 2 -> 3, 2 -> 4 and 10 -> 11
+    roles = pd.DataFrame({'id' : [2, 3, 4, 11], 'MGR_ID' : [1, 2, 2, 10], 'ROLE_TITLE' : [0, 0, 0, 0]})
+    roles.to_csv(tmp_path / 'roles.csv', index=False)
+    hier_path = str(tmp_path / 'hier')
+    forest_path = str(tmp_path / 'forest.pkl')
+    get_person_con(str(tmp_path / 'roles.csv'), outpath=hier_path)
+    extract_hierarchy(hier_path, outpath=forest_path)
+
+    #2 moves under 10 (a merge of its subtree), 5 is hired under 3, 11 leaves
+    delta_path = str(tmp_path / 'delta.csv')
+    write_delta(delta_path, [['change', 2, 10], ['add', 5, 3], ['remove', 11, 10]])
+    update_hierarchy(hier_path, forest_path, delta_path, diff_path=None)
+    #a second delta builds on the first: 4 becomes a root
+    write_delta(delta_path, [['remove', 4, 2]])
+    update_hierarchy(hier_path, forest_path, delta_path, diff_path=None)
+
+    hier = load_hierarchy(hier_path)
+    fresh = extract_forest(hier)
+    updated = load_forest(forest_path.replace('.pkl', '_catalog.db'))
+    assert sorted(canon(t) for t in updated.values()) == sorted(canon(t) for t in fresh.values())
+
+    #delta.db holds one row per changed key, not every row of every delta
+    with sqlite3.connect(os.path.join(hier_path, DELTA_DB)) as conn:
+        keys = [k for k, in conn.execute("SELECT key FROM overlay")]
+    assert len(keys) == len(set(keys))
+
+    compact_store(hier_path)
+    assert not os.path.exists(os.path.join(hier_path, DELTA_DB))
+    assert load_hierarchy(hier_path).to_dict() == hier.to_dict()
+
+def test_saved_index_matches_built_index(tmp_path):
+    roles = pd.DataFrame({'id' : [5, 3, 9, 3], 'MGR_ID' : [7, 7, 5, 5], 'ROLE_TITLE' : [0, 0, 0, 0]})
+    roles.to_csv(tmp_path / 'roles.csv', index=False)
+    hier_path = str(tmp_path / 'hier')
+    get_person_con(str(tmp_path / 'roles.csv'), outpath=hier_path)
+    saved = load_hierarchy(hier_path)
+    for a in ['sorted_nodes', 'node_order', 'child_order', 'child_ptr', 'parent_ptr']:
+        os.remove(os.path.join(hier_path, a + '.npy'))
+    built = load_hierarchy(hier_path)
+    assert saved.to_dict() == built.to_dict()
+    assert 42 not in saved and saved[3] == {'parent' : [], 'child' : [7, 5]}
+    assert np.array_equal(saved.lookup([9, 7]), built.lookup([9, 7]))
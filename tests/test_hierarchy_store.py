@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+from amazon_access import get_person_con
+from hierarchy_store import (adj_lst_to_store, convert_repr_hierarchy, hier_roots, load_edge_store, load_hierarchy,
+                             save_edge_store)
+from test_amazon_access import random_roles
+
+def test_edge_store_matches_repr(tmp_path):
+    for seed in range(3):
+        df = random_roles(seed)
+        df.to_csv(tmp_path / 'roles.csv', index=False)
+        repr_path = str(tmp_path / 'hier.json')
+        store_path = str(tmp_path / 'hier_{}'.format(seed))
+        get_person_con(str(tmp_path / 'roles.csv'), outpath=repr_path)
+        get_person_con(str(tmp_path / 'roles.csv'), outpath=store_path)
+
+        raw_adj_lst = load_hierarchy(repr_path)
+        store = load_hierarchy(store_path)
+        assert isinstance(store.person, np.memmap)
+        assert len(store) == len(raw_adj_lst) and list(store) == list(raw_adj_lst)
+        assert all(store[k] == raw_adj_lst[k] for k in raw_adj_lst)
+        assert store.to_dict() == raw_adj_lst
+        assert hier_roots(store) == hier_roots(raw_adj_lst)
+        assert 10**9 not in store
+
+def test_repr_converts_exactly(tmp_path):
+    #a dictionary whose lists are not in row order still round-trips through the store
+    raw_adj_lst = {3 : {'parent' : [], 'child' : [7, 5]},
+                   7 : {'parent' : [5, 3], 'child' : []},
+                   5 : {'parent' : [3], 'child' : [7]}}
+    store_path = str(tmp_path / 'store')
+    save_edge_store(store_path, adj_lst_to_store(raw_adj_lst))
+    loaded = load_edge_store(store_path)
+    assert list(loaded) == [3, 7, 5] and loaded.to_dict() == raw_adj_lst
+
+    repr_path = str(tmp_path / 'hier.json')
+    with open(repr_path, 'w') as fh:
+        print(raw_adj_lst, file=fh)
+    convert_repr_hierarchy(repr_path, str(tmp_path / 'converted'))
+    assert load_edge_store(str(tmp_path / 'converted'), mmap=False).to_dict() == raw_adj_lst
+    assert os.path.exists(str(tmp_path / 'converted' / 'nodes.npy'))
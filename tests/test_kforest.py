@@ -0,0 +1,98 @@
+import pickle
+import random
+
+import numpy as np
+
+from amazon_access import kTree, tree_stats
+from kforest import (kforest_from_ktrees, save_kforest, load_kforest, save_kforest_dir, load_kforest_dir, ForestStore,
+                     forest_store_arrays, store_subset, concat_stores, store_to_kforest, save_forest_store,
+                     load_forest_store, migrate_pickle, load_forest, load_trees)
+
+def random_forest(seed, n_trees=4, n=80, label=None):
+    #kTrees with random shapes: every node hangs under a random earlier node of its tree.
+    #label turns IDs into something else, e.g. (title, description) tuples like relabelled trees
+    rng = random.Random(seed)
+    label = label or (lambda p: p)
+    forest = {}
+    p = 0
+    for k in range(n_trees):
+        nodes = [kTree(label(p))]
+        p += 1
+        for _ in range(rng.randrange(0, n)):
+            node = kTree(label(p))
+            p += 1
+            rng.choice(nodes).children.append(node)
+            nodes.append(node)
+        forest[k * 10] = nodes[0]
+    return forest
+
+def test_kforest_round_trip(tmp_path):
+    for seed in range(3):
+        forest = random_forest(seed)
+        compact = kforest_from_ktrees(forest)
+        back = compact.to_ktrees()
+        assert list(back) == list(forest)
+        assert all(back[k].tree2dict() == forest[k].tree2dict() for k in forest)
+
+        save_kforest(compact, str(tmp_path / 'f.npz'))
+        save_kforest_dir(compact, str(tmp_path / 'f_dir'))
+        for loaded in [load_kforest(str(tmp_path / 'f.npz')), load_kforest_dir(str(tmp_path / 'f_dir'))]:
+            assert all(loaded[k].tree2dict() == forest[k].tree2dict() for k in forest)
+
+def test_relabelled_trees_round_trip(tmp_path):
+    forest = random_forest(1, label=lambda p: ('Title ' + str(p % 7), 'Role ' + str(p)))
+    save_kforest(kforest_from_ktrees(forest), str(tmp_path / 'roles.npz'))
+    loaded = load_kforest(str(tmp_path / 'roles.npz'))
+    assert all(loaded[k].tree2dict() == forest[k].tree2dict() for k in forest)
+
+def test_views_stand_in_for_ktree():
+    forest = random_forest(2)
+    compact = kforest_from_ktrees(forest)
+    all_stats = compact.tree_stats()
+    for k in forest:
+        tree = forest[k]
+        view = compact[k]
+        assert view.person == tree.person
+        assert [c.person for c in view.children] == [c.person for c in tree.children]
+        assert view.max_depth() == tree.max_depth()
+        assert view.min_depth() == tree.min_depth()
+        assert view.num_nodes() == tree.num_nodes()
+        assert tree_stats(view) == tree_stats(tree) == all_stats[k]
+        assert view.contains(tree.children[0].person if tree.children else tree.person)
+        assert not view.contains(-1)
+        assert view.to_ktree().tree2dict() == tree.tree2dict()
+
+def test_forest_store_matches_pickle(tmp_path):
+    forest = random_forest(3, n_trees=6)
+    with open(tmp_path / 'forest.pkl', 'wb') as fh:
+        pickle.dump(forest, fh)
+    migrate_pickle(str(tmp_path / 'forest.pkl'), str(tmp_path / 'store'))
+    save_forest_store(kforest_from_ktrees(forest), str(tmp_path / 'store_from_kforest'))
+
+    store = load_forest(str(tmp_path / 'store'))
+    assert isinstance(store, ForestStore) and isinstance(store.person, np.memmap)
+    assert list(store) == list(forest)
+    all_stats = store.tree_stats()
+    for k in forest:
+        assert store[k].tree2dict() == forest[k].tree2dict()
+        assert store.tree_size(k) == forest[k].num_nodes()
+        assert all_stats[k] == tree_stats(forest[k])
+    #a store written from the kForest holds the same trees
+    back = load_forest_store(str(tmp_path / 'store_from_kforest'), mmap=False).to_kforest().to_ktrees()
+    assert list(back) == list(forest) and all(back[k].tree2dict() == forest[k].tree2dict() for k in forest)
+
+    #only the requested trees, in the requested order
+    some = load_trees(str(tmp_path / 'store'), [50, 10])
+    assert list(some) == [50, 10]
+    assert all(some[k].tree2dict() == forest[k].tree2dict() for k in some)
+
+def test_store_subsets_concatenate_back():
+    forest = random_forest(4, n_trees=7)
+    store_arrays = forest_store_arrays(forest)
+    parts = [store_subset(store_arrays, idx) for idx in [[0, 1, 2], [3], [4, 5, 6]]]
+    whole = concat_stores(parts)
+    for a in store_arrays:
+        assert (np.asarray(whole[a]) == np.asarray(store_arrays[a])).all()
+    back = store_to_kforest(store_subset(store_arrays, [5, 2])).to_ktrees()
+    assert list(back) == [50, 20]
+    assert all(back[k].tree2dict() == forest[k].tree2dict() for k in back)
@@ -0,0 +1,36 @@
+import pytest
+
+from amazon_access import extract_hierarchy, get_person_con, kTree
+from kforest import ForestStore, load_forest
+from synth_hierarchy import gen_shape, write_roles_csv
+from tree_catalog import ForestCatalog, load_trees
+
+def canon(t):
+    return (t.person, [canon(c) for c in t.children])
+
+def test_jobs_give_the_same_forest(tmp_path):
+    forest = gen_shape('balance', 300, str(tmp_path / 'synth'), n_trees=5, seed=1)
+    hier_path = str(tmp_path / 'hier')
+    get_person_con(write_roles_csv(forest, str(tmp_path / 'roles.csv')), outpath=hier_path)
+
+    serial = extract_hierarchy(hier_path, outpath=str(tmp_path / 'serial.pkl'))
+    parallel = extract_hierarchy(hier_path, outpath=str(tmp_path / 'parallel.pkl'), jobs=2)
+    assert isinstance(parallel, ForestStore)
+    assert list(parallel) == list(serial)
+    assert [canon(parallel[k]) for k in parallel] == [canon(serial[k]) for k in serial]
+
+    #the pickle and the catalog hold the same trees, and the catalog still gives hierarchy_delta kTrees
+    reloaded = load_forest(str(tmp_path / 'parallel.pkl'))
+    assert [canon(reloaded[k]) for k in reloaded] == [canon(serial[k]) for k in serial]
+    catalogued = load_trees(str(tmp_path / 'parallel_catalog.db'), list(serial))
+    assert [canon(catalogued[k]) for k in serial] == [canon(serial[k]) for k in serial]
+    catalog = ForestCatalog(str(tmp_path / 'parallel_catalog.db'))
+    try:
+        assert type(catalog.load(0)) is kTree and canon(catalog.load(0)) == canon(serial[0])
+        assert catalog.key_of(serial[1].person) == 1
+    finally:
+        catalog.close()
+
+def test_recursive_is_serial_only(tmp_path):
+    with pytest.raises(Exception, match='Only the iterative method'):
+        extract_hierarchy(str(tmp_path / 'hier'), method='recursive', jobs=2)
@@ -0,0 +1,25 @@
+import numpy as np
+
+from amazon_access import kTree
+from privileges import audit_privileges, node_lookup, as_kforest
+
+def small_forest():
+    #1 manages 2 and 3
+    root = kTree(1)
+    root.children.extend([kTree(2), kTree(3)])
+    return {0 : root}
+
+def test_unknown_ids_are_skipped(capsys):
+    #7 and 8 are not in the forest, as if they were in a management cycle
+    assignments = {1 : ['a'], 2 : ['a', 'b'], 3 : ['b'], 7 : ['a', 'c'], 8 : ['c']}
+    eff, privileges, violations = audit_privileges(small_forest(), assignments)
+    assert "Skipped 3 assignments to 2 IDs not in the forest, e.g., [7, 8]" in capsys.readouterr().out
+    assert privileges.tolist() == ['a', 'b']
+    #3 lacks 'a', which its manager 1 has
+    assert violations[['Parent', 'Child', 'Missing Count']].values.tolist() == [[1, 3, 1]]
+    assert eff.shape == (3, 1)
+
+def test_node_lookup_marks_unknown():
+    forest = as_kforest(small_forest())
+    assert node_lookup(forest, np.array([3, 9, 1])).tolist()[1] == -1
+    assert node_lookup(forest, ['x']).tolist() == [-1]
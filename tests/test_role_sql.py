@@ -0,0 +1,61 @@
+from amazon_access import kTree
+from role_sql import iter_role_sql, role_name, max_ident_len
+
+def role_trees():
+    #two trees that share titles, and a title with no letters or digits
+    ceo = kTree(('CEO', 'Runs the company'))
+    vp = kTree(('VP', "Runs the company's sales"))
+    vp.children.extend([kTree(('Engineer', 'Builds things')), kTree(('Engineer', 'Builds\nthings'))])
+    ceo.children.extend([vp, kTree(('VP', 'Runs ops'))])
+    other = kTree(('CEO', 'Runs the other company'))
+    other.children.append(kTree(('???', 'Unknown role')))
+    return {'t1' : ceo, '' : other}
+
+def test_role_sql_golden():
+    stat_dct = {}
+    lines = list(iter_role_sql(role_trees(), stat_dct, txn_size=8, grant_batch=1))
+    assert lines == [
+        "BEGIN;",
+        "CREATE ROLE \"t1_ceo\";",
+        "COMMENT ON ROLE \"t1_ceo\" IS 'Runs the company';",
+        "CREATE ROLE \"t1_vp\";",
+        "COMMENT ON ROLE \"t1_vp\" IS 'Runs the company''s sales';",
+        "CREATE ROLE \"t1_vp_2\";",
+        "COMMENT ON ROLE \"t1_vp_2\" IS 'Runs ops';",
+        "GRANT \"t1_ceo\" TO \"t1_vp\";",
+        "GRANT \"t1_ceo\" TO \"t1_vp_2\";",
+        "COMMIT;",
+        "BEGIN;",
+        "CREATE ROLE \"t1_engineer\";",
+        "COMMENT ON ROLE \"t1_engineer\" IS 'Builds things';",
+        "CREATE ROLE \"t1_engineer_2\";",
+        "COMMENT ON ROLE \"t1_engineer_2\" IS 'Builds things';",
+        "GRANT \"t1_vp\" TO \"t1_engineer\";",
+        "GRANT \"t1_vp\" TO \"t1_engineer_2\";",
+        "CREATE ROLE \"ceo\";",
+        "COMMENT ON ROLE \"ceo\" IS 'Runs the other company';",
+        "COMMIT;",
+        "BEGIN;",
+        "CREATE ROLE \"role_1\";",
+        "COMMENT ON ROLE \"role_1\" IS 'Unknown role';",
+        "GRANT \"ceo\" TO \"role_1\";",
+        "COMMIT;",
+    ]
+    assert stat_dct == {'Roles' : 7, 'Comments' : 7, 'Grants' : 5, 'Grant Edges' : 5,
+                        'Statements' : 19, 'Transactions' : 3}
+
+def test_role_name_dedup():
+    used = {}
+    names = [role_name('t', ('Engineer', ''), used) for _ in range(3)]
+    assert names == ['t_engineer', 't_engineer_2', 't_engineer_3']
+    #a title that matches a generated name still gets a name of its own
+    assert role_name('t', ('Engineer 2', ''), used) == 't_engineer_2_2'
+    #long names keep their suffix inside the identifier limit
+    long_names = [role_name('t', ('x' * 100, ''), used) for _ in range(2)]
+    assert long_names[0] == ('t_' + 'x' * 100)[:max_ident_len]
+    assert long_names[1].endswith('_2') and len(long_names[1]) == max_ident_len
+    #nothing usable in the tree name or the title
+    assert role_name('', ('!!', ''), used) == 'role'
+    assert role_name('', ('!!', ''), used) == 'role_2'
+    #with the node's position instead, and never from the description
+    assert role_name('', ('!!', 'Secret description'), used, 7) == 'role_7'
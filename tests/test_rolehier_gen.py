@@ -0,0 +1,122 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+from amazon_access import kTree
+import rolehier_gen
+from rolehier_gen import gen_roletrees, LabelCache, RoleTreeView, relabel_trees, treeid_to_roles
+
+class FakeHandler:
+    #answers every labelling prompt with a title made from each ID, and counts the calls
+    model_name = 'fake'
+
+    def __init__(self, fail_on=()):
+        self.calls = 0
+        self.fail_on = set(fail_on)
+
+    def get_response(self, messages):
+        self.calls += 1
+        employees = json.loads(messages[-1]['content'][len(rolehier_gen.label_instr):])
+        if any(e['id'] in self.fail_on for e in employees):
+            raise Exception('rate limited')
+        return json.dumps([{'id' : e['id'], 'title' : 'Title ' + e['id'], 'description' : 'Reports to ' + e['manager_title']}
+                           for e in employees])
+
+def id_trees():
+    #0 manages 1 and 2, 1 manages 3; 10 manages 11
+    t0 = kTree(0)
+    t1 = kTree(1)
+    t1.children.append(kTree(3))
+    t0.children.extend([t1, kTree(2)])
+    t10 = kTree(10)
+    t10.children.append(kTree(11))
+    return {'a' : t0, 'b' : t10}
+
+def small_forest(path):
+    trees = id_trees()
+    with open(path, 'wb') as fh:
+        pickle.dump({0 : trees['a'], 1 : trees['b']}, fh)
+
+def test_import_needs_no_llm_client():
+    #in a fresh interpreter, so the result does not depend on what other tests imported first
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    check = 'import rolehier_gen, sys; assert "utils.chat_utils" not in sys.modules'
+    result = subprocess.run([sys.executable, '-c', check], cwd=repo, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def test_second_run_uses_cache(tmp_path):
+    forest_path = str(tmp_path / 'forest.pkl')
+    cache_path = str(tmp_path / 'cache.jsonl')
+    small_forest(forest_path)
+
+    handler = FakeHandler()
+    first = gen_roletrees(forest_path, str(tmp_path / 'roles'), [0, 1], cur_handler=handler,
+                          cache_path=cache_path, batch_size=2)
+    assert handler.calls > 0
+    assert first[0][3] == ('Title 3', 'Reports to Title 1')
+    assert os.path.exists(str(tmp_path / 'roles_id0.pkl'))
+
+    again = FakeHandler()
+    second = gen_roletrees(forest_path, str(tmp_path / 'roles'), [0, 1], cur_handler=again,
+                           cache_path=cache_path, batch_size=2)
+    assert again.calls == 0
+    assert second == first
+
+    #the cache file reloads to one entry per request, holding the labels that were returned
+    entries = LabelCache(cache_path).entries
+    assert len(entries) == handler.calls
+    reloaded = {}
+    for e in entries.values():
+        reloaded.update({int(p) : tuple(e[p]) for p in e})
+    assert reloaded == {p : l for t in first for p, l in first[t].items() if p not in (0, 10)}
+
+def test_failed_batches_are_reported(tmp_path):
+    forest_path = str(tmp_path / 'forest.pkl')
+    small_forest(forest_path)
+
+    handler = FakeHandler(fail_on={'1'})
+    out = gen_roletrees(forest_path, str(tmp_path / 'roles'), [0, 1], cur_handler=handler,
+                        cache_path=str(tmp_path / 'cache.jsonl'), batch_size=1, max_retries=2, backoff=0)
+    #1 failed both tries, 3 is below it; the other tree is unaffected
+    assert 1 not in out[0] and 3 not in out[0] and 2 in out[0]
+    assert out[1][11] == ('Title 11', 'Reports to CEO')
+    assert not os.path.exists(str(tmp_path / 'roles_id0.pkl'))
+    assert os.path.exists(str(tmp_path / 'roles_id1.pkl'))
+    with open(str(tmp_path / 'roles_label_failures.json')) as fh:
+        assert json.load(fh) == {'0' : [1, 3]}
+
+def label_map(ids):
+    return {p : ('Title ' + str(p), 'Role of ' + str(p)) for p in ids}
+
+def test_lazy_view_matches_eager_relabel():
+    label_maps = {'a' : label_map([0, 1, 2, 3]), 'b' : label_map([10, 11])}
+    eager = relabel_trees(id_trees(), label_maps=label_maps)
+    lazy = relabel_trees(id_trees(), label_maps=label_maps, lazy=True)
+    assert all(isinstance(lazy[k], RoleTreeView) for k in lazy)
+    for k in eager:
+        assert lazy[k].tree2dict() == eager[k].tree2dict()
+        assert lazy[k].person == eager[k].person
+        assert [c.person for c in lazy[k].children] == [c.person for c in eager[k].children]
+        assert lazy[k].num_nodes() == eager[k].num_nodes()
+        assert lazy[k].max_depth() == eager[k].max_depth()
+    assert lazy['a'].contains(('Title 3', 'Role of 3')) and not lazy['a'].contains(('Title 11', 'Role of 11'))
+
+def test_unmapped_ids_are_reported_by_tree(tmp_path):
+    #3 is missing from tree a's map, and 11 from tree b's; nothing is written
+    label_maps = {'a' : label_map([0, 1, 2]), 'b' : label_map([10])}
+    outpref = str(tmp_path / 'amazon')
+    with pytest.raises(Exception) as err:
+        treeid_to_roles(id_trees(), outpref, label_maps=label_maps)
+    assert "IDs without a role mapping, by tree: {'a': [3], 'b': [11]}" in str(err.value)
+    assert not os.path.exists(outpref + '_roletrees.pkl')
+    #the lazy path checks too, rather than failing with a KeyError on first access
+    with pytest.raises(Exception, match='IDs without a role mapping'):
+        relabel_trees(id_trees(), label_maps=label_maps, lazy=True)
+
+def test_trees_without_a_map_are_reported():
+    with pytest.raises(Exception, match=r"No role mappings available: \['b'\]"):
+        relabel_trees(id_trees(), label_maps={'a' : label_map([0, 1, 2, 3])})
@@ -0,0 +1,28 @@
+import argparse
+
+import run_pipeline
+from run_pipeline import stage_keys, stage_params, stage_order
+
+def test_module_edit_invalidates_stage_and_below(tmp_path, monkeypatch):
+    input_path = tmp_path / 'roles.csv'
+    input_path.write_text('id,MGR_ID,ROLE_TITLE\n1,2,3\n')
+    module_path = tmp_path / 'forest_module.py'
+    module_path.write_text('x = 1\n')
+    #pretend the forest stage runs forest_module.py and nothing else is hashed
+    monkeypatch.setattr(run_pipeline, 'stage_sources', lambda stage: [str(module_path)] if stage == 'forest' else [])
+    args = argparse.Namespace(input=str(input_path), method='iterative', trees={'t' : 0}, labels=None, txn_size=10)
+    cache_dir = str(tmp_path / 'cache')
+    (tmp_path / 'cache').mkdir()
+
+    before = stage_keys(stage_params(args), cache_dir)
+    assert stage_keys(stage_params(args), cache_dir) == before
+    module_path.write_text('x = 2  # edited\n')
+    after = stage_keys(stage_params(args), cache_dir)
+
+    changed = [s for s in stage_order if before[s] != after[s]]
+    assert changed == ['forest', 'stats', 'relabel', 'output']
+
+def test_every_stage_lists_existing_modules():
+    import os
+    for stage in stage_order:
+        assert all(os.path.exists(f) for f in run_pipeline.stage_sources(stage))
@@ -0,0 +1,33 @@
+import random
+
+from amazon_access import get_person_con, stream_person_con, load_resource_sets
+from test_amazon_access import random_roles
+
+def test_stream_matches_get_person_con(tmp_path, capsys):
+    #no repeated rows: the store holds exactly get_person_con's raw_adj_lst, whatever the partitions
+    df = random_roles(3, n=200, dup=0).drop_duplicates(['id', 'MGR_ID'])
+    df.to_csv(tmp_path / 'roles.csv', index=False)
+    raw_adj_lst = get_person_con(str(tmp_path / 'roles.csv'), outpath=str(tmp_path / 'hier.json'))
+    expect_out = capsys.readouterr().out
+    for blocksize in [500, '64MB']:
+        store = stream_person_con(str(tmp_path / 'roles.csv'), outpath=str(tmp_path / 'stream'), blocksize=blocksize)
+        assert capsys.readouterr().out == expect_out
+        assert list(store) == list(raw_adj_lst) and store.to_dict() == raw_adj_lst
+
+def test_stream_dedups_rows_and_counts_them(tmp_path, capsys):
+    df = random_roles(4, n=200, dup=0.3)
+    rng = random.Random(4)
+    df['RESOURCE'] = [rng.randrange(20) for _ in range(len(df))]
+    df.to_csv(tmp_path / 'access.csv', index=False)
+    get_person_con(str(tmp_path / 'access.csv'), outpath=str(tmp_path / 'hier.json'))
+    expect_out = capsys.readouterr().out
+
+    store = stream_person_con(str(tmp_path / 'access.csv'), outpath=str(tmp_path / 'stream'),
+                              resource_col='RESOURCE', blocksize=500)
+    #the same Added/Missed counts, per row, but every edge listed once
+    assert capsys.readouterr().out == expect_out
+    edges = df[['id', 'MGR_ID']].drop_duplicates()
+    assert list(zip(store.person.tolist(), store.manager.tolist())) == list(zip(edges['id'], edges['MGR_ID']))
+
+    resources = load_resource_sets(str(tmp_path / 'stream') + '_resources.npz')
+    assert resources == {k : set(v) for k, v in df.groupby('id')['RESOURCE']}
@@ -0,0 +1,21 @@
+import pytest
+
+from amazon_access import get_person_con, extract_forest, tree_stats
+from hierarchy_store import load_hierarchy
+from synth_hierarchy import gen_forest, gen_shape, write_roles_csv
+
+def test_roles_csv_round_trip(tmp_path):
+    forest = gen_shape('balance', 500, str(tmp_path / 'synth'), n_trees=7, seed=3)
+    csv_path = write_roles_csv(forest, str(tmp_path / 'roles.csv'))
+    hier_path = str(tmp_path / 'hier.json')
+    get_person_con(csv_path, outpath=hier_path)
+    trees = extract_forest(load_hierarchy(hier_path))
+
+    assert len(trees) == len(forest.keys_arr) == 7
+    assert sorted(tree_stats(t)['nodes'] for t in trees.values()) == sorted(s['nodes'] for s in forest.tree_stats().values())
+
+def test_lone_roots_are_refused(tmp_path):
+    #5 trees but only 3 nodes below them, so 2 roots have no children
+    forest = gen_forest([5, 3], str(tmp_path / 'synth'))
+    with pytest.raises(Exception, match='2 of 5 trees are a lone root'):
+        write_roles_csv(forest, str(tmp_path / 'roles.csv'))
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from tree_index import TreeIndex
+from test_kforest import random_forest
+
+def naive_ancestry(forest):
+    #parent and depth of every ID, and the tree it is in, by walking every tree
+    parent = {}
+    depth = {}
+    tree = {}
+    for k in forest:
+        stack = [(forest[k], None, 1)]
+        while stack:
+            node, up, d = stack.pop()
+            parent[node.person] = up
+            depth[node.person] = d
+            tree[node.person] = k
+            stack.extend((c, node.person, d + 1) for c in node.children)
+    return parent, depth, tree
+
+def ancestors(parent, x):
+    out = [x]
+    while parent[x] is not None:
+        x = parent[x]
+        out.append(x)
+    return out
+
+def test_index_matches_naive_ancestry():
+    forest = random_forest(5, n_trees=5, n=40)
+    parent, depth, tree = naive_ancestry(forest)
+    index = TreeIndex.from_ktrees(forest)
+
+    ids = np.array(sorted(parent))
+    a = np.repeat(ids, len(ids))
+    b = np.tile(ids, len(ids))
+    expect_anc = np.array([x in ancestors(parent, y)[1:] for x, y in zip(a.tolist(), b.tolist())])
+    assert (index.is_ancestor(a, b) == expect_anc).all()
+    assert (index.is_ancestor(a, b, strict=False) == (expect_anc | (a == b))).all()
+    assert (index.depth_of(ids) == np.array([depth[x] for x in ids.tolist()])).all()
+    assert (index.same_tree(a, b) == np.array([tree[x] == tree[y] for x, y in zip(a.tolist(), b.tolist())])).all()
+
+    def naive_lca(x, y):
+        if tree[x] != tree[y]:
+            return -1
+        above_y = set(ancestors(parent, y))
+        return next(z for z in ancestors(parent, x) if z in above_y)
+    assert index.lca(a, b).tolist() == [naive_lca(x, y) for x, y in zip(a.tolist(), b.tolist())]
+
+    #scalars in, scalars out
+    x, y = ids[3].item(), ids[-1].item()
+    assert index.is_ancestor(x, y) == (x in ancestors(parent, y)[1:])
+    assert index.lca(x, y) == (naive_lca(x, y) if tree[x] == tree[y] else None)
+    with pytest.raises(KeyError):
+        index.depth_of(10**9)
+
+def test_index_takes_tuple_ids():
+    forest = random_forest(6, n_trees=2, n=20, label=lambda p: ('Title', str(p)))
+    parent, depth, _ = naive_ancestry(forest)
+    index = TreeIndex.from_ktrees(forest)
+    for x in parent:
+        assert index.depth_of(x) == depth[x]
+        if parent[x] is not None:
+            assert index.is_ancestor(parent[x], x) and not index.is_ancestor(x, parent[x])
+            assert index.lca(x, parent[x]) == parent[x]
@@ -0,0 +1,231 @@
+import sqlite3
+import pickle
+import json
+import os
+import gc
+import pandas as pd
+
+'''
+Purpose: pick trees of the spanning forest by shape without unpickling the whole forest
+or reading amazon_tree_stats.csv by eye.
+
+The catalog is an SQLite file with one row per tree: its key, the statistics from tree_stats
+(nodes, leaves, min and max depth, fan-out), and the tree itself, pickled on its own.
+The numeric columns are indexed, so a query like "50-200 nodes and depth >= 8" is a few index lookups,
+and only the trees that match are ever unpickled.
+
+extract_hierarchy rebuilds the catalog whenever it writes the forest (see catalog_path_for).
+
+The catalog is also where hierarchy_delta keeps the forest up to date (see ForestCatalog): the members table
+has the tree of every person, so a delta only reads and rewrites the trees it touches, and cut_trees holds
+the subtrees that a manager cycle keeps out of the forest, under negative keys.
+'''
+
+catalog_cols = ['nodes', 'leaves', 'min_depth', 'max_depth', 'max_fanout', 'mean_fanout']
+
+def catalog_path_for(forest_path):
+    #amazon_spanningforest.pkl -> amazon_spanningforest_catalog.db
+    return os.path.splitext(forest_path)[0] + '_catalog.db'
+
+def build_catalog(forest, all_stats, catalog_path):
+    '''
+    Write the catalog for forest (a dictionary of kTree, a kForest or a ForestStore), given its forest_stats.
+    The new catalog is written next to the old one and swapped in at the end,
+    so a reader never sees a half-built catalog.
+    '''
+    tmp_path = catalog_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute('''CREATE TABLE trees (key PRIMARY KEY, nodes INTEGER, leaves INTEGER,
+                        min_depth INTEGER, max_depth INTEGER, max_fanout INTEGER, mean_fanout REAL,
+                        fanout_hist TEXT, level_widths TEXT, tree BLOB)''')
+
+        conn.execute('CREATE TABLE members (person PRIMARY KEY, key INTEGER)')
+        conn.execute('CREATE TABLE cut_trees (key INTEGER PRIMARY KEY, tree BLOB)')
+        conn.execute('CREATE TABLE meta (name PRIMARY KEY, value)')
+
+        conn.executemany('INSERT INTO trees VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (_catalog_row(k, forest[k], all_stats[k]) for k in all_stats))
+        conn.executemany('INSERT INTO members VALUES (?, ?)',
+                         ((p, _plain(k)) for k in all_stats for p in tree_members(forest[k])))
+        next_key = max([_plain(k) for k in all_stats if isinstance(_plain(k), int)], default=-1) + 1
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [('next_key', next_key), ('next_cut_key', -1)])
+        for c in catalog_cols:
+            conn.execute('CREATE INDEX idx_{0} ON trees ({0})'.format(c))
+        conn.execute('CREATE INDEX idx_members_key ON members (key)')
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, catalog_path)
+    print("Catalogued {} trees in {}".format(len(all_stats), catalog_path))
+
+def _plain(v):
+    #sqlite takes Python ints and strings, not NumPy scalars
+    return v.item() if hasattr(v, 'item') else v
+
+def tree_members(tree):
+    #the IDs of every node in a tree (kTree or kTreeView)
+    if hasattr(tree, 'node_range'):
+        return tree.forest.person[tree.node_range()].tolist()
+    out = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        out.append(_plain(node.person))
+        stack.extend(node.children)
+    return out
+
+def _tree_blob(tree):
+    #a view of a one-tree kForest (what a ForestStore gives) is pickled as its arrays.
+    #any other kTreeView would pickle the whole kForest behind it, so it is made a kTree
+    if hasattr(tree, 'to_ktree') and not (len(tree.forest) == 1 and tree.idx == 0):
+        tree = tree.to_ktree()
+    return pickle.dumps(tree, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _catalog_row(k, tree, cur_stats):
+    key = _plain(k)
+    inner = cur_stats['nodes'] - cur_stats['leaves']
+    return (key, cur_stats['nodes'], cur_stats['leaves'], cur_stats['min_depth'], cur_stats['max_depth'],
+            len(cur_stats['fanout_hist']) - 1, (cur_stats['nodes'] - 1) / inner if inner else 0.0,
+            json.dumps(cur_stats['fanout_hist']), json.dumps(cur_stats['level_widths']),
+            _tree_blob(tree))
+
+class ForestCatalog:
+    '''
+    A catalog as the store of a spanning forest that changes: look up which tree someone is in,
+    load single trees, and write back the trees that changed, all without reading the rest of the forest.
+    Keys >= 0 are trees of the forest; keys < 0 are subtrees cut off by a manager cycle (see hierarchy_delta.py).
+    '''
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        self.conn = sqlite3.connect(catalog_path)
+        has_members = self.conn.execute("SELECT name FROM sqlite_master WHERE name = 'members'").fetchone()
+        if has_members is None:
+            self.conn.close()
+            raise Exception("{} has no members table; rebuild it with build_catalog".format(catalog_path))
+
+    def key_of(self, p):
+        #key of the tree (or cut subtree) p is in, or None if p is in neither
+        row = self.conn.execute('SELECT key FROM members WHERE person = ?', (_plain(p),)).fetchone()
+        return row[0] if row is not None else None
+
+    def load(self, k):
+        if k >= 0:
+            row = self.conn.execute('SELECT tree FROM trees WHERE key = ?', (k,)).fetchone()
+        else:
+            row = self.conn.execute('SELECT tree FROM cut_trees WHERE key = ?', (k,)).fetchone()
+        if row is None:
+            raise Exception("Tree {} is not in the catalog {}".format(k, self.catalog_path))
+        tree = pickle.loads(row[0])
+        #trees are changed in place, so a view (see _tree_blob) is made a kTree
+        return tree.to_ktree() if hasattr(tree, 'to_ktree') else tree
+
+    def meta(self, name):
+        return self.conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()[0]
+
+    def save(self, trees, all_stats, cut_trees, removed_keys, members, gone, meta):
+        '''
+        In one transaction: delete the trees (and cut subtrees) in removed_keys and the people in gone,
+        write trees (key -> tree, with their tree_stats in all_stats) and cut_trees (negative key -> subtree),
+        set the key of the people in members (person -> key), and set the meta values.
+        Every other row is left alone.
+        '''
+        conn = self.conn
+        with conn:
+            for k in removed_keys:
+                conn.execute('DELETE FROM trees WHERE key = ?', (k,))
+                conn.execute('DELETE FROM cut_trees WHERE key = ?', (k,))
+            conn.executemany('INSERT OR REPLACE INTO trees VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (_catalog_row(k, trees[k], all_stats[k]) for k in trees))
+            conn.executemany('INSERT OR REPLACE INTO cut_trees VALUES (?, ?)',
+                             ((k, _tree_blob(cut_trees[k])) for k in cut_trees))
+            conn.executemany('DELETE FROM members WHERE person = ?', [(_plain(p),) for p in gone])
+            conn.executemany('INSERT OR REPLACE INTO members VALUES (?, ?)',
+                             ((_plain(p), members[p]) for p in members))
+            conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', list(meta.items()))
+
+    def close(self):
+        self.conn.close()
+
+def catalog_keys(catalog_path):
+    #keys of every tree in the catalog, in order
+    conn = sqlite3.connect(catalog_path)
+    try:
+        return [row[0] for row in conn.execute('SELECT key FROM trees ORDER BY key')]
+    finally:
+        conn.close()
+
+def _where_clause(where=None, **ranges):
+    #ranges are column=(lo, hi) (inclusive, either end may be None) or column=value
+    conds = []
+    params = []
+    for c in ranges:
+        if c not in catalog_cols:
+            raise Exception("Unknown catalog column {}, expected one of {}".format(c, catalog_cols))
+        bounds = ranges[c]
+        if not isinstance(bounds, tuple):
+            bounds = (bounds, bounds)
+        lo, hi = bounds
+        if lo is not None:
+            conds.append('{} >= ?'.format(c))
+            params.append(lo)
+        if hi is not None:
+            conds.append('{} <= ?'.format(c))
+            params.append(hi)
+    if where is not None:
+        conds.append('(' + where + ')')
+    clause = ' WHERE ' + ' AND '.join(conds) if conds else ''
+    return clause, params
+
+def find_trees(catalog_path, where=None, order_by=None, limit=None, **ranges):
+    '''
+    Statistics of the trees that match, without loading any tree. e.g., deep trees with 50-200 nodes:
+        find_trees('amazon_spanningforest_catalog.db', nodes=(50, 200), max_depth=(8, None))
+    where is an extra SQL condition over the catalog columns, e.g., 'leaves < nodes / 2'.
+    '''
+    clause, params = _where_clause(where=where, **ranges)
+    query = 'SELECT key, {}, fanout_hist, level_widths FROM trees'.format(', '.join(catalog_cols)) + clause
+    if order_by is not None:
+        query += ' ORDER BY ' + order_by
+    if limit is not None:
+        query += ' LIMIT {}'.format(int(limit))
+    conn = sqlite3.connect(catalog_path)
+    try:
+        return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+def load_trees(catalog_path, keys):
+    #the trees with the given keys (kTree, or kTreeView for a forest catalogued from a ForestStore), unpickling only those.
+    #unpickling creates one object per node, and the garbage collector would rescan them over and over
+    conn = sqlite3.connect(catalog_path)
+    out = {}
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for k in keys:
+            row = conn.execute('SELECT tree FROM trees WHERE key = ?', (k,)).fetchone()
+            if row is None:
+                raise Exception("Tree {} is not in the catalog {}".format(k, catalog_path))
+            out[k] = pickle.loads(row[0])
+    finally:
+        conn.close()
+        if gc_was_enabled:
+            gc.enable()
+    return out
+
+def select_trees(catalog_path, where=None, order_by=None, limit=None, **ranges):
+    #find_trees, then load_trees on what it found
+    found = find_trees(catalog_path, where=where, order_by=order_by, limit=limit, **ranges)
+    return load_trees(catalog_path, found['key'].tolist())
+
+if __name__=='__main__':
+    #catalog an existing spanning forest
+    from amazon_access import forest_stats
+    from kforest import load_forest
+
+    spanning_forest = load_forest('amazon_spanningforest.pkl')
+    build_catalog(spanning_forest, forest_stats(spanning_forest), catalog_path_for('amazon_spanningforest.pkl'))
+    print(find_trees(catalog_path_for('amazon_spanningforest.pkl'), nodes=(50, 200), max_depth=(8, None)))
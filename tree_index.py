@@ -0,0 +1,177 @@
+import numpy as np
+
+from kforest import kForest, kforest_from_ktrees, _to_value
+
+'''
+Purpose: constant-time ancestry queries over the spanning forest, for auditing
+privilege subsumption ("is role A above role B?") without searching the trees.
+
+Every node gets its pre-order position in the forest. A node's subtree is then the interval
+[pos, pos + size), so is_ancestor(a, b) is two comparisons. For the lowest common ancestor of u and v
+(pos[u] < pos[v]), the shallowest node in pre-order positions pos[u]+1..pos[v] is a child of the LCA,
+so LCA queries are one range-minimum lookup in a sparse table over depths.
+
+All queries take scalars or NumPy arrays of IDs, and run over whole arrays at once.
+'''
+
+class TreeIndex:
+    def __init__(self, forest : kForest):
+        n = len(forest.person)
+        n_roots = len(forest.keys_arr)
+        depth, tree = forest.node_depths()
+        parent = forest.parent.astype(np.int64)
+
+        #subtree sizes, bottom level first. children of a node are contiguous, so every level is one scatter-add
+        levels = forest.level_ranges()
+        size = np.ones(n, dtype=np.int64)
+        for lo, hi in levels[:0:-1]:
+            np.add.at(size, parent[lo:hi], size[lo:hi])
+
+        #pre-order positions, top level first: a node comes right after its parent,
+        #plus the subtree sizes of the siblings before it
+        pos = np.empty(n, dtype=np.int64)
+        pos[:n_roots] = np.cumsum(size[:n_roots]) - size[:n_roots]
+        for lo, hi in levels[1:]:
+            before = np.cumsum(size[lo:hi]) - size[lo:hi]
+            first_sibling = forest.child_ptr[parent[lo:hi]] - lo
+            pos[lo:hi] = pos[parent[lo:hi]] + 1 + before - before[first_sibling]
+
+        #everything below is indexed by pre-order position
+        self.ids = np.empty(n, dtype=forest.person.dtype)
+        self.ids[pos] = forest.person
+        self.depth = np.empty(n, dtype=np.int64)
+        self.depth[pos] = depth
+        self.size = np.empty(n, dtype=np.int64)
+        self.size[pos] = size
+        self.tree = np.empty(n, dtype=np.int64)
+        self.tree[pos] = tree
+        self.parent = np.full(n, -1, dtype=np.int64)
+        has_parent = parent >= 0
+        self.parent[pos[has_parent]] = pos[parent[has_parent]]
+        self.keys_arr = forest.keys_arr
+
+        self._build_lookup()
+        self._build_sparse_table()
+
+    @classmethod
+    def from_ktree(cls, tree):
+        return cls(kforest_from_ktrees({0 : tree}))
+
+    @classmethod
+    def from_ktrees(cls, forest):
+        #forest is a dictionary of kTree, or already a kForest
+        if isinstance(forest, kForest):
+            return cls(forest)
+        return cls(kforest_from_ktrees(forest))
+
+    def _build_lookup(self):
+        if self.ids.dtype == object:
+            self._id_pos = {p : i for i, p in enumerate(self.ids)}
+            return
+        self._order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._order]
+        if (self._sorted_ids[1:] == self._sorted_ids[:-1]).any():
+            raise Exception("IDs must be unique across the indexed forest")
+
+        #employee IDs are usually a compact range of integers, and then a direct lookup table
+        #beats a binary search per query by a wide margin
+        self._dense = None
+        n = len(self.ids)
+        if n and np.issubdtype(self.ids.dtype, np.integer) and self._sorted_ids[0] >= 0 \
+                and self._sorted_ids[-1] < 4 * n + 1024:
+            self._dense = np.full(int(self._sorted_ids[-1]) + 1, -1, dtype=np.int64)
+            self._dense[self.ids] = np.arange(n)
+
+    def _build_sparse_table(self):
+        #table[k][i] is the position of the shallowest node among positions i..i+2^k-1
+        n = len(self.ids)
+        self._log = np.zeros(n + 1, dtype=np.int64)
+        if n > 1:
+            self._log[2:] = np.floor(np.log2(np.arange(2, n + 1))).astype(np.int64)
+        n_levels = int(self._log[n]) + 1 if n else 1
+        table = np.empty((n_levels, n), dtype=np.int32 if n < np.iinfo(np.int32).max else np.int64)
+        table[0] = np.arange(n)
+        for k in range(1, n_levels):
+            half = 1 << (k - 1)
+            left = table[k - 1, :n - half]
+            right = table[k - 1, half:]
+            table[k, :n - half] = np.where(self.depth[right] < self.depth[left], right, left)
+            table[k, n - half:] = table[k - 1, n - half:]
+        self._table = table
+
+    def is_scalar(self, query):
+        #relabelled trees use (title, description) tuples as IDs, so a tuple is one ID there
+        return np.ndim(query) == 0 or (self.ids.dtype == object and isinstance(query, tuple))
+
+    def positions(self, ids):
+        #pre-order positions of ids (scalar or array). unknown IDs raise a KeyError naming them
+        if self.ids.dtype == object:
+            id_lst = [ids] if self.is_scalar(ids) else list(ids)
+            missing = [p for p in id_lst if p not in self._id_pos]
+            if missing:
+                raise KeyError("IDs not in the index: {}".format(missing[:10]))
+            found = np.array([self._id_pos[p] for p in id_lst], dtype=np.int64)
+            return found[0] if self.is_scalar(ids) else found
+        ids = np.asarray(ids)
+        if self._dense is not None and np.issubdtype(ids.dtype, np.integer):
+            in_range = (ids >= 0) & (ids < len(self._dense))
+            found = np.where(in_range, self._dense[np.where(in_range, ids, 0)], -1)
+            if np.any(found < 0):
+                raise KeyError("IDs not in the index: {}".format(ids[found < 0].ravel()[:10].tolist()))
+            return found
+        found = np.searchsorted(self._sorted_ids, ids)
+        found = np.minimum(found, len(self._sorted_ids) - 1)
+        bad = self._sorted_ids[found] != ids
+        if np.any(bad):
+            raise KeyError("IDs not in the index: {}".format(ids[bad].ravel()[:10].tolist()))
+        return self._order[found]
+
+    def _shallowest(self, lo, hi):
+        #position of the minimum-depth node in lo..hi (inclusive), per element
+        k = self._log[hi - lo + 1]
+        left = self._table[k, lo]
+        right = self._table[k, hi - (1 << k) + 1]
+        return np.where(self.depth[right] < self.depth[left], right, left)
+
+    def depth_of(self, x):
+        #depth of x, with roots at depth 1 like kTree.max_depth
+        return self._unwrap(x, self.depth[self.positions(x)])
+
+    def same_tree(self, a, b):
+        return self._unwrap(a, self.tree[self.positions(a)] == self.tree[self.positions(b)])
+
+    def is_ancestor(self, a, b, strict=True):
+        #whether a is above b. with strict=False, every node also counts as its own ancestor
+        pa = self.positions(a)
+        pb = self.positions(b)
+        res = (pa <= pb) & (pb < pa + self.size[pa])
+        if strict:
+            res &= pa != pb
+        return self._unwrap(a, res)
+
+    def lca(self, a, b, missing=-1):
+        #lowest common ancestor IDs. pairs in different trees get missing (None for a scalar query)
+        pa = np.atleast_1d(self.positions(a))
+        pb = np.atleast_1d(self.positions(b))
+        lo = np.minimum(pa, pb)
+        hi = np.maximum(pa, pb)
+        same = self.tree[lo] == self.tree[hi]
+
+        res = lo.copy()
+        differ = same & (lo != hi)
+        res[differ] = self.parent[self._shallowest(lo[differ] + 1, hi[differ])]
+
+        if self.is_scalar(a):
+            return _to_value(self.ids[res[0]]) if same[0] else None
+        out = self.ids[res]
+        if self.ids.dtype == object:
+            out[~same] = None
+        else:
+            out[~same] = missing
+        return out
+
+    def _unwrap(self, query, res):
+        #scalar in, scalar out
+        if self.is_scalar(query):
+            return np.asarray(res).item()
+        return res